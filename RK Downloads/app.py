@@ -1,57 +1,168 @@
-from flask import Flask, request, render_template, jsonify, send_file, url_for
+from flask import Flask, request, render_template, jsonify, send_file, url_for, Response, abort
 import os
-import tempfile
-import threading
+import mimetypes
 import requests
+import hmac
+import itertools
 import json
 import re
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
 from datetime import datetime
-import yt_dlp
-import instaloader
+from urllib.parse import parse_qs, quote, urlsplit
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
-import zipfile
-import shutil
+from werkzeug.security import safe_join
+from artifacts import ArtifactStore
+from bandwidth import BandwidthGovernor, PRIORITY_WEIGHTS
+from cache import InfoCache, SingleFlight
+from engine import DownloadEngine
+from instagram import InstagramEngine
+from jobs import JobManager, JobQueueClient, QueueFullError
+from jobstore import JobStore
+from lazy import LazyModule
+from listing import DownloadIndex
+from metrics import Metrics
+from pools import YoutubeDLPool
+from postprocess import PostProcessStage
+from router import UrlRouter
+from storage import StorageManager
+from store import ContentStore
+from syncstate import SyncState
+from zipstream import iter_zip
+
+# Heavy imports are deferred until the first download or extraction needs them
+yt_dlp = LazyModule('yt_dlp')
+instaloader = LazyModule('instaloader')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-this'
+# Download worker pool sizing (and parallel downloads within one playlist job)
+app.config['MAX_WORKERS'] = int(os.environ.get('RK_MAX_WORKERS', 4))
+app.config['QUEUE_DEPTH'] = int(os.environ.get('RK_QUEUE_DEPTH', 50))
+app.config['PLAYLIST_PARALLELISM'] = int(os.environ.get('RK_PLAYLIST_PARALLELISM', 4))
+# 'inline' runs downloads in the web process; 'external' only enqueues them for
+# separate `python app.py worker` processes sharing the job database
+app.config['WORKER_MODE'] = os.environ.get('RK_WORKER_MODE', 'inline')
+app.config['WORKER_POLL_INTERVAL'] = float(os.environ.get('RK_WORKER_POLL_INTERVAL', 1.0))
+# Seconds without a heartbeat after which another process (worker, or web
+# process in inline mode) takes over the jobs of a process that went away
+app.config['WORKER_STALE_AFTER'] = int(os.environ.get('RK_WORKER_STALE_AFTER', 60))
+# Concurrent jobs allowed per platform (as returned by detect_platform)
+app.config['PLATFORM_CONCURRENCY'] = int(os.environ.get('RK_PLATFORM_CONCURRENCY', 2))
+app.config['PLATFORM_CONCURRENCY_OVERRIDES'] = {
+    'instagram': 1,  # Instagram rate-limits anonymous sessions aggressively
+    'unknown': app.config['MAX_WORKERS'],
+}
+# File serving: X-Sendfile (Apache/lighttpd) or X-Accel-Redirect (nginx) hand-off
+app.config['USE_X_SENDFILE'] = os.environ.get('RK_X_SENDFILE') == '1'
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('RK_ACCEL_REDIRECT_PREFIX', '')
+# Extracted metadata cache shared by /get-formats and downloads
+app.config['INFO_CACHE_SIZE'] = int(os.environ.get('RK_INFO_CACHE_SIZE', 256))
+app.config['INFO_CACHE_TTL'] = int(os.environ.get('RK_INFO_CACHE_TTL', 600))
+app.config['INFO_CACHE_MB'] = int(os.environ.get('RK_INFO_CACHE_MB', 64))
+# Reusable YoutubeDL/Instaloader instances: idle ones kept per option profile,
+# and how many to build at startup (0 to skip prewarming)
+app.config['POOL_MAX_IDLE'] = int(os.environ.get('RK_POOL_MAX_IDLE', 4))
+app.config['PREWARM_INSTANCES'] = int(os.environ.get('RK_PREWARM_INSTANCES', 1))
+# Concurrent ffmpeg post-processing tasks (merges, remuxes); defaults to the CPU count
+app.config['POSTPROCESS_WORKERS'] = int(os.environ.get('RK_POSTPROCESS_WORKERS', 0)) or None
+# Instagram: optional account whose session file is reused across jobs and
+# restarts, a request budget shared by all Instagram jobs of a process, and
+# how many media files to fetch in parallel
+app.config['INSTAGRAM_USERNAME'] = os.environ.get('RK_INSTAGRAM_USERNAME')
+app.config['INSTAGRAM_PASSWORD'] = os.environ.get('RK_INSTAGRAM_PASSWORD')
+app.config['INSTAGRAM_RATE'] = float(os.environ.get('RK_INSTAGRAM_RATE', 0.2))  # queries per second
+app.config['INSTAGRAM_BURST'] = int(os.environ.get('RK_INSTAGRAM_BURST', 10))
+app.config['INSTAGRAM_MEDIA_PARALLELISM'] = int(os.environ.get('RK_INSTAGRAM_MEDIA_PARALLELISM', 4))
+# Download bandwidth cap per process in bytes per second (0 for none), shared
+# between running jobs by priority; adjustable at runtime via /admin/bandwidth
+app.config['BANDWIDTH_LIMIT'] = int(os.environ.get('RK_BANDWIDTH_LIMIT', 0))
+# Languages whose automatic captions are offered as subtitle artifacts
+app.config['CAPTION_LANGS'] = os.environ.get('RK_CAPTION_LANGS', 'en').split(',')
+# Disk quota for the downloads directory in MB (0 for none): above the high
+# watermark, least recently used job folders are deleted until usage is under
+# the low one; folders of unfinished jobs and ongoing transfers are kept
+app.config['STORAGE_QUOTA_MB'] = int(os.environ.get('RK_STORAGE_QUOTA_MB', 0))
+app.config['STORAGE_HIGH_WATERMARK'] = float(os.environ.get('RK_STORAGE_HIGH_WATERMARK', 0.9))
+app.config['STORAGE_LOW_WATERMARK'] = float(os.environ.get('RK_STORAGE_LOW_WATERMARK', 0.75))
+app.config['STORAGE_CHECK_INTERVAL'] = int(os.environ.get('RK_STORAGE_CHECK_INTERVAL', 60))
+# Folders downloaded or accessed more recently than this many seconds are never evicted
+app.config['STORAGE_MIN_AGE'] = int(os.environ.get('RK_STORAGE_MIN_AGE', 300))
+# External downloader for yt-dlp downloads (e.g. aria2c), used if installed;
+# the native downloader otherwise
+app.config['EXTERNAL_DOWNLOADER'] = os.environ.get('RK_EXTERNAL_DOWNLOADER')
+# JSON Lines file that receives the phase timeline of every finished job, if set
+app.config['TRACE_FILE'] = os.environ.get('RK_TRACE_FILE')
+# Token required in the X-Admin-Token header of /admin endpoints; without one
+# they only answer requests from this machine
+app.config['ADMIN_TOKEN'] = os.environ.get('RK_ADMIN_TOKEN')
 
 # Create downloads directory if it doesn't exist
 DOWNLOAD_DIR = os.path.join(os.getcwd(), 'downloads')
 if not os.path.exists(DOWNLOAD_DIR):
     os.makedirs(DOWNLOAD_DIR)
 
+# Internal state (content store, ...) lives next to the downloads directory so
+# job folders can hardlink into it
+DATA_DIR = os.path.join(os.getcwd(), 'data')
+
 class UniversalDownloader:
-    def __init__(self):
+    # Download method per platform; other platforms go through download_generic_content
+    PLATFORM_HANDLERS = {
+        'youtube': 'download_youtube_content',
+        'instagram': 'download_instagram_content',
+        'tiktok': 'download_tiktok_content',
+        'twitter': 'download_twitter_content',
+        'facebook': 'download_facebook_content',
+        'reddit': 'download_reddit_content',
+    }
+
+    # Platforms whose channels/playlists/profiles can be synced incrementally
+    SYNC_PLATFORMS = ('youtube', 'instagram')
+
+    # Options for metadata-only extraction (/get-formats and the info cache)
+    EXTRACT_OPTIONS = {'quiet': True, 'no_warnings': True}
+
+    # Extractors instantiated on pooled instances at startup
+    PREWARM_EXTRACTORS = ('Youtube', 'YoutubeTab', 'Instagram', 'TikTok', 'Twitter', 'Facebook', 'Reddit', 'Generic')
+
+    def __init__(self, info_cache=None, store=None, playlist_parallelism=4, router=None, pool_max_idle=4, instagram=None,
+                 postprocessing=None, artifacts=None, metrics=None, engine=None, entry_slots=None):
+        self.router = router or UrlRouter()
+        self.metrics = metrics or Metrics()
+        self.engine = engine or DownloadEngine()
+        self.ydl_pool = YoutubeDLPool(max_idle=pool_max_idle)
+        self.postprocessing = postprocessing or PostProcessStage()
+        self.instagram = instagram or InstagramEngine(os.path.join(DATA_DIR, 'instagram'), pool_max_idle=pool_max_idle)
+        self.sync_state = SyncState(os.path.join(DATA_DIR, 'sync'))
+        self.info_cache = info_cache or InfoCache()
+        self.playlist_parallelism = playlist_parallelism
+        # entry_slots(platform) gives the running job's SlotGroup, so playlist
+        # entries count against the job manager's worker and platform caps
+        self.entry_slots = entry_slots
+        self.extractions = SingleFlight()
+        self.store = store or ContentStore(os.path.join(DATA_DIR, 'store'))
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+        self.artifacts = artifacts or ArtifactStore(os.path.join(DATA_DIR, 'artifacts'), self.session)
         
+    def prewarm(self, count=1):
+        """Load yt-dlp and build pooled instances before the first request needs them"""
+        self.router.extractors
+        self.ydl_pool.prewarm(self.EXTRACT_OPTIONS, count)
+        self.ydl_pool.warm_extractors(self.EXTRACT_OPTIONS, self.PREWARM_EXTRACTORS)
+
     def detect_platform(self, url):
-        """Detect the platform from URL"""
-        url = url.lower()
-        if 'youtube.com' in url or 'youtu.be' in url:
-            return 'youtube'
-        elif 'instagram.com' in url:
-            return 'instagram'
-        elif 'facebook.com' in url or 'fb.watch' in url:
-            return 'facebook'
-        elif 'twitter.com' in url or 'x.com' in url:
-            return 'twitter'
-        elif 'tiktok.com' in url:
-            return 'tiktok'
-        elif 'pinterest.com' in url:
-            return 'pinterest'
-        elif 'linkedin.com' in url:
-            return 'linkedin'
-        elif 'snapchat.com' in url:
-            return 'snapchat'
-        elif 'reddit.com' in url:
-            return 'reddit'
-        elif 'twitch.tv' in url:
-            return 'twitch'
-        else:
-            return 'unknown'
+        """Detect the platform from the URL's hostname"""
+        return self.router.route(url).platform
     
     def create_safe_filename(self, filename, max_length=100):
         """Create a safe filename"""
@@ -61,30 +172,295 @@ class UniversalDownloader:
         if len(filename) > max_length:
             filename = filename[:max_length]
         return filename
-    
-    def download_youtube_content(self, url, path, quality=None):
-        """Download YouTube videos, shorts, playlists"""
+
+    def canonical_url(self, url):
+        """Normalize a URL into a stable cache key (and the URL we actually download)"""
+        return self.router.route(url).url
+
+    def ie_key(self, url):
+        """yt-dlp extractor known to handle url, so extract_info can skip scanning all of them"""
+        return self.router.route(url).ie_key
+
+    def cache_info(self, url, info):
+        """Store a single-video info dict so later requests can skip extraction, and record its artifacts"""
+        if info and info.get('_type', 'video') == 'video':
+            info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+            self.info_cache.put(self.canonical_url(url), info)
+            self.artifacts.record_info(info)
+
+    def job_key(self, url, quality=None, sync=False):
+        """Key under which identical download requests are coalesced"""
+        return f'{self.canonical_url(url)}|{quality or ""}' + ('|sync' if sync else '')
+
+    def extract_info(self, url):
+        """Extract metadata without downloading, going through the info cache.
+
+        Concurrent calls for the same URL share one extraction, so treat the
+        returned dict as read-only.
+        """
+        key = self.canonical_url(url)
+        info = self.info_cache.get(key)
+        if info is None:
+            info = self.extractions.do(key, lambda: self._extract_info(url))
+        return info
+
+    def progressive_format(self, info, format_id=None):
+        """The requested format, or the best one, that is a single file with both video and audio over HTTP"""
+        formats = info.get('formats') or [info]
+        candidates = [
+            fmt for fmt in formats
+            if fmt.get('url') and fmt.get('protocol', 'https') in ('http', 'https') and not fmt.get('fragments')
+            and fmt.get('vcodec') != 'none' and fmt.get('acodec') != 'none'
+        ]
+        if format_id:
+            candidates = [fmt for fmt in candidates if fmt.get('format_id') == format_id]
+        # yt-dlp sorts formats from worst to best
+        return candidates[-1] if candidates else None
+
+    def open_stream(self, url, format_id=None, byte_range=None):
+        """Open a progressive format of url at its source; returns (response, info, format).
+
+        Raises ValueError if url has no such format.
+        """
+        for attempt in range(2):
+            info = self.extract_info(url)
+            fmt = self.progressive_format(info, format_id)
+            if fmt is None:
+                raise ValueError(f'Format {format_id} is not a single progressive file' if format_id
+                                 else 'No single-file format with both video and audio to stream')
+            headers = dict(fmt.get('http_headers') or {}, **{'Accept-Encoding': 'identity'})
+            if byte_range:
+                headers['Range'] = byte_range
+            resp = self.session.get(fmt['url'], headers=headers, stream=True, timeout=(10, 60))
+            if resp.status_code in (401, 403, 410) and attempt == 0:
+                # Signed media URLs in cached metadata expire; extract them again
+                resp.close()
+                self.info_cache.discard(self.canonical_url(url))
+                continue
+            if resp.status_code >= 400 and resp.status_code != 416:
+                resp.close()
+                resp.raise_for_status()
+            return resp, info, fmt
+
+    def artifact_manifest(self, url):
+        """Artifacts recorded for the media at url, extracting it if it was never seen"""
+        identity = self.media_identity(url)
+        manifest = self.artifacts.manifest(self.artifacts.key(*identity)) if identity else None
+        if manifest is None:
+            info = self.extract_info(url)
+            if info.get('_type', 'video') != 'video':
+                raise ValueError('Artifacts are available for single videos and posts only')
+            manifest = self.artifacts.record_info(info)
+            if manifest is None:
+                raise ValueError('Could not identify the media at this URL')
+        return manifest
+
+    def fetch_artifact(self, url, kind, lang=None, ext=None):
+        """Path of a cached artifact of the media at url, fetching it on first use"""
+        manifest = self.artifact_manifest(url)
         try:
-            # Set format based on quality selection
-            if quality:
-                format_str = quality
+            return self.artifacts.fetch(manifest, kind, lang, ext)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (403, 404, 410):
+                raise
+        # Recorded subtitle and thumbnail URLs may have expired; extract them again
+        self.info_cache.discard(self.canonical_url(url))
+        manifest = self.artifacts.record_info(self.extract_info(url)) or manifest
+        return self.artifacts.fetch(manifest, kind, lang, ext)
+
+    def record_instagram_artifacts(self, item):
+        """Record the thumbnail and metadata JSON of an Instagram post or story item"""
+        self.artifacts.record(
+            self.artifacts.key('Instagram', item.shortcode),
+            title=item.caption[:100] if getattr(item, 'caption', None) else item.shortcode,
+            thumbnails=[{'url': item.url}],
+            metadata=instaloader.get_json_structure(item)
+        )
+
+    def _extract_info(self, url):
+        with self.ydl_pool.borrow(self.EXTRACT_OPTIONS) as ydl:
+            info = ydl.extract_info(url, download=False, ie_key=self.ie_key(url))
+        self.cache_info(url, info)
+        return info
+
+    def media_identity(self, url, info=None):
+        """Return (extractor_key, video_id) for url without network access, if known.
+
+        Hosts the router does not know are only identified by extracted info:
+        matching them against every yt-dlp extractor costs more than it saves.
+        """
+        if info and info.get('extractor_key') and info.get('id'):
+            return info['extractor_key'], info['id']
+        ie_key = self.ie_key(url)
+        if ie_key:
+            video_id = yt_dlp.extractor.get_info_extractor(ie_key).get_temp_id(url)
+            return (ie_key, video_id) if video_id else None
+        return None
+
+    def run_ydl(self, ydl, url, path, progress_hook=None):
+        """Download url with ydl into path and wait for its post-processing.
+
+        Waiting for the post-processing stage is reported as the 'postprocess'
+        phase, which hands the job's worker slot to the next queued job.
+        """
+        info, postprocessing = self.start_ydl(ydl, url, path)
+        if postprocessing:
+            self.report_progress(progress_hook, phase='postprocess', message='Waiting for post-processing...')
+            postprocessing.result()
+        return info
+
+    def start_ydl(self, ydl, url, path, then=None):
+        """Download url with ydl into path, reusing stored files or cached metadata when possible.
+
+        yt-dlp's post-processing is handed to the post-processing stage.
+        Returns (info, future), where future is None if there was nothing to
+        post-process and otherwise resolves once the files are final and
+        then(info, error) ran; ydl must stay checked out until then. then may
+        also run before start_ydl returns, e.g. for a content store hit.
+        """
+        def finish(error):
+            if error is None:
+                self.store_download(result, format_spec)
+            if then:
+                then(result, error)
+
+        # If /get-formats is extracting this URL right now, wait and use its result
+        self.extractions.wait(self.canonical_url(url))
+        info = self.info_cache.get(self.canonical_url(url))
+        format_spec = ydl.params.get('format') or 'best'
+
+        # Already downloaded in this format: link the stored files, no network I/O
+        identity = self.media_identity(url, info)
+        if identity:
+            manifest = self.store.lookup(self.store.key(*identity, format_spec))
+            if manifest:
+                with self.metrics.store_seconds.time(operation='materialize'):
+                    self.store.materialize(manifest, path)
+                stored = dict(manifest['info'], from_store=True)
+                if then:
+                    then(stored, None)
+                return stored, None
+
+        result = None
+        with self.postprocessing.deferring(ydl) as calls:
+            if info is not None:
+                ydl._download_retcode = 0
+                try:
+                    result = ydl.process_ie_result(info, download=True)
+                except yt_dlp.utils.DownloadError:
+                    pass
+                if ydl._download_retcode:
+                    # With ignoreerrors (YouTube) a failed download is only logged, not raised
+                    result = None
+                if result is None:
+                    # Cached media URLs may have been rejected; fall back to a fresh extraction
+                    self.info_cache.discard(self.canonical_url(url))
+                    del calls[:]
+            if result is None:
+                result = ydl.extract_info(url, download=True, ie_key=self.ie_key(url))
+                self.cache_info(url, result)
+        if not calls:
+            finish(None)
+            return result, None
+        return result, self.postprocessing.submit(ydl, calls, then=finish)
+
+    def downloaded_files(self, info):
+        """Final paths of the media and subtitle files yt-dlp wrote for info"""
+        paths = [download.get('filepath') for download in info.get('requested_downloads') or []]
+        paths += [subtitle.get('filepath') for subtitle in (info.get('requested_subtitles') or {}).values()]
+        return [path for path in paths if path]
+
+    def store_download(self, info, format_spec):
+        """Add a finished single-video download to the content store"""
+        if not info or info.get('_type', 'video') != 'video' or not info.get('id'):
+            return
+        keys = {self.store.key(info['extractor_key'], info['id'], format_spec)}
+        if info.get('format_id'):
+            keys.add(self.store.key(info['extractor_key'], info['id'], info['format_id']))
+        summary = {field: info[field] for field in (
+            'id', 'title', 'uploader', 'extractor', 'extractor_key', 'format_id', 'ext', '_type'
+        ) if info.get(field) is not None}
+        try:
+            with self.metrics.store_seconds.time(operation='ingest'):
+                self.store.ingest(sorted(keys), self.downloaded_files(info), summary)
+        except OSError:
+            # The store is only an optimization; keep the plain job folder if linking fails
+            pass
+
+    def report_progress(self, progress_hook, **fields):
+        """Send a progress update to the caller, if it asked for one"""
+        if progress_hook:
+            progress_hook(**fields)
+
+    def ydl_progress_hooks(self, progress_hook, lease=None, min_interval=0.25):
+        """Translate yt-dlp progress and postprocessor events into progress updates, metering a bandwidth lease"""
+        hooks = {'progress_hooks': [], 'postprocessor_hooks': []}
+        if lease:
+            # The lease counts the job's bytes and paces the threads that download them
+            hooks['progress_hooks'].append(lease.ydl_progress_hook)
+            hooks['bandwidth_lease'] = lease
+        if not progress_hook:
+            return hooks
+        last_report = {'time': 0}
+
+        def on_progress(d):
+            total = int(d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+            downloaded = int(d.get('downloaded_bytes') or 0)
+            filename = os.path.basename(d.get('filename') or '')
+            if d['status'] == 'downloading':
+                # yt-dlp calls this for every chunk, so throttle what we pass on
+                now = time.time()
+                if now - last_report['time'] < min_interval:
+                    return
+                last_report['time'] = now
+                percent = round(downloaded * 100 / total, 1) if total else 0
+                progress_hook(
+                    phase='download',
+                    progress=percent,
+                    downloaded_bytes=downloaded,
+                    total_bytes=total,
+                    speed=d.get('speed'),
+                    eta=d.get('eta'),
+                    filename=filename,
+                    message=f'Downloading... {percent}%' if total else 'Downloading...'
+                )
+            elif d['status'] == 'finished':
+                progress_hook(
+                    phase='download',
+                    progress=100,
+                    downloaded_bytes=downloaded or total,
+                    total_bytes=total or downloaded,
+                    speed=None,
+                    eta=None,
+                    filename=filename,
+                    message=f'Downloaded {filename}'
+                )
+
+        def on_postprocess(d):
+            if d['status'] != 'started':
+                return
+            if d.get('postprocessor') == 'Merger':
+                progress_hook(phase='merge', message='Merging video and audio...')
             else:
-                format_str = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-
-            ydl_opts = {
-                'outtmpl': os.path.join(path, '%(uploader)s - %(title)s.%(ext)s'),
-                'format': format_str,
-                'writesubtitles': True,
-                'writeautomaticsub': True,
-                'subtitleslangs': ['en'],
-                'ignoreerrors': True,
-                'no_warnings': False,
-                'extract_flat': False,
-                'http_chunk_size': 10485760,  # 10MB chunks
-            }
+                progress_hook(phase='postprocess', message=f'Post-processing ({d.get("postprocessor")})...')
+
+        hooks['progress_hooks'].append(on_progress)
+        hooks['postprocessor_hooks'].append(on_postprocess)
+        return hooks
+
+    def download_youtube_content(self, url, path, quality=None, progress_hook=None, sync=False, lease=None):
+        """Download YouTube videos, shorts, playlists"""
+        try:
+            ydl_opts = self.engine.options('youtube', path, quality)
+
+            if self.is_playlist_url(url):
+                return self.download_youtube_playlist(url, path, ydl_opts, progress_hook, sync=sync, lease=lease)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            ydl_opts = self.engine.with_hooks(ydl_opts, self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
+
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
 
                 if 'entries' in info:  # Playlist
                     titles = [entry.get('title', 'Unknown') for entry in info['entries'] if entry]
@@ -105,89 +481,261 @@ class UniversalDownloader:
         except Exception as e:
             return {'status': 'error', 'message': f'YouTube error: {str(e)}'}
     
-    def download_instagram_content(self, url, path):
+    def is_playlist_url(self, url):
+        """Whether a YouTube URL points at a playlist or channel rather than a single video"""
+        parts = urlsplit(url)
+        if 'list' in parse_qs(parts.query):
+            return True
+        return parts.path.startswith(('/playlist', '/channel/', '/c/', '/user/', '/@'))
+
+    def download_youtube_playlist(self, url, path, ydl_opts, progress_hook=None, sync=False, lease=None):
+        """Flat-extract a playlist once, then download its entries in parallel.
+
+        In sync mode only entries missing from the source's download archive
+        are listed and downloaded, and finished ones are added to it.
+        """
+        source = f'youtube:{self.canonical_url(url)}'
+        self.report_progress(progress_hook, phase='extract', message='Listing playlist entries...')
+        if sync:
+            flat_entries = self.new_playlist_entries(url, self.sync_state.archived_ids(source))
+        else:
+            with self.ydl_pool.borrow(dict(self.EXTRACT_OPTIONS, extract_flat='in_playlist')) as ydl:
+                playlist = ydl.extract_info(url, download=False, ie_key=self.ie_key(url))
+            flat_entries = [entry for entry in playlist.get('entries') or [] if entry]
+
+        entries = [{
+            'index': index,
+            'id': entry.get('id'),
+            'title': entry.get('title') or entry.get('id') or 'Unknown',
+            'url': entry.get('url') or entry.get('webpage_url'),
+            'status': 'pending'
+        } for index, entry in enumerate(flat_entries, start=1)]
+        archive_ids = [self.archive_id(entry) for entry in flat_entries]
+        if not entries and sync:
+            self.sync_state.update(source, platform='youtube', url=url, new_items=0)
+            return {'status': 'success', 'message': 'No new videos since the last sync', 'new': 0, 'type': 'playlist'}
+        if not entries:
+            return {'status': 'error', 'message': 'YouTube error: playlist has no entries'}
+
+        lock = threading.Lock()
+        slots = self.entry_slots('youtube') if self.entry_slots else None
+        entry_opts = self.engine.with_hooks(dict(ydl_opts, noplaylist=True), self.ydl_progress_hooks(None, lease))
+
+        def report():
+            with lock:
+                finished = [entry for entry in entries if entry['status'] in ('completed', 'skipped', 'failed')]
+                failed = sum(1 for entry in finished if entry['status'] == 'failed')
+                self.report_progress(
+                    progress_hook,
+                    phase='download',
+                    entries=[dict(entry) for entry in entries],
+                    progress=round(len(finished) * 100 / len(entries), 1),
+                    message=f'Downloaded {len(finished)} of {len(entries)} videos' + (f' ({failed} failed)' if failed else '')
+                )
+
+        def finish_entry(entry, info, error=None):
+            if error is not None:
+                entry['status'] = 'failed'
+                entry['error'] = str(error)
+            elif not info:
+                entry['status'] = 'failed'
+            else:
+                # Entries already in the content store are linked in, not downloaded
+                entry['status'] = 'skipped' if info.get('from_store') else 'completed'
+                entry['title'] = info.get('title', entry['title'])
+                if sync:
+                    self.sync_state.add_to_archive(source, [archive_ids[entry['index'] - 1]])
+            report()
+
+        def download_entry(entry):
+            with slots.slot() if slots else nullcontext():
+                return start_entry(entry)
+
+        def start_entry(entry):
+            entry['status'] = 'running'
+            report()
+            profile, ydl = self.ydl_pool.checkout(entry_opts)
+
+            def after_postprocessing(info, error):
+                self.ydl_pool.checkin(profile, ydl)
+                finish_entry(entry, info, error)
+
+            try:
+                info, postprocessing = self.start_ydl(ydl, entry['url'], path, then=after_postprocessing)
+            except Exception as e:
+                after_postprocessing(None, e)
+                return None
+            if postprocessing:
+                # The merge runs on the post-processing stage while this thread takes the next entry
+                entry['status'] = 'postprocessing'
+                report()
+            return postprocessing
+
+        with ThreadPoolExecutor(max_workers=self.playlist_parallelism) as pool:
+            postprocessing = [future for future in pool.map(download_entry, entries) if future]
+        if postprocessing:
+            self.report_progress(progress_hook, phase='postprocess', message='Waiting for post-processing...')
+            wait(postprocessing)
+
+        succeeded = [entry for entry in entries if entry['status'] != 'failed']
+        if sync:
+            self.sync_state.update(source, platform='youtube', url=url, new_items=len(succeeded),
+                                   latest_id=entries[0]['id'])
+        if not succeeded:
+            return {'status': 'error', 'message': f'YouTube error: all {len(entries)} playlist entries failed'}
+        return {
+            'status': 'success',
+            'message': f'Downloaded {len(succeeded)} of {len(entries)} videos from playlist',
+            'titles': [entry['title'] for entry in succeeded[:5]],  # Show first 5 titles
+            'downloaded': sum(1 for entry in entries if entry['status'] == 'completed'),
+            'skipped': sum(1 for entry in entries if entry['status'] == 'skipped'),
+            'failed': len(entries) - len(succeeded),
+            'type': 'playlist'
+        }
+
+    def archive_id(self, entry):
+        """yt-dlp download-archive ID ('youtube <id>') of a flat playlist entry"""
+        return yt_dlp.utils.make_archive_id(entry.get('ie_key') or entry.get('extractor_key') or 'Youtube', entry.get('id'))
+
+    def new_playlist_entries(self, url, known_ids):
+        """Flat entries of a playlist or channel whose archive IDs are not in known_ids.
+
+        Entries are paged in lazily. Channel tabs list uploads newest first, so
+        listing a tab stops at its first known video instead of walking it all.
+        """
+        stop_early = urlsplit(url).path.startswith(('/channel/', '/c/', '/user/', '/@'))
+        entries = []
+
+        def walk(ydl, result, depth=0):
+            # Follow redirects (e.g. a channel URL to its videos tab) without processing them
+            while result and result.get('_type') in ('url', 'url_transparent') and depth < 3:
+                result = ydl.extract_info(result['url'], download=False, process=False, ie_key=result.get('ie_key'))
+                depth += 1
+            for entry in (result or {}).get('entries') or []:
+                if not entry:
+                    continue
+                if entry.get('_type') == 'playlist' or entry.get('ie_key') == 'YoutubeTab':
+                    # A channel page lists its tabs (videos, shorts, live) as nested playlists
+                    walk(ydl, entry, depth + 1)
+                elif self.archive_id(entry) in known_ids:
+                    if stop_early:
+                        break
+                else:
+                    entries.append(entry)
+
+        with self.ydl_pool.borrow(dict(self.EXTRACT_OPTIONS, extract_flat='in_playlist')) as ydl:
+            walk(ydl, ydl.extract_info(url, download=False, process=False, ie_key=self.ie_key(url)))
+        return entries
+
+    def download_instagram_content(self, url, path, quality=None, progress_hook=None, sync=False, lease=None):
         """Download Instagram posts, reels, stories, IGTV"""
         try:
-            loader = instaloader.Instaloader(
-                dirname_pattern=path,
-                filename_pattern='{profile}_{mediaid}_{date_utc}',
-                download_videos=True,
-                download_video_thumbnails=False,
-                download_geotags=False,
-                download_comments=False,
-                save_metadata=True,
-                compress_json=False
-            )
-            
-            # Handle different Instagram URL types
-            if '/stories/' in url:
-                # Story URL
-                username = self.extract_instagram_username(url)
-                if username:
-                    profile = instaloader.Profile.from_username(loader.context, username)
-                    for story in loader.get_stories([profile.userid]):
-                        for item in story.get_items():
-                            loader.download_storyitem(item, target=username)
-                    return {
-                        'status': 'success',
-                        'message': f'Instagram stories downloaded for {username}',
-                        'type': 'stories'
-                    }
-            elif '/reel/' in url or '/p/' in url or '/tv/' in url:
-                # Post, Reel, or IGTV
-                shortcode = self.extract_instagram_shortcode(url)
-                post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            self.report_progress(progress_hook, phase='extract', message='Fetching Instagram metadata...')
+            loader_options = {
+                'progress_hook': progress_hook,
+                'throttle': lease.consume if lease else None,
+                'dirname_pattern': path,
+                'filename_pattern': '{profile}_{mediaid}_{date_utc}',
+                'download_videos': True,
+                'download_video_thumbnails': False,
+                'download_geotags': False,
+                'download_comments': False,
+                # Metadata JSON is an artifact, fetched from /artifacts when asked for
+                'save_metadata': False,
+                'compress_json': False
+            }
+
+            # Media files are fetched in parallel and waited for when the block ends
+            with self.instagram.loader(loader_options) as loader:
+                # Handle different Instagram URL types
+                if '/stories/' in url:
+                    # Story URL
+                    username = self.extract_instagram_username(url)
+                    if username:
+                        profile = instaloader.Profile.from_username(loader.context, username)
+                        for story in loader.get_stories([profile.userid]):
+                            for item in story.get_items():
+                                loader.download_storyitem(item, target=username)
+                                self.record_instagram_artifacts(item)
+                        return {
+                            'status': 'success',
+                            'message': f'Instagram stories downloaded for {username}',
+                            'type': 'stories'
+                        }
+                    return {'status': 'error', 'message': 'Instagram error: no username in story URL'}
+                elif '/reel/' in url or '/p/' in url or '/tv/' in url:
+                    # Post, Reel, or IGTV
+                    shortcode = self.extract_instagram_shortcode(url)
+                    post = instaloader.Post.from_shortcode(loader.context, shortcode)
                 
-                loader.download_post(post, target=post.owner_username)
+                    loader.download_post(post, target=post.owner_username)
+                    self.record_instagram_artifacts(post)
                 
-                content_type = 'reel' if post.is_video else 'post'
-                if post.typename == 'GraphSidecar':
-                    content_type = 'carousel'
+                    content_type = 'reel' if post.is_video else 'post'
+                    if post.typename == 'GraphSidecar':
+                        content_type = 'carousel'
                 
-                return {
-                    'status': 'success',
-                    'message': f'Instagram {content_type} downloaded successfully!',
-                    'username': post.owner_username,
-                    'caption': post.caption[:100] + '...' if post.caption and len(post.caption) > 100 else post.caption,
-                    'type': content_type
-                }
+                    return {
+                        'status': 'success',
+                        'message': f'Instagram {content_type} downloaded successfully!',
+                        'username': post.owner_username,
+                        'caption': post.caption[:100] + '...' if post.caption and len(post.caption) > 100 else post.caption,
+                        'type': content_type
+                    }
+                else:
+                    # Profile URL - download recent posts, or in sync mode every post since the last sync
+                    username = self.extract_instagram_username(url)
+                    profile = instaloader.Profile.from_username(loader.context, username)
+                    source = f'instagram:{username.lower()}'
+                    since = self.sync_state.load(source).get('latest_date') if sync else None
+                    limit = 10 if since is None else None
+
+                    count = 0
+                    newest = None
+                    for post in profile.get_posts():
+                        if limit and count >= limit:  # Limit to 10 recent posts
+                            break
+                        if since is not None and post.date_utc.timestamp() <= since:
+                            if post.is_pinned:
+                                # Pinned posts are listed first even when they are older
+                                continue
+                            break
+                        loader.download_post(post, target=username)
+                        self.record_instagram_artifacts(post)
+                        count += 1
+                        if newest is None or post.date_utc > newest.date_utc:
+                            newest = post
+                        if limit:
+                            self.report_progress(progress_hook, progress=count * 100 // limit, message=f'Fetched {count} of {limit} posts')
+                        else:
+                            self.report_progress(progress_hook, message=f'Fetched {count} new posts')
+
+            # Profile downloads end here, once the loader has fetched every queued media file
+            if sync:
+                mark = {'latest_date': newest.date_utc.timestamp(), 'latest_shortcode': newest.shortcode} if newest else {}
+                self.sync_state.update(source, platform='instagram', url=url, new_items=count, **mark)
+            if sync and since is not None:
+                message = f'Synced {count} new posts from {username}' if count else f'No new posts from {username} since the last sync'
             else:
-                # Profile URL - download recent posts
-                username = self.extract_instagram_username(url)
-                profile = instaloader.Profile.from_username(loader.context, username)
-                
-                count = 0
-                for post in profile.get_posts():
-                    if count >= 10:  # Limit to 10 recent posts
-                        break
-                    loader.download_post(post, target=username)
-                    count += 1
-                
-                return {
-                    'status': 'success',
-                    'message': f'Downloaded {count} recent posts from {username}',
-                    'type': 'profile'
-                }
-                
+                message = f'Downloaded {count} recent posts from {username}'
+            return {
+                'status': 'success',
+                'message': message,
+                'new': count,
+                'type': 'profile'
+            }
+
         except Exception as e:
             return {'status': 'error', 'message': f'Instagram error: {str(e)}'}
     
-    def download_tiktok_content(self, url, path, quality=None):
+    def download_tiktok_content(self, url, path, quality=None, progress_hook=None, lease=None):
         """Download TikTok videos"""
         try:
-            # Set format based on quality selection
-            if quality:
-                format_str = quality
-            else:
-                format_str = 'best'
+            ydl_opts = self.engine.options('tiktok', path, quality, hooks=self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
 
-            ydl_opts = {
-                'outtmpl': os.path.join(path, 'TikTok_%(uploader)s_%(title)s.%(ext)s'),
-                'format': format_str,
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
                 return {
                     'status': 'success',
                     'message': 'TikTok video downloaded successfully!',
@@ -198,23 +746,14 @@ class UniversalDownloader:
         except Exception as e:
             return {'status': 'error', 'message': f'TikTok error: {str(e)}'}
     
-    def download_twitter_content(self, url, path, quality=None):
+    def download_twitter_content(self, url, path, quality=None, progress_hook=None, lease=None):
         """Download Twitter/X videos, images, threads"""
         try:
-            # Set format based on quality selection
-            if quality:
-                format_str = quality
-            else:
-                format_str = 'best'
+            ydl_opts = self.engine.options('twitter', path, quality, hooks=self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
 
-            ydl_opts = {
-                'outtmpl': os.path.join(path, 'Twitter_%(uploader)s_%(title)s.%(ext)s'),
-                'format': format_str,
-                'writesubtitles': True,
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
                 return {
                     'status': 'success',
                     'message': 'Twitter content downloaded successfully!',
@@ -225,22 +764,14 @@ class UniversalDownloader:
         except Exception as e:
             return {'status': 'error', 'message': f'Twitter error: {str(e)}'}
     
-    def download_facebook_content(self, url, path, quality=None):
+    def download_facebook_content(self, url, path, quality=None, progress_hook=None, lease=None):
         """Download Facebook videos, posts"""
         try:
-            # Set format based on quality selection
-            if quality:
-                format_str = quality
-            else:
-                format_str = 'best'
-
-            ydl_opts = {
-                'outtmpl': os.path.join(path, 'Facebook_%(title)s.%(ext)s'),
-                'format': format_str,
-            }
+            ydl_opts = self.engine.options('facebook', path, quality, hooks=self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
                 return {
                     'status': 'success',
                     'message': 'Facebook content downloaded successfully!',
@@ -250,22 +781,14 @@ class UniversalDownloader:
         except Exception as e:
             return {'status': 'error', 'message': f'Facebook error: {str(e)}'}
     
-    def download_reddit_content(self, url, path, quality=None):
+    def download_reddit_content(self, url, path, quality=None, progress_hook=None, lease=None):
         """Download Reddit videos, images, gifs"""
         try:
-            # Set format based on quality selection
-            if quality:
-                format_str = quality
-            else:
-                format_str = 'best'
-
-            ydl_opts = {
-                'outtmpl': os.path.join(path, 'Reddit_%(title)s.%(ext)s'),
-                'format': format_str,
-            }
+            ydl_opts = self.engine.options('reddit', path, quality, hooks=self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
                 return {
                     'status': 'success',
                     'message': 'Reddit content downloaded successfully!',
@@ -275,16 +798,14 @@ class UniversalDownloader:
         except Exception as e:
             return {'status': 'error', 'message': f'Reddit error: {str(e)}'}
     
-    def download_generic_content(self, url, path):
+    def download_generic_content(self, url, path, quality=None, progress_hook=None, lease=None):
         """Download from any supported platform using yt-dlp"""
         try:
-            ydl_opts = {
-                'outtmpl': os.path.join(path, '%(extractor)s_%(title)s.%(ext)s'),
-                'format': 'best',
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            ydl_opts = self.engine.options('generic', path, quality, hooks=self.ydl_progress_hooks(progress_hook, lease))
+            self.report_progress(progress_hook, phase='extract', message='Extracting media info...')
+
+            with self.ydl_pool.borrow(ydl_opts) as ydl:
+                info = self.run_ydl(ydl, url, path, progress_hook)
                 return {
                     'status': 'success',
                     'message': 'Content downloaded successfully!',
@@ -315,45 +836,216 @@ class UniversalDownloader:
             return match.group(1)
         return None
     
-    def download_content(self, url, custom_path=None, quality=None):
+    def sync_folder_name(self, url):
+        """Stable folder for a synced source, so each sync adds to the same place"""
+        route = self.router.route(url)
+        parts = urlsplit(route.url)
+        source = re.sub(r'[^A-Za-z0-9_-]+', '_', f'{parts.path}_{parts.query}').strip('_')
+        return f"{route.platform}_sync_{source[:80] or 'home'}"
+
+    def job_folder_name(self, platform, job_id=None):
+        """Timestamped folder name for a download (suffixed with the job id so
+        concurrent jobs started in the same second don't share a folder)"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f"{platform}_{timestamp}_{job_id}" if job_id else f"{platform}_{timestamp}"
+
+    def download_content(self, url, custom_path=None, quality=None, job_id=None, progress_hook=None, folder_name=None,
+                         sync=False, lease=None):
         """Main download function"""
         path = custom_path or DOWNLOAD_DIR
-        platform = self.detect_platform(url)
+        route = self.router.route(url)
+        if sync and route.platform not in self.SYNC_PLATFORMS:
+            return {'status': 'error', 'message': f'Sync mode is not supported for {route.platform} URLs'}
 
-        # Create timestamped folder for this download
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        download_folder = os.path.join(path, f"{platform}_{timestamp}")
+        # Create timestamped folder for this download, or reuse the given one
+        # so a resumed job continues its partial (.part) files
+        folder_name = folder_name or self.job_folder_name(route.platform, job_id)
+        download_folder = os.path.join(path, folder_name)
         os.makedirs(download_folder, exist_ok=True)
 
+        # Every handler reports its phases through the progress hook, which the trace times
+        trace = self.metrics.trace(route.platform, job_id, route.url)
+        progress_hook = trace.wrap(progress_hook)
         try:
-            if platform == 'youtube':
-                return self.download_youtube_content(url, download_folder, quality)
-            elif platform == 'instagram':
-                return self.download_instagram_content(url, download_folder)
-            elif platform == 'tiktok':
-                return self.download_tiktok_content(url, download_folder, quality)
-            elif platform == 'twitter':
-                return self.download_twitter_content(url, download_folder, quality)
-            elif platform == 'facebook':
-                return self.download_facebook_content(url, download_folder, quality)
-            elif platform == 'reddit':
-                return self.download_reddit_content(url, download_folder, quality)
+            handler = getattr(self, self.PLATFORM_HANDLERS.get(route.platform, 'download_generic_content'))
+            if sync:
+                result = handler(route.url, download_folder, quality, progress_hook=progress_hook, sync=True, lease=lease)
             else:
-                # Try generic download for other platforms
-                return self.download_generic_content(url, download_folder, quality)
+                result = handler(route.url, download_folder, quality, progress_hook=progress_hook, lease=lease)
+
+            # Let callers find (and link to) the job folder
+            result['folder'] = folder_name
 
         except Exception as e:
-            return {'status': 'error', 'message': f'Unexpected error: {str(e)}'}
+            result = {'status': 'error', 'message': f'Unexpected error: {str(e)}'}
+        # The lease counts every byte of the job, merged formats and playlist entries included
+        trace.finish(result, downloaded_bytes=lease.bytes if lease else None)
+        return result
 
-# Global progress tracking
-current_progress = {
-    'progress': 0,
-    'status': 'idle',
-    'filename': ''
-}
+# Per-platform, per-phase timings and counters served by /metrics
+metrics = Metrics(trace_path=app.config['TRACE_FILE'])
 
 # Initialize downloader
-downloader = UniversalDownloader()
+downloader = UniversalDownloader(
+    info_cache=InfoCache(
+        max_entries=app.config['INFO_CACHE_SIZE'],
+        ttl=app.config['INFO_CACHE_TTL'],
+        max_bytes=app.config['INFO_CACHE_MB'] * 1024 * 1024
+    ),
+    playlist_parallelism=app.config['PLAYLIST_PARALLELISM'],
+    pool_max_idle=app.config['POOL_MAX_IDLE'],
+    postprocessing=PostProcessStage(app.config['POSTPROCESS_WORKERS']),
+    artifacts=ArtifactStore(os.path.join(DATA_DIR, 'artifacts'), caption_langs=app.config['CAPTION_LANGS']),
+    metrics=metrics,
+    engine=DownloadEngine(external_downloader=app.config['EXTERNAL_DOWNLOADER']),
+    instagram=InstagramEngine(
+        os.path.join(DATA_DIR, 'instagram'),
+        username=app.config['INSTAGRAM_USERNAME'],
+        password=app.config['INSTAGRAM_PASSWORD'],
+        rate=app.config['INSTAGRAM_RATE'],
+        burst=app.config['INSTAGRAM_BURST'],
+        media_parallelism=app.config['INSTAGRAM_MEDIA_PARALLELISM'],
+        pool_max_idle=app.config['POOL_MAX_IDLE']
+    )
+)
+
+# Download bandwidth shared between the jobs running in this process
+bandwidth = BandwidthGovernor(
+    limit=app.config['BANDWIDTH_LIMIT'] or None,
+    settings_path=os.path.join(DATA_DIR, 'bandwidth.json')
+)
+
+def run_download_job(job):
+    """Run a queued download job on a worker thread"""
+    def progress_hook(**fields):
+        job_manager.update(job, **fields)
+
+    metrics.phase_seconds.observe(max(0, (job.started_at or time.time()) - job.created_at), platform=job.platform, phase='queue')
+    if not job.folder:
+        # Record the folder before downloading so a restart resumes into it
+        folder = downloader.sync_folder_name(job.url) if job.sync else downloader.job_folder_name(job.platform, job.id)
+        job_manager.update(job, folder=folder)
+        job_manager.persist(job)
+
+    with bandwidth.lease(job.id, job.priority) as lease:
+        result = downloader.download_content(
+            job.url,
+            quality=job.quality,
+            job_id=job.id,
+            progress_hook=progress_hook,
+            folder_name=job.folder,
+            sync=job.sync,
+            lease=lease
+        )
+    download_index.refresh(result.get('folder'))
+    storage.poke()
+    return result
+
+# Cached listing of DOWNLOAD_DIR for /downloads
+download_index = DownloadIndex(DOWNLOAD_DIR)
+
+# Bounded worker pool replacing one thread per request
+job_store = JobStore(os.path.join(DATA_DIR, 'jobs.db'))
+
+def create_job_manager(progress_interval=None):
+    """Job manager that runs downloads in this process"""
+    return JobManager(
+        run_download_job,
+        max_workers=app.config['MAX_WORKERS'],
+        queue_depth=app.config['QUEUE_DEPTH'],
+        platform_limit=app.config['PLATFORM_CONCURRENCY'],
+        platform_limits=app.config['PLATFORM_CONCURRENCY_OVERRIDES'],
+        store=job_store,
+        progress_interval=progress_interval,
+        # Jobs waiting on post-processing free their worker for the next download,
+        # up to a small backlog per post-processing worker
+        max_offloaded=downloader.postprocessing.workers * 2
+    )
+
+def active_download_entries():
+    """Folders of queued and running jobs, which the storage manager must not evict"""
+    return {record['folder'] for record in job_store.unfinished() if record.get('folder')}
+
+# Keeps DOWNLOAD_DIR under its quota by evicting least recently used folders
+storage = StorageManager(
+    DOWNLOAD_DIR,
+    app.config['STORAGE_QUOTA_MB'] * 1024 * 1024,
+    store_objects_dir=downloader.store.objects_dir,
+    high_watermark=app.config['STORAGE_HIGH_WATERMARK'],
+    low_watermark=app.config['STORAGE_LOW_WATERMARK'],
+    interval=app.config['STORAGE_CHECK_INTERVAL'],
+    min_age=app.config['STORAGE_MIN_AGE'],
+    active_entries=active_download_entries,
+    state_path=os.path.join(DATA_DIR, 'storage_access.json'),
+    on_evict=download_index.refresh
+)
+
+if app.config['WORKER_MODE'] == 'external':
+    job_manager = JobQueueClient(
+        job_store,
+        queue_depth=app.config['QUEUE_DEPTH'],
+        platform_limit=app.config['PLATFORM_CONCURRENCY'],
+        platform_limits=app.config['PLATFORM_CONCURRENCY_OVERRIDES']
+    )
+else:
+    job_manager = create_job_manager()
+
+# Playlist entries beyond the first borrow worker slots from whichever job manager runs the job
+downloader.entry_slots = lambda platform: job_manager.slot_group(platform)
+
+metrics.gauge('rk_jobs_queued', 'Download jobs waiting for a worker', lambda: job_manager.stats()['queued'])
+metrics.gauge('rk_active_workers', 'Download jobs holding a worker', lambda: job_manager.stats()['running'])
+metrics.gauge(
+    'rk_active_workers_by_platform', 'Download jobs holding a worker, by platform',
+    lambda: job_manager.stats()['running_by_platform'], ('platform',)
+)
+metrics.gauge('rk_postprocess_queued', 'Post-processing tasks waiting for ffmpeg', lambda: downloader.postprocessing.stats()['queued'])
+metrics.gauge('rk_postprocess_running', 'Post-processing tasks running', lambda: downloader.postprocessing.stats()['running'])
+metrics.gauge('rk_bandwidth_bytes_per_second', 'Current download speed of all jobs', lambda: bandwidth.stats()['speed'])
+metrics.gauge('rk_storage_usage_bytes', 'Disk used by downloads at the last storage check', lambda: storage.usage)
+metrics.gauge('rk_storage_evicted_total', 'Download folders evicted to stay under the quota', lambda: storage.evicted)
+metrics.gauge(
+    'rk_fragment_parallelism', 'Concurrent fragment downloads given to new jobs, by platform',
+    lambda: {platform: tuner.current for platform, tuner in dict(downloader.engine.tuners).items()}, ('platform',)
+)
+
+# Finish time up to which the download index has seen jobs from worker processes
+index_synced_at = time.time()
+
+def sync_index_with_workers():
+    """Rescan folders of jobs finished by worker processes since the last listing"""
+    global index_synced_at
+    if app.config['WORKER_MODE'] != 'external':
+        return
+    now = time.time()
+    for folder in job_manager.finished_folders_since(index_synced_at):
+        download_index.refresh(folder)
+    index_synced_at = now
+
+def publish_worker_metrics(worker_id):
+    """Share this worker's counters and histograms with the web process's /metrics through the job store"""
+    while True:
+        time.sleep(app.config['WORKER_POLL_INTERVAL'])
+        try:
+            job_store.save_metrics(worker_id, metrics.snapshot())
+        except Exception:
+            # The database may be busy; the next snapshot carries the same totals
+            pass
+
+def run_worker():
+    """Worker process entry point: take jobs from the shared job store and run them"""
+    global job_manager
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    # run_download_job reports through the module-level job_manager
+    job_manager = create_job_manager(progress_interval=1.0)
+    prewarm_downloader()
+    threading.Thread(target=publish_worker_metrics, args=(worker_id,), name='metrics-publisher', daemon=True).start()
+    print(f"Download worker {worker_id} started with {app.config['MAX_WORKERS']} threads")
+    job_manager.serve_store_queue(
+        worker_id,
+        poll_interval=app.config['WORKER_POLL_INTERVAL'],
+        stale_after=app.config['WORKER_STALE_AFTER']
+    )
 
 @app.route('/')
 def index():
@@ -367,135 +1059,329 @@ def download():
         data = request.get_json()
         url = data.get('url', '').strip()
         quality = data.get('quality', None)
+        # Sync mode only fetches what is new since the last sync of this channel/playlist/profile
+        sync = bool(data.get('sync', False))
+        # Interactive jobs are queued first and get most of the bandwidth; syncs default to bulk
+        priority = data.get('priority') or ('bulk' if sync else 'interactive')
 
         if not url:
             return jsonify({'status': 'error', 'message': 'URL is required'})
+        if priority not in PRIORITY_WEIGHTS:
+            return jsonify({'status': 'error', 'message': f'Unknown priority: {priority}'})
 
         # Detect platform automatically
         platform = downloader.detect_platform(url)
+        if sync and platform not in downloader.SYNC_PLATFORMS:
+            return jsonify({'status': 'error', 'message': f'Sync mode is not supported for {platform} URLs'})
 
-        # Reset progress
-        current_progress['progress'] = 0
-        current_progress['status'] = 'Starting download...'
-        current_progress['filename'] = ''
-
-        # Start download in background thread
-        def download_thread():
-            try:
-                result = downloader.download_content(url, quality=quality)
-                if result['status'] == 'success':
-                    current_progress['progress'] = 100
-                    current_progress['status'] = 'Download completed!'
-                else:
-                    current_progress['progress'] = 0
-                    current_progress['status'] = 'Download failed'
-            except Exception as e:
-                current_progress['progress'] = 0
-                current_progress['status'] = f'Error: {str(e)}'
-
-        thread = threading.Thread(target=download_thread)
-        thread.daemon = True
-        thread.start()
+        try:
+            # Identical in-flight requests attach to the existing job and share its result
+            job, attached = job_manager.submit_or_attach(
+                url, platform, quality, key=downloader.job_key(url, quality, sync), sync=sync, priority=priority
+            )
+        except QueueFullError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 503
 
         return jsonify({
             'status': 'started',
-            'message': 'Download started',
-            'platform': platform
+            'message': 'Joined download already in progress' if attached else 'Download started',
+            'platform': platform,
+            'job_id': job.id,
+            'coalesced': attached
         })
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Server error: {str(e)}'})
 
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream progress updates for a job as Server-Sent Events"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+
+    def stream():
+        version = -1
+        while True:
+            snapshot, version = job_manager.wait_for_update(job, version, timeout=15)
+            if snapshot is None:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            yield f'event: progress\ndata: {json.dumps(snapshot)}\n\n'
+            if snapshot['state'] in ('completed', 'failed'):
+                break
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/events')
+def events():
+    """Stream a notification whenever any job finishes, so clients can refresh listings"""
+    def stream():
+        count = job_manager.finished_count
+        while True:
+            new_count = job_manager.wait_for_finished(count, timeout=15)
+            if new_count == count:
+                yield ': keep-alive\n\n'
+                continue
+            count = new_count
+            yield f'event: job-finished\ndata: {json.dumps({"finished": count})}\n\n'
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/bulk-download', methods=['POST'])
 def bulk_download():
-    """Handle bulk download requests"""
+    """Handle bulk download requests, streaming each URL's result as NDJSON when it finishes"""
     try:
         data = request.get_json()
-        urls = data.get('urls', [])
+        urls = [url.strip() for url in data.get('urls', []) if url.strip()]
+        sync = bool(data.get('sync', False))
+        priority = data.get('priority') or 'bulk'
         
         if not urls:
             return jsonify({'status': 'error', 'message': 'URLs list is required'})
+        if priority not in PRIORITY_WEIGHTS:
+            return jsonify({'status': 'error', 'message': f'Unknown priority: {priority}'})
         
-        results = []
-        for url in urls:
-            if url.strip():
-                result = downloader.download_content(url.strip())
-                result['url'] = url
-                results.append(result)
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'Processed {len(results)} URLs',
-            'results': results
-        })
+        # Queue the whole batch up front so it runs concurrently on the worker pool
+        jobs = {}
+        indices = {}
+        rejected = []
+        for index, url in enumerate(urls):
+            try:
+                job = job_manager.submit(
+                    url, downloader.detect_platform(url), key=downloader.job_key(url, sync=sync), sync=sync,
+                    priority=priority
+                )
+                jobs[job.id] = job
+                indices.setdefault(job.id, []).append(index)
+            except QueueFullError as e:
+                rejected.append({'index': index, 'url': url, 'status': 'error', 'message': str(e)})
+
+        def stream():
+            for line in rejected:
+                yield json.dumps(line) + '\n'
+            for job in job_manager.as_completed(jobs.values()):
+                # Duplicate URLs in a batch share one job, so report it for each of them
+                for index in indices[job.id]:
+                    line = dict(job.result or {})
+                    line.update({'index': index, 'url': urls[index], 'job_id': job.id})
+                    yield json.dumps(line) + '\n'
+            yield json.dumps({
+                'status': 'done',
+                'message': f'Processed {len(urls)} URLs'
+            }) + '\n'
+
+        return Response(stream(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
         
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Bulk download error: {str(e)}'})
 
+@app.route('/stream')
+def stream_media():
+    """Relay a progressive format of a URL straight from its source to the client, without saving it"""
+    url = request.args.get('url', '').strip()
+    if not url:
+        return jsonify({'status': 'error', 'message': 'URL is required'}), 400
+    platform = downloader.detect_platform(url)
+    try:
+        upstream, info, fmt = downloader.open_stream(url, request.args.get('format'), request.headers.get('Range'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'platform': platform}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Could not open stream: {str(e)}', 'platform': platform}), 502
+
+    def relay():
+        # Chunks are read from the source only as fast as the client takes them
+        try:
+            with bandwidth.lease(f'stream-{uuid.uuid4().hex[:12]}', 'interactive') as lease:
+                for chunk in upstream.iter_content(chunk_size=65536):
+                    lease.consume(len(chunk))
+                    yield chunk
+        finally:
+            upstream.close()
+
+    ext = fmt.get('ext') or info.get('ext') or 'mp4'
+    filename = f"{downloader.create_safe_filename(info.get('title') or 'video')}.{ext}"
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+        'Accept-Ranges': 'bytes',
+        'X-Accel-Buffering': 'no'
+    }
+    for header in ('Content-Length', 'Content-Range'):
+        if header in upstream.headers:
+            headers[header] = upstream.headers[header]
+    mimetype = upstream.headers.get('Content-Type') or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return Response(relay(), status=upstream.status_code, mimetype=mimetype, headers=headers)
+
+@app.route('/artifacts')
+def list_artifacts():
+    """List the subtitles, thumbnail and metadata available for a URL, and which are cached"""
+    url = request.args.get('url', '').strip()
+    if not url:
+        return jsonify({'status': 'error', 'message': 'URL is required'}), 400
+    try:
+        manifest = downloader.artifact_manifest(url)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Could not get artifacts: {str(e)}'}), 502
+    return jsonify(dict(downloader.artifacts.available(manifest), status='success'))
+
+@app.route('/artifacts/<kind>')
+def get_artifact(kind):
+    """Serve one artifact of a URL (fetching it on first request): subtitles, thumbnail or metadata"""
+    url = request.args.get('url', '').strip()
+    if not url:
+        return jsonify({'status': 'error', 'message': 'URL is required'}), 400
+    try:
+        path = downloader.fetch_artifact(url, kind, request.args.get('lang'), request.args.get('ext'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'Could not fetch {kind}: {str(e)}'}), 502
+    return send_file(path, as_attachment=request.args.get('download') == '1', conditional=True, etag=True)
+
 @app.route('/downloads')
 def list_downloads():
-    """List downloaded files and folders"""
+    """List downloaded files and folders, paginated and sorted, with ETag revalidation"""
     try:
-        items = []
-        if os.path.exists(DOWNLOAD_DIR):
-            for item in os.listdir(DOWNLOAD_DIR):
-                item_path = os.path.join(DOWNLOAD_DIR, item)
-                if os.path.isfile(item_path):
-                    items.append({
-                        'name': item,
-                        'type': 'file',
-                        'size': os.path.getsize(item_path)
-                    })
-                elif os.path.isdir(item_path):
-                    file_count = len([f for f in os.listdir(item_path) if os.path.isfile(os.path.join(item_path, f))])
-                    items.append({
-                        'name': item,
-                        'type': 'folder',
-                        'file_count': file_count
-                    })
-        
-        return jsonify({'items': items})
+        sort = request.args.get('sort', 'mtime')
+        order = request.args.get('order', 'desc')
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(1000, max(1, request.args.get('per_page', 100, type=int)))
+        sync_index_with_workers()
+
+        # The index version changes whenever the listing does, so clients that
+        # already have this page get a 304 without us building it again
+        etag = f'{download_index.etag}-{sort}-{order}-{page}-{per_page}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            items, total = download_index.page(sort, order, page, per_page)
+            response = jsonify({
+                'items': items,
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'sort': sort,
+                'order': order
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)})
 
+def resolve_download_path(relative_path):
+    """Resolve a client-supplied path to a file inside DOWNLOAD_DIR, or None"""
+    path = safe_join(DOWNLOAD_DIR, relative_path)
+    if path is None:
+        return None
+    # Resolve symlinks too, so nothing inside DOWNLOAD_DIR can point outside it
+    real_root = os.path.realpath(DOWNLOAD_DIR)
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([real_root, real_path]) != real_root or not os.path.isfile(real_path):
+        return None
+    return real_path
+
 @app.route('/download-file/<path:filename>')
 def download_file(filename):
-    """Download a specific file"""
+    """Download a specific file, including files inside job folders"""
+    # Hold the entry from before the lookup, so the storage manager cannot
+    # evict it between finding the file and opening it
+    entry = storage.entry_name(filename)
+    if not storage.acquire(entry):
+        return jsonify({'error': 'File not found'}), 404
+    held = True
     try:
-        safe_filename = secure_filename(filename)
-        file_path = os.path.join(DOWNLOAD_DIR, safe_filename)
-        
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
-        else:
+        file_path = resolve_download_path(filename)
+        relative_path = os.path.relpath(file_path, os.path.realpath(DOWNLOAD_DIR)) if file_path else None
+        if not file_path or storage.entry_name(relative_path) != entry:
             return jsonify({'error': 'File not found'}), 404
+
+        accel_prefix = app.config['ACCEL_REDIRECT_PREFIX']
+        if accel_prefix:
+            # Let the fronting nginx serve the bytes (Range, sendfile and all)
+            response = Response(mimetype=mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+            response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(file_path))}"
+            return response
+
+        if app.config['USE_X_SENDFILE']:
+            # The web server reads the file by path after we return
+            return send_file(file_path, as_attachment=True, conditional=True, etag=True)
+
+        # From here the hold belongs to the file: the storage manager leaves the
+        # folder alone until the server has sent and closed it
+        try:
+            file = storage.open_held(file_path, entry)
+        except FileNotFoundError:
+            abort(404)
+        held = False
+        try:
+            stat = os.fstat(file.fileno())
+            response = send_file(
+                file, as_attachment=True, download_name=os.path.basename(file_path), etag=False,
+                last_modified=stat.st_mtime
+            )
+            response.content_length = stat.st_size
+            response.set_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+            # ETag/Last-Modified revalidation with 304s and Range/206 responses; full-file
+            # responses go through wsgi.file_wrapper (sendfile under gunicorn)
+            return response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+        except Exception:
+            file.close()
+            raise
+    except HTTPException:
+        # e.g. 416 for a Range past the end of the file
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if held:
+            # Nothing is being sent from the file (anymore), or a fronting server sends it
+            storage.release(entry)
 
 @app.route('/download-folder/<foldername>')
 def download_folder(foldername):
-    """Download a folder as ZIP"""
+    """Download a folder as a streamed ZIP"""
+    safe_foldername = secure_filename(foldername)
+    # Hold the folder before looking at it, so it cannot be evicted before it is read
+    if not safe_foldername or not storage.acquire(safe_foldername):
+        return jsonify({'error': 'Folder not found'}), 404
+    held = True
     try:
-        safe_foldername = secure_filename(foldername)
         folder_path = os.path.join(DOWNLOAD_DIR, safe_foldername)
-        
-        if os.path.exists(folder_path) and os.path.isdir(folder_path):
-            # Create a temporary ZIP file
-            temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-            temp_zip.close()
-            
-            with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(folder_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, folder_path)
-                        zipf.write(file_path, arcname)
-            
-            return send_file(temp_zip.name, as_attachment=True, download_name=f'{safe_foldername}.zip')
-        else:
+        if not os.path.isdir(folder_path):
             return jsonify({'error': 'Folder not found'}), 404
+        # Stream the ZIP as it is built instead of writing a temporary file first;
+        # the first piece is read here so that a folder that is gone is still a 404
+        chunks = iter_zip(folder_path)
+        try:
+            first = next(chunks)
+        except FileNotFoundError:
+            abort(404)
+        response = Response(itertools.chain([first], chunks), mimetype='application/zip', headers={
+            'Content-Disposition': f'attachment; filename="{safe_foldername}.zip"',
+            'X-Accel-Buffering': 'no'
+        })
+        response.call_on_close(lambda: storage.release(safe_foldername))
+        held = False
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if held:
+            storage.release(safe_foldername)
 
 @app.route('/supported-platforms')
 def supported_platforms():
@@ -526,27 +1412,104 @@ def supported_platforms():
             'Stories download',
             'Playlist support',
             'High quality downloads',
-            'Metadata preservation',
-            'Subtitle downloads'
+            'Subtitles, thumbnails and metadata on demand from /artifacts'
         ]
     }
     return jsonify(platforms)
 
 @app.route('/clear-downloads', methods=['POST'])
 def clear_downloads():
-    """Clear all downloaded files"""
+    """Clear all downloaded files, except folders of unfinished jobs and ongoing transfers"""
     try:
-        if os.path.exists(DOWNLOAD_DIR):
-            shutil.rmtree(DOWNLOAD_DIR)
-            os.makedirs(DOWNLOAD_DIR)
+        kept = storage.clear()
+        download_index.rebuild()
+        if kept:
+            return jsonify({
+                'status': 'success',
+                'message': f'Downloads cleared, except {len(kept)} still in use',
+                'kept': kept
+            })
         return jsonify({'status': 'success', 'message': 'Downloads cleared successfully'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Error clearing downloads: {str(e)}'})
 
 @app.route('/progress')
 def get_progress():
-    """Get current download progress"""
-    return jsonify(current_progress)
+    """Get download progress for a job (defaults to the most recent one)"""
+    job_id = request.args.get('job_id')
+    job = job_manager.get(job_id) if job_id else job_manager.latest()
+    if not job:
+        return jsonify({'progress': 0, 'status': 'idle', 'filename': ''})
+    return jsonify({
+        'progress': job.progress,
+        'status': job.message,
+        'filename': job.filename
+    })
+
+@app.route('/jobs')
+def list_jobs():
+    """List tracked download jobs and worker pool stats"""
+    jobs = [job.to_dict() for job in job_manager.list_jobs()]
+    return jsonify({'jobs': jobs, 'stats': job_manager.stats()})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Get the status of a single download job"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/sync-sources')
+def sync_sources():
+    """List synced sources with their high-water marks and last sync time"""
+    return jsonify({'sources': downloader.sync_state.sources()})
+
+@app.route('/cache-stats')
+def cache_stats():
+    """Report metadata cache size and hit/miss counters"""
+    stats = downloader.info_cache.stats()
+    stats['store'] = downloader.store.stats()
+    stats['coalesced_extractions'] = downloader.extractions.coalesced
+    stats['coalesced_downloads'] = job_manager.coalesced
+    stats['pools'] = {'youtube_dl': downloader.ydl_pool.stats(), 'instaloader': downloader.instagram.pool.stats()}
+    stats['instagram'] = downloader.instagram.stats()
+    stats['postprocessing'] = downloader.postprocessing.stats()
+    stats['artifacts'] = downloader.artifacts.stats()
+    stats['storage'] = storage.stats()
+    stats['engine'] = downloader.engine.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Download pipeline metrics in the Prometheus text format"""
+    # In external mode the downloads, and so their timings, happen in worker processes
+    worker_metrics = job_store.worker_metrics() if app.config['WORKER_MODE'] == 'external' else ()
+    return Response(metrics.render(worker_metrics), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def admin_allowed():
+    """Whether the request carries the admin token, or comes from this machine if no token is set"""
+    admin_token = app.config['ADMIN_TOKEN']
+    if admin_token:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode('utf-8'), admin_token.encode('utf-8'))
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/bandwidth', methods=['GET', 'POST'])
+def admin_bandwidth():
+    """Show or change the bandwidth cap and priority weights"""
+    if not admin_allowed():
+        return jsonify({'status': 'error', 'message': 'Forbidden'}), 403
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        limit = data.get('limit', bandwidth.limit)
+        weights = data.get('weights') or {}
+        if limit is not None and (not isinstance(limit, (int, float)) or limit < 0):
+            return jsonify({'status': 'error', 'message': 'limit must be bytes per second, or null for no cap'}), 400
+        if any(priority not in PRIORITY_WEIGHTS or not isinstance(weight, (int, float)) or weight <= 0
+               for priority, weight in weights.items()):
+            return jsonify({'status': 'error', 'message': f'weights must be positive numbers for {list(PRIORITY_WEIGHTS)}'}), 400
+        bandwidth.configure(limit=int(limit) if limit else None, weights=weights)
+    return jsonify(bandwidth.stats())
 
 @app.route('/get-formats', methods=['POST'])
 def get_formats():
@@ -558,29 +1521,22 @@ def get_formats():
         if not url:
             return jsonify({'status': 'error', 'message': 'URL is required'})
 
-        # Use yt-dlp to get formats
-        ydl_opts = {
-            'listformats': True,
-            'quiet': True,
-            'no_warnings': True,
-        }
-
         formats_info = []
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                if 'formats' in info:
-                    for fmt in info['formats']:
-                        if fmt.get('format_note') and fmt.get('ext'):
-                            formats_info.append({
-                                'format_id': fmt.get('format_id', ''),
-                                'ext': fmt.get('ext', ''),
-                                'resolution': fmt.get('resolution', ''),
-                                'filesize': fmt.get('filesize', 0),
-                                'format_note': fmt.get('format_note', ''),
-                                'vcodec': fmt.get('vcodec', ''),
-                                'acodec': fmt.get('acodec', '')
-                            })
+            # Metadata is cached so a following /download can skip extraction
+            info = downloader.extract_info(url)
+            if 'formats' in info:
+                for fmt in info['formats']:
+                    if fmt.get('format_note') and fmt.get('ext'):
+                        formats_info.append({
+                            'format_id': fmt.get('format_id', ''),
+                            'ext': fmt.get('ext', ''),
+                            'resolution': fmt.get('resolution', ''),
+                            'filesize': fmt.get('filesize', 0),
+                            'format_note': fmt.get('format_note', ''),
+                            'vcodec': fmt.get('vcodec', ''),
+                            'acodec': fmt.get('acodec', '')
+                        })
         except Exception as e:
             return jsonify({'status': 'error', 'message': f'Could not get formats: {str(e)}'})
 
@@ -594,7 +1550,29 @@ def get_formats():
     except Exception as e:
         return jsonify({'status': 'error', 'message': f'Server error: {str(e)}'})
 
-if __name__ == '__main__':
+def prewarm_downloader():
+    """Build pooled downloader instances in the background so startup stays fast"""
+    if app.config['PREWARM_INSTANCES'] > 0:
+        threading.Thread(
+            target=downloader.prewarm, args=(app.config['PREWARM_INSTANCES'],), daemon=True
+        ).start()
+
+def start_background_services():
+    """Start per-process background work: resume jobs left unfinished by the last run, enforce the disk quota"""
+    job_manager.resume_unfinished(stale_after=app.config['WORKER_STALE_AFTER'])
+    prewarm_downloader()
+    storage.start()
+
+if __name__ != '__main__':
+    # Imported by a WSGI server
+    start_background_services()
+
+if __name__ == '__main__' and sys.argv[1:2] == ['worker']:
+    run_worker()
+elif __name__ == '__main__':
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     print("=" * 60)
     print("UNIVERSAL SOCIAL MEDIA DOWNLOADER")
     print("=" * 60)
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from cache import SingleFlight
+
+
+class ArtifactStore:
+    """Side artifacts of extracted media (subtitles, thumbnails, metadata JSON), fetched on demand.
+
+    Extraction only records which artifacts a media item has and where they
+    live; nothing is downloaded until an artifact is first requested, after
+    which it is served from the cache directory.
+    """
+
+    KINDS = ('subtitles', 'thumbnail', 'metadata')
+
+    # Info fields left out of the metadata artifact: bulky, and their URLs expire
+    METADATA_EXCLUDE = ('formats', 'subtitles', 'automatic_captions', 'thumbnails', 'http_headers', 'url')
+
+    def __init__(self, root, session=None, caption_langs=('en',)):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.session = session or requests.Session()
+        # Automatic captions come machine-translated into every language; only these are recorded
+        self.caption_langs = caption_langs
+        self.fetches = SingleFlight()
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.served_from_cache = 0
+
+    def key(self, extractor, media_id):
+        return f'{extractor}:{media_id}'
+
+    def folder(self, key):
+        return os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def record(self, key, title=None, subtitles=None, thumbnails=None, metadata=None):
+        """Save what artifacts key has; files already fetched stay cached"""
+        manifest = {
+            'key': key,
+            'title': title,
+            'recorded_at': time.time(),
+            'subtitles': subtitles or {},
+            'thumbnails': thumbnails or [],
+            'metadata': metadata
+        }
+        folder = self.folder(key)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, 'manifest.json')
+        with open(path + f'.{threading.get_ident()}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(path + f'.{threading.get_ident()}.tmp', path)
+        return manifest
+
+    def record_info(self, info):
+        """Record the artifacts of a yt-dlp info dict of a single video"""
+        if not info.get('extractor_key') or not info.get('id'):
+            return None
+        subtitles = {}
+        automatic = info.get('automatic_captions') or {}
+        for lang in self.caption_langs:
+            for tracks_lang, tracks in automatic.items():
+                if tracks_lang == lang or tracks_lang.startswith(f'{lang}-'):
+                    subtitles[tracks_lang] = self._tracks(tracks, automatic=True)
+        for lang, tracks in (info.get('subtitles') or {}).items():
+            if lang != 'live_chat':
+                subtitles[lang] = self._tracks(tracks, automatic=False)
+        thumbnails = info.get('thumbnails') or ([{'url': info['thumbnail']}] if info.get('thumbnail') else [])
+        return self.record(
+            self.key(info['extractor_key'], info['id']),
+            title=info.get('title'),
+            subtitles={lang: tracks for lang, tracks in subtitles.items() if tracks},
+            # yt-dlp sorts thumbnails from worst to best
+            thumbnails=[{'url': thumb['url']} for thumb in thumbnails if thumb.get('url')][-1:],
+            metadata={field: value for field, value in info.items() if field not in self.METADATA_EXCLUDE}
+        )
+
+    def _tracks(self, tracks, automatic):
+        return [
+            {'ext': track.get('ext') or 'vtt', 'url': track['url'], 'automatic': automatic}
+            for track in tracks if track.get('url') and track.get('ext') != 'json'
+        ]
+
+    def manifest(self, key):
+        """Artifacts recorded for key, or None if it was never extracted"""
+        try:
+            with open(os.path.join(self.folder(key), 'manifest.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def available(self, manifest):
+        """Client-facing summary of a manifest: what can be requested and what is cached already"""
+        folder = self.folder(manifest['key'])
+        return {
+            'title': manifest.get('title'),
+            'subtitles': [
+                {'lang': lang, 'ext': track['ext'], 'automatic': track['automatic']}
+                for lang, tracks in manifest['subtitles'].items() for track in tracks
+            ],
+            'thumbnail': bool(manifest['thumbnails']),
+            'metadata': manifest.get('metadata') is not None,
+            'cached': sorted(name for name in os.listdir(folder) if name != 'manifest.json' and not name.endswith('.tmp'))
+        }
+
+    def select(self, manifest, kind, lang=None, ext=None):
+        """Return (cache filename, source URL or None) of an artifact; ValueError if it is not available"""
+        if kind == 'metadata':
+            if manifest.get('metadata') is None:
+                raise ValueError('No metadata recorded for this media')
+            return 'metadata.json', None
+        if kind == 'thumbnail':
+            if not manifest['thumbnails']:
+                raise ValueError('This media has no thumbnail')
+            url = manifest['thumbnails'][-1]['url']
+            ext = os.path.splitext(urlsplit(url).path)[1].lstrip('.').lower() or 'jpg'
+            return f'thumbnail.{ext}', url
+        if kind == 'subtitles':
+            subtitles = manifest['subtitles']
+            if lang is None:
+                # Prefer manually written subtitles over automatic captions
+                langs = sorted(subtitles, key=lambda candidate: subtitles[candidate][0]['automatic'])
+                lang = langs[0] if langs else None
+            tracks = subtitles.get(lang) or []
+            if ext:
+                tracks = [track for track in tracks if track['ext'] == ext]
+            else:
+                tracks = sorted(tracks, key=lambda track: track['ext'] != 'vtt')
+            if not tracks:
+                raise ValueError(f'No {lang} subtitles' + (f' in {ext} format' if ext else '') if lang else 'This media has no subtitles')
+            return f"subtitles.{lang}.{tracks[0]['ext']}", tracks[0]['url']
+        raise ValueError(f"Unknown artifact kind '{kind}' (expected one of {', '.join(self.KINDS)})")
+
+    def fetch(self, manifest, kind, lang=None, ext=None):
+        """Path of a cached artifact, downloading it on the first request.
+
+        Raises ValueError if the media has no such artifact and
+        requests.HTTPError if its source refused it.
+        """
+        name, url = self.select(manifest, kind, lang, ext)
+        path = os.path.join(self.folder(manifest['key']), name)
+        if os.path.isfile(path):
+            with self._lock:
+                self.served_from_cache += 1
+            return path
+        return self.fetches.do(path, lambda: self._download(manifest, path, url))
+
+    def _download(self, manifest, path, url):
+        if os.path.isfile(path):
+            return path
+        temp_path = path + '.tmp'
+        if url is None:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest['metadata'], f, ensure_ascii=False, indent=2)
+        else:
+            with self.session.get(url, stream=True, timeout=(10, 60)) as resp:
+                resp.raise_for_status()
+                with open(temp_path, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=65536):
+                        f.write(chunk)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.fetched += 1
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {'fetched': self.fetched, 'served_from_cache': self.served_from_cache}
@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Share of the bandwidth cap each priority class gets per job, relative to the others
+PRIORITY_WEIGHTS = {'interactive': 8, 'bulk': 1}
+
+# Seconds without bytes after which a job paced through Lease.consume counts as idle
+IDLE_AFTER = 2
+
+
+class Lease:
+    """One job's claim on the governed bandwidth.
+
+    Every download of the job is paced against one shared budget: yt-dlp
+    downloads from the progress hook, which runs on the thread that read
+    the bytes (each fragment thread of an HLS/DASH download included),
+    other download paths through `consume`. yt-dlp's own `ratelimit` is not
+    used for that, as fragment downloaders copy it once per download and
+    apply it to every fragment thread separately; it is only kept up to date
+    for external downloaders, which take it as their overall limit when they
+    start. `on_change` is called when the job starts or stops moving bytes.
+    """
+
+    def __init__(self, job_id, priority, on_change=None):
+        self.job_id = job_id
+        self.priority = priority
+        self.on_change = on_change
+        self.rate = None  # bytes per second, None while unlimited
+        self.speed = 0.0
+        self.bytes = 0
+        self._measured_bytes = 0
+        self._params = []
+        self._file_bytes = {}  # files yt-dlp is downloading right now
+        self._consumed_at = 0
+        self._next_send = 0
+        self.paced_seconds = 0.0  # time the job's downloads spent waiting for their share
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """Whether the job is downloading, as opposed to extracting, merging or waiting"""
+        return bool(self._file_bytes) or time.monotonic() - self._consumed_at < IDLE_AFTER
+
+    def attach(self, params):
+        """Start governing a YoutubeDL's params dict (shared with its downloaders and read by external ones)"""
+        with self._lock:
+            self._params.append(params)
+            self._apply()
+
+    def detach(self, params):
+        with self._lock:
+            self._params = [attached for attached in self._params if attached is not params]
+            params['ratelimit'] = None
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate
+            self._apply()
+
+    def _apply(self):
+        # Parallel playlist entries of one job split its share between them
+        external = [params for params in self._params if params.get('external_downloader')]
+        rate = max(1, int(self.rate / len(external))) if self.rate and external else None
+        for params in external:
+            params['ratelimit'] = rate
+
+    def ydl_progress_hook(self, d):
+        """yt-dlp progress hook that counts the bytes this job downloads and paces the thread that read them"""
+        name = d.get('tmpfilename') or d.get('filename')
+        downloaded = d.get('downloaded_bytes') or 0
+        count = 0
+        with self._lock:
+            was_active = bool(self._file_bytes)
+            if d['status'] == 'downloading':
+                # Fragment threads report a shared running total, not always in order
+                count = max(0, downloaded - self._file_bytes.get(name, 0))
+                self.bytes += count
+                self._file_bytes[name] = max(downloaded, self._file_bytes.get(name, 0))
+            else:
+                # 'finished' names the final file, progress updates named its .part file
+                for partial in [key for key in self._file_bytes if key == name or key.startswith(f'{name}.')]:
+                    self.bytes += max(0, downloaded - self._file_bytes.pop(partial))
+            changed = was_active != bool(self._file_bytes)
+        if changed and self.on_change:
+            self.on_change()
+        if count:
+            self._pace(count)
+
+    def consume(self, count):
+        """Count `count` bytes read by the job, sleeping as needed to stay under its rate"""
+        now = time.monotonic()
+        with self._lock:
+            self.bytes += count
+            was_idle = now - self._consumed_at >= IDLE_AFTER
+            self._consumed_at = now
+        if was_idle and self.on_change:
+            self.on_change()
+        self._pace(count)
+
+    def _pace(self, count):
+        # One budget for all threads of the job: each waits until every byte read so far fits the rate
+        now = time.monotonic()
+        with self._lock:
+            if not self.rate:
+                return
+            self._next_send = max(self._next_send, now) + count / self.rate
+            delay = self._next_send - now
+            if delay > 0:
+                self.paced_seconds += delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def measure(self, interval):
+        """Smoothed download speed since the previous measurement"""
+        with self._lock:
+            current = (self.bytes - self._measured_bytes) / interval
+            self._measured_bytes = self.bytes
+        self.speed = current if not self.speed else 0.5 * self.speed + 0.5 * current
+        return self.speed
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'priority': self.priority,
+            'rate': self.rate,
+            'speed': round(self.speed),
+            'downloaded_bytes': self.bytes
+        }
+
+
+class BandwidthGovernor:
+    """Process-wide download rate cap, shared between running jobs by priority.
+
+    The cap is split between the jobs that are moving bytes in proportion
+    to the weight of their priority class, and re-split whenever a job
+    starts or stops downloading, so an interactive job gets most of the link
+    as soon as it starts and bulk jobs soak up the rest. Jobs that are
+    extracting or merging are given the share they would get once they
+    download again, so a download starts at its share rather than at a
+    trickle.
+
+    Settings are kept in `settings_path` so that changes made through the
+    admin endpoint reach worker processes too; the cap applies to each
+    process separately.
+    """
+
+    def __init__(self, limit=None, weights=None, settings_path=None, interval=0.5, min_rate=32 * 1024):
+        self.limit = limit  # bytes per second, None for no cap
+        self.weights = dict(PRIORITY_WEIGHTS, **(weights or {}))
+        self.settings_path = settings_path
+        self.interval = interval
+        self.min_rate = min_rate
+        self._leases = []
+        self._lock = threading.Lock()
+        self._rebalance_lock = threading.Lock()
+        self._settings_mtime = None
+        self._thread = None
+        self.load_settings()
+
+    @contextmanager
+    def lease(self, job_id, priority='interactive'):
+        """Govern the downloads of a job for the duration of the block"""
+        lease = Lease(job_id, priority if priority in self.weights else 'interactive', on_change=self.rebalance)
+        with self._lock:
+            self._leases.append(lease)
+            self._ensure_thread()
+        self.rebalance()
+        try:
+            yield lease
+        finally:
+            with self._lock:
+                self._leases = [held for held in self._leases if held is not lease]
+            self.rebalance()
+
+    def configure(self, limit=None, weights=None):
+        """Change the cap and priority weights at runtime and save them for other processes"""
+        with self._lock:
+            self.limit = limit
+            self.weights.update(weights or {})
+            self._ensure_thread()
+        self.save_settings()
+        self.rebalance()
+
+    def rebalance(self):
+        """Recompute every job's share of the cap and push it to its downloads"""
+        with self._rebalance_lock:
+            with self._lock:
+                leases = list(self._leases)
+                limit = self.limit
+            shares = self.allocate(leases, limit) if limit else {}
+            for lease in leases:
+                lease.set_rate(shares.get(lease))
+
+    def allocate(self, leases, limit):
+        """Split limit between the active leases by priority weight; idle ones get what they would if they started.
+
+        Each lease's min_rate floor comes out of the limit before the split, so
+        the shares never add up to more than the limit; when the floors alone
+        would, they shrink to an even split of it.
+        """
+        active = [lease for lease in leases if lease.active]
+        total_weight = sum(self.weights[lease.priority] for lease in active)
+        shares = {}
+        for lease in leases:
+            weight = self.weights[lease.priority]
+            count, weights = (len(active), total_weight) if lease.active else (len(active) + 1, total_weight + weight)
+            floor = min(self.min_rate, limit // count)
+            shares[lease] = floor + int((limit - floor * count) * weight / weights)
+        return shares
+
+    def load_settings(self):
+        """Pick up settings saved by another process, if they changed"""
+        if not self.settings_path:
+            return
+        try:
+            mtime = os.path.getmtime(self.settings_path)
+            if mtime == self._settings_mtime:
+                return
+            with open(self.settings_path, encoding='utf-8') as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._settings_mtime = mtime
+            self.limit = settings.get('limit')
+            self.weights.update(settings.get('weights') or {})
+
+    def save_settings(self):
+        if not self.settings_path:
+            return
+        os.makedirs(os.path.dirname(self.settings_path), exist_ok=True)
+        with self._lock:
+            settings = {'limit': self.limit, 'weights': self.weights}
+        with open(self.settings_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(self.settings_path + '.tmp', self.settings_path)
+        with self._lock:
+            self._settings_mtime = os.path.getmtime(self.settings_path)
+
+    def stats(self):
+        with self._lock:
+            leases = list(self._leases)
+            return {
+                'limit': self.limit,
+                'weights': dict(self.weights),
+                'jobs': [lease.to_dict() for lease in leases],
+                'speed': round(sum(lease.speed for lease in leases))
+            }
+
+    def _ensure_thread(self):
+        # Started with the first job so importing the app does not spawn threads
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='bandwidth-governor', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                leases = list(self._leases)
+            for lease in leases:
+                lease.measure(now - last)
+            last = now
+            self.load_settings()
+            self.rebalance()
@@ -0,0 +1,175 @@
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Media bytes repeat this block; random so that nothing downstream compresses it
+BLOCK = random.Random(0).randbytes(1024 * 1024)
+
+# Just enough of an MP4 for yt-dlp and clients to take the file for one
+MP4_HEADER = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+
+SEGMENT_SECONDS = 2
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Synthetic media that yt-dlp's generic extractor understands.
+
+        /media/<name>.mp4?size=N                        progressive MP4 of N bytes (Range supported)
+        /hls/<name>.m3u8?segments=N&size=B              HLS media playlist of N segments of B bytes
+        /dash/<name>.mpd?segments=N&size=B              DASH manifest with a segment list
+        /playlist/<name>.html?entries=N&size=B          page embedding N progressive videos
+        /channel/<name>?entries=N&size=B                the same, at a channel-style path
+        /images/<name>.jpg?size=N                       image of N bytes
+        /expired/<name>.mp4                             403, like a signed media URL past its expiry
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        size = int(query.get('size', 4 * 1024 * 1024))
+        segments = int(query.get('segments', 8))
+        entries = int(query.get('entries', 3))
+        path = parts.path
+
+        if re.fullmatch(r'/media/[^/]+\.mp4', path):
+            return self.send_media(size, 'video/mp4', send_body)
+        match = re.fullmatch(r'/hls/([^/]+)\.m3u8', path)
+        if match:
+            return self.send_text(self.hls_playlist(match.group(1), segments, size), 'application/vnd.apple.mpegurl', send_body)
+        if re.fullmatch(r'/hls/[^/]+/seg\d+\.ts', path):
+            return self.send_media(size, 'video/mp2t', send_body)
+        match = re.fullmatch(r'/dash/([^/]+)\.mpd', path)
+        if match:
+            return self.send_text(self.dash_manifest(match.group(1), segments, size), 'application/dash+xml', send_body)
+        if re.fullmatch(r'/dash/[^/]+/(init\.mp4|seg\d+\.m4s)', path):
+            return self.send_media(size, 'video/mp4', send_body)
+        match = re.fullmatch(r'/playlist/([^/]+)\.html', path) or re.fullmatch(r'/channel/([^/]+)', path)
+        if match:
+            return self.send_text(self.playlist_page(match.group(1), entries, size), 'text/html; charset=utf-8', send_body)
+        if re.fullmatch(r'/images/[^/]+\.jpg', path):
+            return self.send_media(size, 'image/jpeg', send_body)
+        if re.fullmatch(r'/expired/[^/]+\.mp4', path):
+            return self.send_text('Forbidden', 'text/plain', send_body, status=403)
+        self.send_text('Not found', 'text/plain', send_body, status=404)
+
+    def hls_playlist(self, name, segments, size):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(segments):
+            lines += [f'#EXTINF:{SEGMENT_SECONDS}.0,', f'{name}/seg{index}.ts?size={size}']
+        return '\n'.join(lines + ['#EXT-X-ENDLIST', ''])
+
+    def dash_manifest(self, name, segments, size):
+        segment_urls = ''.join(f'<SegmentURL media="{name}/seg{index}.m4s?size={size}"/>' for index in range(segments))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S" '
+            f'mediaPresentationDuration="PT{segments * SEGMENT_SECONDS}S" profiles="urn:mpeg:dash:profile:isoff-main:2011">'
+            '<Period><AdaptationSet mimeType="video/mp4">'
+            f'<Representation id="av" codecs="avc1.4d401f,mp4a.40.2" width="1280" height="720" bandwidth="{size * 4}">'
+            f'<SegmentList timescale="1" duration="{SEGMENT_SECONDS}"><Initialization sourceURL="{name}/init.mp4?size=1024"/>'
+            f'{segment_urls}</SegmentList>'
+            '</Representation></AdaptationSet></Period></MPD>'
+        )
+
+    def playlist_page(self, name, entries, size):
+        videos = ''.join(f'<video src="/media/{name}-{index}.mp4?size={size}"></video>' for index in range(entries))
+        return f'<html><head><title>{name}</title></head><body>{videos}</body></html>'
+
+    def send_text(self, text, content_type, send_body, status=200):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_media(self, size, content_type, send_body):
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if send_body:
+            for offset in range(start, end + 1, 65536):
+                self.wfile.write(media_bytes(offset, min(offset + 65536, end + 1)))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def media_bytes(start, end):
+    """Bytes start:end of a synthetic media file"""
+    data = bytearray()
+    position = start
+    while position < end:
+        block_offset = position % len(BLOCK)
+        piece = BLOCK[block_offset:block_offset + end - position]
+        data += piece
+        position += len(piece)
+    if start < len(MP4_HEADER):
+        data[:len(MP4_HEADER) - start] = MP4_HEADER[start:end]
+    return bytes(data)
+
+
+class MediaServer(ThreadingHTTPServer):
+    """Stand-in media host on 127.0.0.1, serving in a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), MediaHandler)
+        self.thread = threading.Thread(target=self.serve_forever, name='media-server', daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def handle_error(self, request, client_address):
+        # yt-dlp's generic extractor hangs up after sniffing the first bytes
+        pass
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve synthetic media for offline benchmarks')
+    parser.add_argument('--port', type=int, default=8765)
+    server = MediaServer(parser.parse_args().port)
+    print(f'Serving synthetic media on {server.base_url}')
+    server.serve_forever()
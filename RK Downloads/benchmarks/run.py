@@ -0,0 +1,300 @@
+"""Offline benchmarks of the RK Downloads HTTP API.
+
+Starts the stand-in media server and the app on a throwaway working
+directory, measures every scenario at each concurrency level and writes
+the results as JSON, so runs can be compared over time:
+
+    python benchmarks/run.py --concurrency 1,4,16 --output results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, APP_DIR)
+
+from media_server import MediaServer, media_bytes
+
+
+class Bench:
+    """A running app and media server, plus the scenarios measured against them"""
+
+    def __init__(self, args):
+        self.args = args
+        self.media = MediaServer().start()
+        self.run_id = uuid.uuid4().hex[:6]
+        self.counter = itertools.count()
+        self.local = threading.local()
+
+        # app.py keeps downloads/ and data/ under the working directory
+        self.workdir = tempfile.mkdtemp(prefix='rk-bench-')
+        os.chdir(self.workdir)
+        os.environ.setdefault('RK_PREWARM_INSTANCES', '0')
+        os.environ.setdefault('RK_MAX_WORKERS', str(args.workers))
+        os.environ.setdefault('RK_QUEUE_DEPTH', '10000')
+        import app
+        from werkzeug.serving import make_server
+
+        self.app = app
+        self.server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name='app-server', daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def unique(self, prefix):
+        # Fresh names keep the info cache, content store and job coalescing from hiding work
+        return f'{prefix}{self.run_id}x{next(self.counter)}'
+
+    def media_url(self, kind):
+        size = self.args.media_size
+        if kind == 'progressive':
+            return f'{self.media.base_url}/media/{self.unique("p")}.mp4?size={size}'
+        if kind == 'hls':
+            return f'{self.media.base_url}/hls/{self.unique("h")}.m3u8?segments=8&size={size // 8}'
+        if kind == 'dash':
+            return f'{self.media.base_url}/dash/{self.unique("d")}.mpd?segments=8&size={size // 8}'
+        return f'{self.media.base_url}/playlist/{self.unique("l")}.html?entries=3&size={size // 3}'
+
+    def wait_for_job(self, job_id):
+        while True:
+            job = self.session.get(f'{self.base_url}/jobs/{job_id}').json()
+            if job['state'] in ('completed', 'failed'):
+                break
+            time.sleep(0.02)
+        result = job.get('result') or {}
+        if result.get('status') != 'success':
+            raise RuntimeError(result.get('message') or job.get('message'))
+        return job
+
+    def download(self, kind):
+        def scenario(index):
+            resp = self.session.post(f'{self.base_url}/download', json={'url': self.media_url(kind)})
+            data = resp.json()
+            if data.get('status') != 'started':
+                raise RuntimeError(data.get('message'))
+            self.wait_for_job(data['job_id'])
+            return self.args.media_size
+        return scenario
+
+    def bulk_download(self, index):
+        urls = [self.media_url('progressive') for _ in range(self.args.batch)]
+        resp = self.session.post(f'{self.base_url}/bulk-download', json={'urls': urls}, stream=True)
+        failed = [line for line in map(json.loads, resp.iter_lines()) if line.get('status') not in ('success', 'done')]
+        if failed:
+            raise RuntimeError(failed[0].get('message'))
+        return self.args.media_size * len(urls)
+
+    def get_formats_cold(self, index):
+        return self.get_formats(self.media_url('progressive'))
+
+    def get_formats_warm(self, index):
+        return self.get_formats(self.warm_url)
+
+    def get_formats(self, url):
+        resp = self.session.post(f'{self.base_url}/get-formats', json={'url': url})
+        if resp.json().get('status') != 'success':
+            raise RuntimeError(resp.json().get('message'))
+        return len(resp.content)
+
+    def list_downloads(self, index):
+        sort = ('mtime', 'name', 'size')[index % 3]
+        page = index % max(1, self.args.folders // 100) + 1
+        resp = self.session.get(f'{self.base_url}/downloads', params={'sort': sort, 'page': page, 'per_page': 100})
+        resp.raise_for_status()
+        return len(resp.content)
+
+    def download_folder(self, index):
+        return self.fetch(f'{self.base_url}/download-folder/{self.zip_folder}')
+
+    def download_file(self, index):
+        return self.fetch(f'{self.base_url}/download-file/{self.file_path}')
+
+    def fetch(self, url):
+        received = 0
+        with self.session.get(url, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                received += len(chunk)
+        return received
+
+    def setup_files(self):
+        """Fake job folders for the listing, plus a folder to zip and a file to serve"""
+        download_dir = self.app.DOWNLOAD_DIR
+        for index in range(self.args.folders):
+            folder = os.path.join(download_dir, f'bench_listing_{index:05d}')
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, 'video.mp4'), 'wb') as f:
+                f.write(media_bytes(0, 1024))
+        self.zip_folder = 'bench_zip'
+        os.makedirs(os.path.join(download_dir, self.zip_folder), exist_ok=True)
+        for index in range(self.args.zip_files):
+            self.write_media(os.path.join(download_dir, self.zip_folder, f'video_{index}.mp4'), self.args.media_size)
+        self.file_path = f'{self.zip_folder}/video_0.mp4'
+        self.warm_url = self.media_url('progressive')
+        self.get_formats(self.warm_url)
+
+    def write_media(self, path, size):
+        with open(path, 'wb') as f:
+            for offset in range(0, size, 1024 * 1024):
+                f.write(media_bytes(offset, min(offset + 1024 * 1024, size)))
+
+    def scenarios(self):
+        return {
+            'get_formats_cold': self.get_formats_cold,
+            'get_formats_warm': self.get_formats_warm,
+            'downloads_listing': self.list_downloads,
+            'download_file': self.download_file,
+            'download_folder_zip': self.download_folder,
+            'download_progressive': self.download('progressive'),
+            'download_hls': self.download('hls'),
+            'download_dash': self.download('dash'),
+            'download_playlist': self.download('playlist'),
+            'bulk_download': self.bulk_download,
+        }
+
+    def close(self, keep=False):
+        self.server.shutdown()
+        self.media.stop()
+        os.chdir(APP_DIR)
+        if keep:
+            print(f'Downloads kept in {self.workdir}', file=sys.stderr)
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def measure(name, scenario, concurrency, count):
+    """Run scenario count times on concurrency threads; latency and throughput summary"""
+    def timed(index):
+        started = time.perf_counter()
+        try:
+            received = scenario(index)
+            return received, time.perf_counter() - started, None
+        except Exception as e:
+            return 0, time.perf_counter() - started, f'{type(e).__name__}: {e}'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, range(count)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for received, seconds, error in outcomes if error is None)
+    errors = [error for received, seconds, error in outcomes if error is not None]
+    received = sum(outcome[0] for outcome in outcomes)
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round((count - len(errors)) / wall, 2),
+        'bytes': received,
+        'mb_per_second': round(received / wall / 1024 / 1024, 2),
+        'latency_ms': {
+            'min': round(latencies[0], 1) if latencies else None,
+            'mean': round(sum(latencies) / len(latencies), 1) if latencies else None,
+            'p50': round(percentile(latencies, 0.5), 1) if latencies else None,
+            'p90': round(percentile(latencies, 0.9), 1) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 1) if latencies else None,
+            'max': round(latencies[-1], 1) if latencies else None
+        }
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import yt_dlp
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'yt_dlp': yt_dlp.version.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RK Downloads API against a local stand-in media server')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=16, help='requests per scenario and concurrency level')
+    parser.add_argument('--scenarios', help='comma-separated subset of scenarios to run')
+    parser.add_argument('--workers', type=int, default=4, help='download workers of the app (RK_MAX_WORKERS)')
+    parser.add_argument('--media-size', type=int, default=4 * 1024 * 1024, help='bytes per synthetic video')
+    parser.add_argument('--batch', type=int, default=4, help='URLs per /bulk-download request')
+    parser.add_argument('--folders', type=int, default=2000, help='job folders in the /downloads listing')
+    parser.add_argument('--zip-files', type=int, default=4, help='videos in the folder zipped by /download-folder')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory with the downloads')
+    args = parser.parse_args()
+    # The app runs in a temporary working directory
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    bench = Bench(args)
+    scenarios = bench.scenarios()
+    selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (available: {', '.join(scenarios)})")
+
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': environment(),
+        'settings': vars(args),
+        'results': []
+    }
+    try:
+        bench.setup_files()
+        for name in selected:
+            for concurrency in levels:
+                result = measure(name, scenarios[name], concurrency, args.requests)
+                report['results'].append(result)
+                print(
+                    f"{name:22} c={concurrency:<3} {result['requests_per_second']:>8} req/s "
+                    f"{result['mb_per_second']:>8} MB/s  p50 {result['latency_ms']['p50']} ms  "
+                    f"p99 {result['latency_ms']['p99']} ms  errors {result['errors']}",
+                    file=sys.stderr
+                )
+    finally:
+        bench.close(args.keep)
+
+    output = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
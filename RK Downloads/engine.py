@@ -0,0 +1,218 @@
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger('rk.download')
+
+MiB = 1024 * 1024
+
+# yt-dlp download settings per platform (as returned by detect_platform);
+# platforms without a profile use 'default'. `fragments` is the (minimum,
+# initial, maximum) number of HLS/DASH fragments fetched concurrently.
+PROFILES = {
+    'default': {
+        'outtmpl': '%(extractor)s_%(title)s.%(ext)s',
+        'format': 'best',
+        'http_chunk_size': None,
+        'fragments': (1, 4, 16),
+        'retries': 10,
+        'fragment_retries': 10,
+        'options': {},
+    },
+    'youtube': {
+        'outtmpl': '%(uploader)s - %(title)s.%(ext)s',
+        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        # YouTube throttles single requests for whole large files
+        'http_chunk_size': 10 * MiB,
+        'fragments': (1, 4, 8),
+        'options': {
+            'ignoreerrors': True,
+            'no_warnings': False,
+            'extract_flat': False,
+            'continuedl': True,  # resume .part files left by an interrupted job
+        },
+    },
+    'tiktok': {'outtmpl': 'TikTok_%(uploader)s_%(title)s.%(ext)s', 'fragments': (1, 4, 8)},
+    'twitter': {'outtmpl': 'Twitter_%(uploader)s_%(title)s.%(ext)s', 'fragments': (1, 4, 8)},
+    'facebook': {'outtmpl': 'Facebook_%(title)s.%(ext)s', 'fragments': (1, 8, 16)},
+    'reddit': {'outtmpl': 'Reddit_%(title)s.%(ext)s', 'fragments': (1, 8, 16)},
+}
+
+
+class FragmentTuner:
+    """Concurrent fragment downloads for one platform, adjusted after every segmented download.
+
+    A 429 halves the parallelism at once. Otherwise it climbs one step at a
+    time while each step still buys at least 10% more throughput than the
+    one below it, and steps back when it makes things slower (e.g. because
+    the link is saturated) or fragments needed retries. Downloads held to
+    their share of the bandwidth cap are not observed, as they measure the
+    cap rather than the parallelism.
+    """
+
+    def __init__(self, minimum, initial, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = max(minimum, min(initial, maximum))
+        self.throughput = {}  # parallelism -> smoothed bytes per second of a download
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def throttle(self, parallelism):
+        with self._lock:
+            self.throttled += 1
+            self.current = max(self.minimum, min(self.current, parallelism // 2))
+
+    def observe(self, parallelism, throughput, retries=0):
+        with self._lock:
+            previous = self.throughput.get(parallelism)
+            self.throughput[parallelism] = throughput if previous is None else 0.7 * previous + 0.3 * throughput
+            below = self.throughput.get(parallelism - 1)
+            if retries:
+                self.current = max(self.minimum, parallelism - 1)
+            elif below is None or self.throughput[parallelism] >= below * 1.1:
+                self.current = min(self.maximum, parallelism + 1)
+            elif self.throughput[parallelism] < below * 0.95:
+                self.current = max(self.minimum, parallelism - 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'parallelism': self.current,
+                'range': [self.minimum, self.maximum],
+                'throughput': {str(level): round(speed) for level, speed in sorted(self.throughput.items())},
+                'throttled': self.throttled
+            }
+
+
+class EngineRun:
+    """Per-job companion of a YoutubeDL: reports segmented downloads and 429s back to the tuner.
+
+    It is installed as the job's yt-dlp logger (retry warnings reach yt-dlp's
+    logger as screen messages), progress hook and retry sleep function.
+    """
+
+    def __init__(self, tuner, parallelism):
+        self.tuner = tuner
+        self.parallelism = parallelism
+        self.retries = 0
+        self.throttled = False
+        self.lease = None  # the job's bandwidth lease, if it is governed
+        self._segmented = set()
+
+    def progress_hook(self, d):
+        if d['status'] == 'downloading' and (d.get('fragment_count') or 0) > 1:
+            self._segmented.add(d.get('filename'))
+        elif d['status'] == 'finished' and d.get('filename') in self._segmented:
+            self._segmented.discard(d.get('filename'))
+            if d.get('elapsed') and d.get('downloaded_bytes') and not self.throttled:
+                throughput = d['downloaded_bytes'] / d['elapsed']
+                rate = self.lease.rate if self.lease else None
+                if not rate or throughput < 0.9 * rate:
+                    self.tuner.observe(self.parallelism, throughput, self.retries)
+            self.retries = 0
+
+    def retry_sleep(self, n):
+        """Seconds to wait before retry n+1 of a request or fragment"""
+        self.retries += 1
+        if self.throttled:
+            return min(30, 2 ** (n + 1))
+        return min(5, 0.25 * 2 ** n)
+
+    def _check_throttled(self, message):
+        if 'HTTP Error 429' in message or 'Too Many Requests' in message:
+            if not self.throttled:
+                self.tuner.throttle(self.parallelism)
+            self.throttled = True
+
+    def debug(self, message):
+        # yt-dlp hands the logger its screen output, download retries included
+        self._check_throttled(message)
+        if not message.startswith('[debug] '):
+            logger.debug(message)
+
+    def info(self, message):
+        logger.info(message)
+
+    def warning(self, message):
+        self._check_throttled(message)
+        logger.warning(message)
+
+    def error(self, message):
+        logger.error(message)
+
+
+class DownloadEngine:
+    """yt-dlp options for every platform's downloads, built from one table of profiles.
+
+    Each job gets the current fragment parallelism of its platform's tuner
+    and an EngineRun that feeds measured throughput and 429s back into it.
+    With an external downloader (e.g. 'aria2c') installed, plain HTTP and
+    fragment downloads go through it with as many connections as the
+    tuner allows; progress is then only reported when a file completes.
+    Under a bandwidth cap aria2c takes the job's current share as its
+    overall limit (over all connections) each time it starts a file.
+    """
+
+    def __init__(self, profiles=None, external_downloader=None):
+        self.profiles = {platform: dict(PROFILES['default'], **profile) for platform, profile in (profiles or PROFILES).items()}
+        self.tuners = {}
+        self._lock = threading.Lock()
+        self.external_downloader = None
+        if external_downloader:
+            if shutil.which(external_downloader):
+                self.external_downloader = external_downloader
+            else:
+                logger.warning('External downloader %s not found, using the native one', external_downloader)
+
+    def profile(self, platform):
+        return self.profiles.get(platform) or self.profiles['default']
+
+    def tuner(self, platform):
+        with self._lock:
+            if platform not in self.tuners:
+                self.tuners[platform] = FragmentTuner(*self.profile(platform)['fragments'])
+            return self.tuners[platform]
+
+    def options(self, platform, path, quality=None, hooks=None, **overrides):
+        """YoutubeDL options for one job of platform downloading into path"""
+        profile = self.profile(platform)
+        run = EngineRun(self.tuner(platform), self.tuner(platform).current)
+        options = dict(
+            profile['options'],
+            outtmpl=os.path.join(path, profile['outtmpl']),
+            format=quality or profile['format'],
+            retries=profile['retries'],
+            fragment_retries=profile['fragment_retries'],
+            http_chunk_size=profile['http_chunk_size'],
+            concurrent_fragment_downloads=run.parallelism,
+            retry_sleep_functions={'http': run.retry_sleep, 'fragment': run.retry_sleep},
+            logger=run,
+            progress_hooks=[run.progress_hook],
+            **overrides
+        )
+        if self.external_downloader:
+            options['external_downloader'] = {'default': self.external_downloader}
+            if self.external_downloader == 'aria2c':
+                connections = str(min(16, run.parallelism))
+                options['external_downloader_args'] = {'aria2c': ['-x', connections, '-s', connections, '-k', '1M']}
+        return self.with_hooks(options, hooks or {})
+
+    def with_hooks(self, options, hooks):
+        """Copy of options with the progress and postprocessor hooks (and other options) of hooks added"""
+        merged = dict(options, **{key: value for key, value in hooks.items() if not key.endswith('_hooks')})
+        for key in ('progress_hooks', 'postprocessor_hooks'):
+            if key in options or key in hooks:
+                merged[key] = list(options.get(key, [])) + list(hooks.get(key, []))
+        if isinstance(merged.get('logger'), EngineRun) and hooks.get('bandwidth_lease'):
+            merged['logger'].lease = hooks['bandwidth_lease']
+        return merged
+
+    def stats(self):
+        with self._lock:
+            tuners = dict(self.tuners)
+        return {
+            'external_downloader': self.external_downloader,
+            'platforms': {platform: tuner.to_dict() for platform, tuner in tuners.items()}
+        }
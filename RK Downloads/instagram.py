@@ -0,0 +1,212 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import requests
+
+from lazy import LazyModule
+from pools import InstaloaderPool
+
+instaloader = LazyModule('instaloader')
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, then take them"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = max(self._paused_until - now, (tokens - self._tokens) / self.rate)
+                self.waited += wait
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds` and start again from an empty bucket"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'tokens': round(self._tokens, 2),
+                'paused_for': round(max(0, self._paused_until - time.monotonic()), 1),
+                'waited_seconds': round(self.waited, 1)
+            }
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class SharedRateController:
+    """Instaloader rate controller that also draws every query from a bucket shared by all loaders.
+
+    Instaloader's own controller only sees the queries of one loader; the
+    shared bucket paces all jobs in this process together, and a 429 on any
+    of them backs all of them off.
+    """
+
+    def __init__(self, context, bucket, backoff=60):
+        self.bucket = bucket
+        self.backoff = backoff
+        self.default = instaloader.RateController(context)
+
+    def wait_before_query(self, query_type):
+        self.bucket.acquire()
+        self.default.wait_before_query(query_type)
+
+    def handle_429(self, query_type):
+        self.bucket.pause(self.backoff)
+        self.default.handle_429(query_type)
+
+    def __getattr__(self, attr):
+        return getattr(self.default, attr)
+
+
+class InstagramEngine:
+    """Instagram downloads on pooled, logged-in loaders with shared rate limiting.
+
+    If a username is configured its session is loaded from (and saved back
+    to) a session file under `session_dir`, logging in with the password
+    only when no valid session file exists. Media files of the posts a job
+    walks are fetched on a thread pool while the next post's metadata is
+    queried, since only metadata queries count against Instagram's limits.
+    """
+
+    def __init__(self, session_dir, username=None, password=None, rate=0.2, burst=10,
+                 media_parallelism=4, pool_max_idle=4, session_save_interval=600):
+        self.session_dir = session_dir
+        self.username = username
+        self.password = password
+        self.session_save_interval = session_save_interval
+        self.bucket = TokenBucket(rate, burst)
+        self.pool = InstaloaderPool(
+            max_idle=pool_max_idle,
+            rate_controller=lambda context: SharedRateController(context, self.bucket),
+            on_create=self.load_session
+        )
+        self.media_pool = ThreadPoolExecutor(max_workers=media_parallelism, thread_name_prefix='instagram-media')
+        self.media_session = requests.Session()
+        self.media_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=media_parallelism))
+        self._session_lock = threading.Lock()
+        self._session_saved_at = 0
+        self.files_fetched = 0
+
+    @property
+    def session_file(self):
+        return os.path.join(self.session_dir, f'session-{self.username}') if self.username else None
+
+    def load_session(self, loader):
+        """Log a new loader in from the session file, or with the password as a fallback"""
+        if not self.username:
+            return
+        with self._session_lock:
+            if os.path.isfile(self.session_file):
+                try:
+                    loader.load_session_from_file(self.username, self.session_file)
+                    if loader.test_login() == self.username:
+                        return
+                except Exception:
+                    pass
+                # Expired or unreadable: back to an anonymous session, then try the password
+                loader.context.username = None
+                loader.context._session = loader.context.get_anonymous_session()
+            if self.password:
+                loader.login(self.username, self.password)
+                self._save_session(loader)
+
+    def save_session(self, loader):
+        """Write a logged-in loader's cookies back to the session file, at most every few minutes"""
+        if not loader.context.is_logged_in or time.time() - self._session_saved_at < self.session_save_interval:
+            return
+        with self._session_lock:
+            self._save_session(loader)
+
+    def _save_session(self, loader):
+        os.makedirs(self.session_dir, exist_ok=True)
+        temp_path = self.session_file + '.tmp'
+        loader.save_session_to_file(temp_path)
+        os.replace(temp_path, self.session_file)
+        self._session_saved_at = time.time()
+
+    @contextmanager
+    def loader(self, options):
+        """Borrow a loader whose media downloads run in parallel.
+
+        Leaving the block waits for every media file the loader queued and
+        re-raises the first download error.
+        """
+        futures = []
+        with self.pool.borrow(options) as loader:
+            loader.download_pic = lambda filename, url, mtime, filename_suffix=None, _attempt=1: self.queue_media(
+                loader, futures, filename, url, mtime, filename_suffix
+            )
+            try:
+                yield loader
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+                del loader.download_pic
+                self.save_session(loader)
+
+    def queue_media(self, loader, futures, filename, url, mtime, filename_suffix=None):
+        """Stand-in for Instaloader.download_pic that fetches the file on the media pool"""
+        if filename_suffix is not None:
+            filename += '_' + filename_suffix
+        futures.append(self.media_pool.submit(self.fetch_media, loader, filename, url, mtime))
+        return True
+
+    def fetch_media(self, loader, filename, url, mtime):
+        """Download one media file like Instaloader.download_pic, over the shared media session"""
+        urlmatch = re.search('\\.[a-z0-9]*\\?', url)
+        file_extension = url[-3:] if urlmatch is None else urlmatch.group(0)[1:-1]
+        nominal_filename = filename + '.' + file_extension
+        if os.path.isfile(nominal_filename):
+            return False
+        resp = self.media_session.get(url, stream=True, timeout=60)
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        content_type = resp.headers.get('Content-Type')
+        if content_type:
+            filename += ('.' + content_type.split(';')[0].split('/')[-1]).lower().replace('jpeg', 'jpg')
+        else:
+            filename = nominal_filename
+        if filename != nominal_filename and os.path.isfile(filename):
+            resp.close()
+            return False
+        loader.context.write_raw(resp, filename)
+        os.utime(filename, (datetime.now().timestamp(), mtime.timestamp()))
+        self.files_fetched += 1
+        return True
+
+    def stats(self):
+        return {
+            'logged_in_as': self.username if self.username and os.path.isfile(self.session_file) else None,
+            'rate_limit': self.bucket.stats(),
+            'files_fetched': self.files_fetched
+        }
@@ -0,0 +1,682 @@
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has reached its configured depth"""
+    pass
+
+
+class JobTakenOverError(Exception):
+    """Raised into a job's runner once another worker owns the job, to stop the local run"""
+    pass
+
+
+def worker_id():
+    """Owner ID of the jobs this process runs: host name and pid, plus a random part as pids get reused"""
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+def dead_local_workers(workers):
+    """Workers among `workers` that were processes on this host which no longer exist"""
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        return []
+    dead = []
+    for worker in workers:
+        match = re.fullmatch(r'(.+)-(\d+)(?:-[0-9a-f]{6})?', worker or '')
+        if not match or match.group(1) != socket.gethostname() or int(match.group(2)) == os.getpid():
+            continue
+        try:
+            os.kill(int(match.group(2)), 0)
+        except ProcessLookupError:
+            dead.append(worker)
+        except OSError:
+            pass
+    return dead
+
+
+class Job:
+    """A single download request tracked by the JobManager"""
+
+    def __init__(self, url, platform, quality=None, key=None, sync=False, priority='interactive'):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.platform = platform
+        self.quality = quality
+        self.key = key
+        self.sync = sync  # only fetch items newer than the source's last sync
+        self.priority = priority  # interactive or bulk: queue order and bandwidth share
+        self.folder = None
+        self.attached = 0
+        self.state = 'queued'  # queued, running, completed, failed
+        self.phase = 'queued'  # queued, extract, download, merge, postprocess, done
+        self.progress = 0
+        self.message = 'Waiting in queue...'
+        self.filename = ''
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = None
+        self.eta = None
+        self.entries = []  # per-entry state for playlist jobs
+        self.worker = None  # worker process that claimed the job (external worker mode)
+        self.version = 0
+        self.persisted_at = 0
+        self.taken_over = False  # requeued to another worker while running here
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a job from a JobStore record"""
+        job = cls(record['url'], record['platform'], record['quality'], record['key'], bool(record.get('sync')),
+                  record.get('priority') or 'interactive')
+        for field in ('id', 'folder', 'state', 'message', 'result', 'created_at', 'started_at', 'finished_at',
+                      'filename', 'speed', 'eta', 'worker'):
+            setattr(job, field, record.get(field))
+        for field in ('progress', 'downloaded_bytes', 'total_bytes', 'version'):
+            setattr(job, field, record.get(field) or 0)
+        job.phase = record.get('phase') or ('done' if job.finished else 'queued')
+        job.filename = job.filename or ''
+        job.entries = record.get('entries') or []
+        return job
+
+    @property
+    def finished(self):
+        return self.state in ('completed', 'failed')
+
+    def to_record(self):
+        """Fields persisted by the JobStore"""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'platform': self.platform,
+            'quality': self.quality,
+            'key': self.key,
+            'sync': self.sync,
+            'priority': self.priority,
+            'state': self.state,
+            'folder': self.folder,
+            'message': self.message,
+            'progress': self.progress,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'phase': self.phase,
+            'filename': self.filename,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+            'entries': self.entries,
+            'worker': self.worker,
+            'heartbeat_at': time.time() if self.worker and not self.finished else None,
+            'version': self.version,
+        }
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'platform': self.platform,
+            'quality': self.quality,
+            'sync': self.sync,
+            'priority': self.priority,
+            'folder': self.folder,
+            'attached': self.attached,
+            'state': self.state,
+            'phase': self.phase,
+            'progress': self.progress,
+            'message': self.message,
+            'filename': self.filename,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+            'entries': self.entries,
+            'worker': self.worker,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs download jobs on a bounded pool of worker threads.
+
+    A running job that reports an OFFLOADED_PHASES phase only waits for the
+    post-processing stage, so it gives up its worker and platform slot: a
+    replacement worker starts on the next queued job, and the surplus thread
+    exits once the offloaded job finishes. At most `max_offloaded` jobs wait
+    on the stage like that; past it, jobs keep their slot while they wait,
+    so a slow stage holds back new downloads instead of piling up behind.
+    """
+
+    OFFLOADED_PHASES = ('postprocess', 'merge')
+
+    def __init__(self, runner, max_workers=4, queue_depth=50, history=500,
+                 platform_limit=None, platform_limits=None, store=None, progress_interval=None, owner=None,
+                 max_offloaded=None):
+        self.runner = runner
+        self.store = store
+        # Jobs queued here are recorded as owned by this process, so another
+        # process sharing the store does not resume them while it is alive
+        self.owner = owner or worker_id()
+        self._keeper = None
+        # When set, progress updates are also written to the store at most this
+        # often, so a web process reading the store can follow them
+        self.progress_interval = progress_interval
+        self.max_workers = max(1, max_workers)
+        self.max_offloaded = self.max_workers if max_offloaded is None else max_offloaded
+        self.queue_depth = max(1, queue_depth)
+        self.history = history
+        # Per-platform concurrency caps so one host can't take every worker
+        self.platform_limit = platform_limit or self.max_workers
+        self.platform_limits = dict(platform_limits or {})
+        self._lock = threading.Lock()
+        # Workers wait on _cond for queued jobs; progress streams wait on _updates
+        self._cond = threading.Condition(self._lock)
+        self._updates = threading.Condition(self._lock)
+        self._queue = deque()
+        self._jobs = OrderedDict()
+        self._workers = []
+        self._inflight = {}
+        self._running = 0
+        self._platform_running = Counter()
+        self._offloaded = set()
+        self.coalesced = 0
+        self._finished_count = 0
+
+    def submit(self, url, platform, quality=None, key=None, sync=False, priority='interactive'):
+        """Queue a new job and return it, raising QueueFullError if there is no room"""
+        return self.submit_or_attach(url, platform, quality, key, sync, priority)[0]
+
+    def submit_or_attach(self, url, platform, quality=None, key=None, sync=False, priority='interactive'):
+        """Queue a job, or attach to the unfinished job with the same key.
+
+        Returns (job, attached) where attached is True if an existing job was reused.
+        """
+        with self._cond:
+            if key is not None and key in self._inflight:
+                job = self._inflight[key]
+                job.attached += 1
+                self.coalesced += 1
+                return job, True
+            if len(self._queue) >= self.queue_depth:
+                raise QueueFullError(f'Download queue is full ({self.queue_depth} jobs waiting)')
+            job = Job(url, platform, quality, key, sync, priority)
+            job.worker = self.owner
+            self._enqueue(job)
+            self._cond.notify()
+        self.persist(job)
+        return job, False
+
+    def resume_unfinished(self, stale_after=60):
+        """Re-queue jobs left unfinished by a process that stopped, e.g. before a restart.
+
+        Each process heartbeats the jobs it owns and atomically claims the
+        orphaned ones, so processes sharing the store never resume the same
+        job. Jobs of a process on this host that no longer exists are taken
+        over at once, others once their heartbeat is `stale_after` seconds
+        old; a background thread keeps checking.
+        """
+        if not self.store:
+            return []
+        resumed = self._resume_orphans(stale_after)
+        with self._cond:
+            if self._keeper is None:
+                self._keeper = threading.Thread(
+                    target=self._keep_jobs, args=(stale_after,), name='job-keeper', daemon=True
+                )
+                self._keeper.start()
+        return resumed
+
+    def _resume_orphans(self, stale_after):
+        self.requeue_orphans(stale_after)
+        resumed = []
+        with self._cond:
+            for record in self.store.adopt_unowned(self.owner):
+                if record['id'] in self._jobs:
+                    continue
+                job = Job.from_record(record)
+                job.state = 'queued'
+                job.message = 'Resuming after restart...'
+                self._enqueue(job)
+                resumed.append(job)
+            self._cond.notify_all()
+        return resumed
+
+    def _keep_jobs(self, stale_after):
+        while True:
+            time.sleep(max(1, stale_after / 4))
+            try:
+                self.store.heartbeat(self.owner)
+                self._resume_orphans(stale_after)
+            except Exception:
+                # The store may be locked by another process for a while; try again next round
+                pass
+
+    def requeue_orphans(self, stale_after):
+        """Put jobs of workers that stopped heartbeating or exited back in the queue"""
+        return self.store.requeue_stale(stale_after, dead_local_workers(self.store.unfinished_workers()))
+
+    def persist(self, job):
+        """Write the job's durable fields to the store, if there is one.
+
+        Returns False once the job was requeued to another worker, which then
+        owns its record; this process must stop running it.
+        """
+        if self.store and not job.taken_over:
+            job.persisted_at = time.time()
+            if not self.store.save(job):
+                job.taken_over = True
+        return not job.taken_over
+
+    def idle_slots(self):
+        """Workers that have nothing running or queued for them"""
+        with self._cond:
+            return max(0, self.max_workers - self._running - len(self._queue))
+
+    def adopt(self, job):
+        """Queue a job claimed from the shared store by this worker process"""
+        with self._cond:
+            self._enqueue(job)
+            self._cond.notify()
+
+    def serve_store_queue(self, worker, poll_interval=1.0, stale_after=60):
+        """Worker-process main loop: claim queued jobs from the store and run them.
+
+        Running jobs are heartbeated so other workers can re-queue them if this
+        process dies; this loop re-queues jobs of workers that stopped.
+        """
+        while True:
+            self.requeue_orphans(stale_after)
+            for record in self.store.claim(worker, self.idle_slots(), self.limit_for):
+                job = Job.from_record(record)
+                job.worker = worker
+                self.adopt(job)
+            self.store.heartbeat(worker)
+            time.sleep(poll_interval)
+
+    def _enqueue(self, job):
+        self._jobs[job.id] = job
+        if job.key is not None:
+            self._inflight[job.key] = job
+        self._queue.append(job)
+        self._trim_history()
+        self._ensure_workers()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            # Jobs dropped from memory (or from before a restart) are still on record
+            record = self.store.load(job_id)
+            if record:
+                job = Job.from_record(record)
+        return job
+
+    def list_jobs(self):
+        with self._cond:
+            return list(self._jobs.values())
+
+    def latest(self):
+        with self._cond:
+            if not self._jobs:
+                return None
+            return next(reversed(self._jobs.values()))
+
+    def update(self, job, **fields):
+        """Update progress fields of a job from a worker thread"""
+        with self._cond:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            if self._can_offload(job):
+                self._offload(job)
+            self._changed(job)
+        if self.progress_interval is not None and time.time() - job.persisted_at >= self.progress_interval:
+            self.persist(job)
+        if job.taken_over:
+            raise JobTakenOverError(f'Job {job.id} was taken over by another worker')
+
+    def wait_for_update(self, job, version, timeout=None):
+        """Block until the job changes past `version`; returns (snapshot, version) or (None, version) on timeout"""
+        with self._updates:
+            if not self._updates.wait_for(lambda: job.version != version, timeout):
+                return None, version
+            return job.to_dict(), job.version
+
+    def as_completed(self, jobs):
+        """Yield the given jobs in the order they finish"""
+        pending = list(jobs)
+        while pending:
+            with self._updates:
+                self._updates.wait_for(lambda: any(job.finished for job in pending))
+                done = [job for job in pending if job.finished]
+                pending = [job for job in pending if not job.finished]
+            for job in done:
+                yield job
+
+    def wait_for_finished(self, count, timeout=None):
+        """Block until more than `count` jobs have finished; returns the new count"""
+        with self._updates:
+            self._updates.wait_for(lambda: self._finished_count != count, timeout)
+            return self._finished_count
+
+    @property
+    def finished_count(self):
+        with self._cond:
+            return self._finished_count
+
+    def _can_offload(self, job):
+        return (job.phase in self.OFFLOADED_PHASES and job.state == 'running' and job.id not in self._offloaded
+                and len(self._offloaded) < self.max_offloaded)
+
+    def _offload(self, job):
+        self._offloaded.add(job.id)
+        self._running -= 1
+        self._platform_running[job.platform] -= 1
+        self._ensure_workers()
+        self._cond.notify_all()
+
+    def _changed(self, job):
+        job.version += 1
+        self._updates.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'mode': 'inline',
+                'workers': self.max_workers,
+                'running': self._running,
+                'running_by_platform': dict(self._platform_running),
+                'postprocessing': len(self._offloaded),
+                'queued': len(self._queue),
+                'queue_depth': self.queue_depth,
+                'tracked_jobs': len(self._jobs),
+                'coalesced': self.coalesced,
+            }
+
+    def limit_for(self, platform):
+        return self.platform_limits.get(platform, self.platform_limit)
+
+    def slot_group(self, platform):
+        """Worker slots for the parallel sub-tasks of a job running on this manager"""
+        return SlotGroup(self, platform)
+
+    def try_acquire_slot(self, platform):
+        """Take a spare worker slot for extra parallel work of a running job.
+
+        Fails when the worker or platform cap is reached, or when a queued job
+        could use the slot instead.
+        """
+        with self._cond:
+            if self._running >= self.max_workers or self._platform_running[platform] >= self.limit_for(platform):
+                return False
+            if any(self._platform_running[job.platform] < self.limit_for(job.platform) for job in self._queue):
+                return False
+            self._running += 1
+            self._platform_running[platform] += 1
+            return True
+
+    def release_slot(self, platform):
+        with self._cond:
+            self._running -= 1
+            self._platform_running[platform] -= 1
+            self._cond.notify_all()
+
+    def _next_runnable(self):
+        # Oldest queued job whose platform is still under its concurrency cap,
+        # interactive jobs ahead of bulk ones; slots borrowed by running jobs count too
+        if self._running >= self.max_workers:
+            return None
+        for priorities in (('interactive',), ('interactive', 'bulk')):
+            for job in self._queue:
+                if job.priority in priorities and self._platform_running[job.platform] < self.limit_for(job.platform):
+                    self._queue.remove(job)
+                    return job
+        return None
+
+    def _ensure_workers(self):
+        # Workers are started lazily so importing the app does not spawn threads
+        while len(self._workers) < self.max_workers + len(self._offloaded):
+            worker = threading.Thread(target=self._worker_loop, name=f'download-worker-{len(self._workers)}')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _trim_history(self):
+        # Forget the oldest finished jobs once we track more than `history` of them
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+            del self._jobs[job_id]
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    if len(self._workers) > self.max_workers + len(self._offloaded):
+                        # A replacement took this worker's place while its job was offloaded
+                        self._workers.remove(threading.current_thread())
+                        return
+                    job = self._next_runnable()
+                    if job is None:
+                        self._cond.wait()
+                job.state = 'running'
+                job.message = 'Starting download...'
+                job.started_at = time.time()
+                self._running += 1
+                self._platform_running[job.platform] += 1
+                self._changed(job)
+            self.persist(job)
+            self._run(job)
+
+    def _run(self, job):
+        try:
+            if job.taken_over:
+                raise JobTakenOverError(f'Job {job.id} was taken over by another worker')
+            result = self.runner(job)
+        except Exception as e:
+            result = {'status': 'error', 'message': f'Error: {str(e)}'}
+        with self._cond:
+            if job.id in self._offloaded:
+                self._offloaded.discard(job.id)
+                # Its place on the stage goes to a job that kept its slot while waiting
+                waiting = next(
+                    (other for other in self._jobs.values() if other is not job and self._can_offload(other)), None
+                )
+                if waiting is not None:
+                    self._offload(waiting)
+            else:
+                self._running -= 1
+                self._platform_running[job.platform] -= 1
+            if job.key is not None and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            # A freed platform slot may unblock a job another worker skipped
+            self._cond.notify_all()
+            job.result = result
+            job.finished_at = time.time()
+            job.phase = 'done'
+            job.speed = None
+            job.eta = None
+            if result.get('status') == 'success':
+                job.state = 'completed'
+                job.progress = 100
+                job.message = 'Download completed!'
+            else:
+                job.state = 'failed'
+                job.progress = 0
+                job.message = result.get('message', 'Download failed')
+            self._changed(job)
+        # The final save also tells whether another worker took the job over meanwhile
+        taken_over = not self.persist(job)
+        with self._cond:
+            if taken_over:
+                # Its record belongs to the new owner; look the job up there from now on
+                job.message = 'Taken over by another worker'
+                self._jobs.pop(job.id, None)
+            else:
+                self._finished_count += 1
+            self._changed(job)
+
+
+class SlotGroup:
+    """Worker slots of one running job for its parallel sub-tasks, e.g. playlist entries.
+
+    One sub-task at a time runs on the job's own slot; each further
+    concurrent one borrows a spare slot from the JobManager, so it counts
+    against the worker and platform caps, and gives it back when it is done.
+    """
+
+    def __init__(self, manager, platform, poll_interval=0.5):
+        self.manager = manager
+        self.platform = platform
+        self.poll_interval = poll_interval
+        self._own_free = True
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        borrowed = False
+        with self._cond:
+            while True:
+                if self._own_free:
+                    self._own_free = False
+                    break
+                if self.manager.try_acquire_slot(self.platform):
+                    borrowed = True
+                    break
+                # Slots free up elsewhere in the manager too, so check again now and then
+                self._cond.wait(self.poll_interval)
+        try:
+            yield
+        finally:
+            if borrowed:
+                self.manager.release_slot(self.platform)
+            with self._cond:
+                if not borrowed:
+                    self._own_free = True
+                self._cond.notify()
+
+
+class JobQueueClient:
+    """Web-tier view of a JobStore shared with separate worker processes.
+
+    It offers the parts of the JobManager interface the routes use, but only
+    enqueues jobs and reads their status; `python app.py worker` processes
+    do the downloading.
+    """
+
+    def __init__(self, store, queue_depth=50, history=500, platform_limit=None,
+                 platform_limits=None, poll_interval=0.5):
+        self.store = store
+        self.queue_depth = max(1, queue_depth)
+        self.history = history
+        self.platform_limit = platform_limit
+        self.platform_limits = dict(platform_limits or {})
+        self.poll_interval = poll_interval
+        self.coalesced = 0
+
+    def submit(self, url, platform, quality=None, key=None, sync=False, priority='interactive'):
+        return self.submit_or_attach(url, platform, quality, key, sync, priority)[0]
+
+    def submit_or_attach(self, url, platform, quality=None, key=None, sync=False, priority='interactive'):
+        job = Job(url, platform, quality, key, sync, priority)
+        try:
+            existing, attached = self.store.enqueue(job, self.queue_depth)
+        except OverflowError:
+            raise QueueFullError(f'Download queue is full ({self.queue_depth} jobs waiting)')
+        if attached:
+            self.coalesced += 1
+            return Job.from_record(existing), True
+        return job, False
+
+    def get(self, job_id):
+        record = self.store.load(job_id)
+        return Job.from_record(record) if record else None
+
+    def list_jobs(self):
+        return [Job.from_record(record) for record in self.store.recent(self.history)]
+
+    def latest(self):
+        records = self.store.recent(1)
+        return Job.from_record(records[0]) if records else None
+
+    def update(self, job, **fields):
+        for key, value in fields.items():
+            setattr(job, key, value)
+        self.persist(job)
+
+    def persist(self, job):
+        self.store.save(job)
+
+    def resume_unfinished(self, stale_after=60):
+        # Worker processes re-queue jobs whose worker died; nothing to do here
+        return []
+
+    def stats(self):
+        counts = self.store.counts()
+        return {
+            'mode': 'external',
+            'busy_workers': counts['busy_workers'],
+            'running': counts['states'].get('running', 0),
+            'running_by_platform': counts['running_by_platform'],
+            'queued': counts['states'].get('queued', 0),
+            'queue_depth': self.queue_depth,
+            'tracked_jobs': sum(counts['states'].values()),
+            'coalesced': self.coalesced,
+        }
+
+    def wait_for_update(self, job, version, timeout=None):
+        """Poll the store until the job's version moves past `version`"""
+        deadline = time.time() + (timeout if timeout is not None else float('inf'))
+        while True:
+            current = self.store.version(job.id)
+            if current is not None and current != version:
+                fresh = self.get(job.id)
+                return fresh.to_dict(), fresh.version
+            if time.time() >= deadline:
+                return None, version
+            time.sleep(self.poll_interval)
+
+    def as_completed(self, jobs):
+        pending = list(jobs)
+        while pending:
+            still_pending = []
+            for job in pending:
+                fresh = self.get(job.id)
+                if fresh is not None and fresh.finished:
+                    yield fresh
+                elif fresh is not None:
+                    still_pending.append(job)
+            pending = still_pending
+            if pending:
+                time.sleep(self.poll_interval)
+
+    @property
+    def finished_count(self):
+        return self.store.finished_count()
+
+    def wait_for_finished(self, count, timeout=None):
+        deadline = time.time() + (timeout if timeout is not None else float('inf'))
+        while True:
+            current = self.store.finished_count()
+            if current != count or time.time() >= deadline:
+                return current
+            time.sleep(self.poll_interval)
+
+    def finished_folders_since(self, timestamp):
+        return self.store.finished_folders_since(timestamp)
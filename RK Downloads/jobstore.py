@@ -0,0 +1,295 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+COLUMNS = (
+    'id', 'url', 'platform', 'quality', 'key', 'state', 'folder', 'message',
+    'progress', 'result', 'created_at', 'started_at', 'finished_at',
+    'phase', 'filename', 'downloaded_bytes', 'total_bytes', 'speed', 'eta',
+    'entries', 'worker', 'heartbeat_at', 'version', 'sync', 'priority'
+)
+
+# Columns added after the first release of the table, with their SQL types
+ADDED_COLUMNS = {
+    'phase': 'TEXT',
+    'filename': 'TEXT',
+    'downloaded_bytes': 'INTEGER',
+    'total_bytes': 'INTEGER',
+    'speed': 'REAL',
+    'eta': 'REAL',
+    'entries': 'TEXT',
+    'worker': 'TEXT',
+    'heartbeat_at': 'REAL',
+    'version': 'INTEGER',
+    'sync': 'INTEGER',
+    'priority': 'TEXT',
+}
+
+JSON_COLUMNS = ('result', 'entries')
+
+
+class JobStore:
+    """SQLite-backed record of download jobs, so queued and running work survives restarts.
+
+    The same database doubles as the queue between the web process and
+    separate worker processes (`python app.py worker`).
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                platform TEXT,
+                quality TEXT,
+                key TEXT,
+                state TEXT NOT NULL,
+                folder TEXT,
+                message TEXT,
+                progress REAL,
+                result TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        existing = {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state)')
+        # Metrics snapshots of worker processes, which serve no HTTP themselves.
+        # Rows of workers that exited stay, so totals never go backwards.
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS worker_metrics (
+                worker TEXT PRIMARY KEY,
+                updated_at REAL,
+                snapshot TEXT
+            )
+        ''')
+
+    def save(self, job):
+        """Insert or update the stored copy of a job.
+
+        A job owned by a worker is only written while that worker still owns
+        it: returns False, leaving the record alone, if the job was requeued
+        or claimed by another worker in the meantime.
+        """
+        with self._lock:
+            if job.worker is None:
+                return self._insert(job)
+            values = self._values(job)
+            cursor = self._conn.execute(
+                f'UPDATE jobs SET {", ".join(f"{column} = ?" for column in COLUMNS)} WHERE id = ? AND worker = ?',
+                [values[column] for column in COLUMNS] + [job.id, job.worker]
+            )
+            if cursor.rowcount:
+                return True
+            # Either the job is new, or it is on record with another owner now
+            return self._insert(job, replace=False)
+
+    def enqueue(self, job, queue_depth):
+        """Atomically queue job unless an unfinished job has the same key.
+
+        Returns (record_of_existing_job, True) when attaching, (None, False)
+        when job was queued, and raises OverflowError if the queue is full.
+        """
+        with self._lock, self._transaction():
+            if job.key is not None:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE key = ? AND state IN ('queued', 'running') LIMIT 1", (job.key,)
+                ).fetchone()
+                if row:
+                    return self._record(row), True
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+            if queued >= queue_depth:
+                raise OverflowError(queued)
+            self._insert(job)
+        return None, False
+
+    def claim(self, worker, slots, limit_for):
+        """Mark up to `slots` queued jobs as running on `worker` and return their records.
+
+        Jobs are taken oldest first (interactive ones before bulk ones),
+        skipping platforms that already have limit_for(platform) jobs running
+        across all workers.
+        """
+        if slots <= 0:
+            return []
+        now = time.time()
+        with self._lock, self._transaction():
+            running = dict(self._conn.execute(
+                "SELECT platform, COUNT(*) FROM jobs WHERE state = 'running' GROUP BY platform"
+            ).fetchall())
+            claimed = []
+            for row in self._conn.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' AND worker IS NULL ORDER BY priority = 'bulk', created_at LIMIT ?",
+                (slots * 20,)
+            ).fetchall():
+                if len(claimed) >= slots:
+                    break
+                if running.get(row['platform'], 0) >= limit_for(row['platform']):
+                    continue
+                running[row['platform']] = running.get(row['platform'], 0) + 1
+                claimed.append(row['id'])
+            self._conn.executemany(
+                "UPDATE jobs SET state = 'running', worker = ?, heartbeat_at = ? WHERE id = ?",
+                [(worker, now, job_id) for job_id in claimed]
+            )
+            rows = [self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone() for job_id in claimed]
+        return [self._record(row) for row in rows]
+
+    def heartbeat(self, worker):
+        """Refresh the heartbeat of every unfinished job owned by worker"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE worker = ? AND state IN ('queued', 'running')", (time.time(), worker)
+            )
+
+    def requeue_stale(self, stale_after, workers=()):
+        """Put unfinished jobs whose worker stopped heartbeating (or is one of `workers`) back in the queue"""
+        placeholders = ', '.join('?' for _ in workers)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL, message = 'Resuming after worker loss...', "
+                "version = COALESCE(version, 0) + 1 "
+                "WHERE state IN ('queued', 'running') AND worker IS NOT NULL "
+                f"AND (heartbeat_at < ? OR worker IN ({placeholders}))",
+                (time.time() - stale_after, *workers)
+            )
+            return cursor.rowcount
+
+    def adopt_unowned(self, worker):
+        """Give every unfinished job without a worker to `worker`; returns their records, oldest first.
+
+        Used by processes that run the jobs they queue themselves, so that
+        several of them sharing the store never resume the same job.
+        """
+        now = time.time()
+        with self._lock, self._transaction():
+            ids = [row[0] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE state IN ('queued', 'running') AND worker IS NULL ORDER BY created_at"
+            ).fetchall()]
+            self._conn.executemany(
+                'UPDATE jobs SET worker = ?, heartbeat_at = ? WHERE id = ?', [(worker, now, job_id) for job_id in ids]
+            )
+            rows = [self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone() for job_id in ids]
+        return [self._record(row) for row in rows]
+
+    def unfinished_workers(self):
+        """Workers that own queued or running jobs"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT worker FROM jobs WHERE state IN ('queued', 'running') AND worker IS NOT NULL"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def load(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def version(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT version FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def unfinished(self):
+        """Jobs that were queued or running, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def recent(self, limit):
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+        return [self._record(row) for row in reversed(rows)]
+
+    def finished_count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('completed', 'failed')"
+            ).fetchone()[0]
+
+    def finished_folders_since(self, timestamp):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT folder FROM jobs WHERE finished_at >= ? AND folder IS NOT NULL", (timestamp,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def counts(self, heartbeat_within=60):
+        """Queue and worker statistics across all processes"""
+        with self._lock:
+            states = dict(self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+            by_platform = dict(self._conn.execute(
+                "SELECT platform, COUNT(*) FROM jobs WHERE state = 'running' GROUP BY platform"
+            ).fetchall())
+            workers = self._conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM jobs WHERE state = 'running' AND heartbeat_at >= ?",
+                (time.time() - heartbeat_within,)
+            ).fetchone()[0]
+        return {'states': states, 'running_by_platform': by_platform, 'busy_workers': workers}
+
+    def save_metrics(self, worker, snapshot):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO worker_metrics (worker, updated_at, snapshot) VALUES (?, ?, ?)',
+                (worker, time.time(), json.dumps(snapshot))
+            )
+
+    def worker_metrics(self):
+        """Latest metrics snapshot of every worker process"""
+        with self._lock:
+            rows = self._conn.execute('SELECT snapshot FROM worker_metrics').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _insert(self, job, replace=True):
+        values = self._values(job)
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        cursor = self._conn.execute(
+            f'INSERT OR {"REPLACE" if replace else "IGNORE"} INTO jobs ({", ".join(COLUMNS)}) VALUES ({placeholders})',
+            [values[column] for column in COLUMNS]
+        )
+        return cursor.rowcount > 0
+
+    def _values(self, job):
+        record = job.to_record()
+        for column in JSON_COLUMNS:
+            record[column] = json.dumps(record[column]) if record[column] is not None else None
+        return record
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def _record(self, row):
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            record[column] = json.loads(record[column]) if record[column] else None
+        return record
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent processes can't claim the same job"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
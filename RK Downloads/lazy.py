@@ -0,0 +1,32 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access.
+
+    `yt_dlp = LazyModule('yt_dlp')` keeps call sites like `yt_dlp.YoutubeDL`
+    unchanged while letting the web process start without loading it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}{" (loaded)" if self.loaded else ""}>'
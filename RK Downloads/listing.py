@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+import uuid
+
+
+class DownloadIndex:
+    """In-memory index of the downloads directory backing the /downloads listing.
+
+    Job folders are rescanned when their job finishes. Folders added or
+    removed by anything else are picked up by comparing the directory's
+    mtime and rescanning only the changed names; a full os.scandir rebuild
+    runs at most every `max_age` seconds as a safety net.
+    """
+
+    SORT_KEYS = ('mtime', 'name', 'size')
+
+    def __init__(self, root, max_age=300):
+        self.root = root
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._items = {}
+        self._root_mtime = None
+        self._built_at = 0
+        # The epoch keeps ETags from one process from matching another's
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+
+    @property
+    def etag(self):
+        self._ensure_fresh()
+        return f'{self._epoch}-{self._version}'
+
+    def items(self):
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._items.values())
+
+    def page(self, sort='mtime', order='desc', page=1, per_page=100):
+        """Return (items, total) for one page of the listing"""
+        if sort not in self.SORT_KEYS:
+            sort = 'mtime'
+        items = sorted(self.items(), key=lambda item: item[sort], reverse=(order == 'desc'))
+        start = (page - 1) * per_page
+        return items[start:start + per_page], len(items)
+
+    def refresh(self, name):
+        """Rescan a single entry, e.g. a job folder whose download just finished"""
+        if not name:
+            return
+        with self._lock:
+            self._update(name)
+
+    def rebuild(self):
+        with self._lock:
+            self._sync(full=True)
+
+    def _ensure_fresh(self):
+        try:
+            root_mtime = os.stat(self.root).st_mtime_ns
+        except OSError:
+            root_mtime = None
+        with self._lock:
+            if time.time() - self._built_at > self.max_age:
+                self._sync(full=True)
+            elif root_mtime != self._root_mtime:
+                self._sync()
+
+    def _sync(self, full=False):
+        # Unless full, only names that appeared or disappeared since the last sync are scanned
+        try:
+            self._root_mtime = os.stat(self.root).st_mtime_ns
+            with os.scandir(self.root) as entries:
+                names = {entry.name for entry in entries if not entry.name.startswith('.')}
+        except OSError:
+            self._root_mtime = None
+            names = set()
+        for name in set(self._items) - names:
+            del self._items[name]
+            self._version += 1
+        for name in (names if full else names - set(self._items)):
+            self._update(name)
+        if full:
+            self._built_at = time.time()
+
+    def _update(self, name):
+        path = os.path.join(self.root, name)
+        item = None
+        try:
+            stat = os.stat(path)
+            if os.path.isdir(path):
+                file_count = 0
+                size = 0
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            file_count += 1
+                            size += entry.stat().st_size
+                item = {'name': name, 'type': 'folder', 'file_count': file_count, 'size': size, 'mtime': stat.st_mtime}
+            elif os.path.isfile(path):
+                item = {'name': name, 'type': 'file', 'size': stat.st_size, 'mtime': stat.st_mtime}
+        except OSError:
+            pass
+        if item is None:
+            if self._items.pop(name, None) is not None:
+                self._version += 1
+        elif self._items.get(name) != item:
+            self._items[name] = item
+            self._version += 1
@@ -0,0 +1,281 @@
+import bisect
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cache hit to a long merge
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Bytes per second, 64 KiB/s to 1 GiB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** exponent for exponent in range(8))
+
+# First matching pattern names the class of a failed job's error message
+ERROR_CLASSES = (
+    ('rate_limited', re.compile(r'HTTP Error 429|Too Many Requests|rate.?limit', re.I)),
+    ('login_required', re.compile(r'log ?in|sign in|private|authenticat|cookies', re.I)),
+    ('forbidden', re.compile(r'HTTP Error 403|forbidden', re.I)),
+    ('not_found', re.compile(r'HTTP Error 404|HTTP Error 410|not found|does not exist|unavailable|removed', re.I)),
+    ('server_error', re.compile(r'HTTP Error 5\d\d', re.I)),
+    ('timeout', re.compile(r'timed? ?out', re.I)),
+    ('network', re.compile(r'connection|resolve|network|unreachable|reset by peer', re.I)),
+    ('unsupported', re.compile(r'unsupported url|no video formats|not supported', re.I)),
+    ('postprocess', re.compile(r'ffmpeg|ffprobe|postprocess|merg', re.I)),
+    ('disk', re.compile(r'No space left|Errno 28|Permission denied|Errno 13', re.I)),
+)
+
+
+def classify_error(message):
+    """Coarse error class of a failed job's message, for metric labels"""
+    for error_class, pattern in ERROR_CLASSES:
+        if pattern.search(message or ''):
+            return error_class
+    return 'other'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, snapshots=()):
+        """Text format lines, with the values of other processes' snapshots added in"""
+        with self._lock:
+            values = dict(self._values)
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_labels(self.labels, key)} {value}' for key, value in sorted(values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                series[bucket] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._series.items()]
+
+    def render(self, snapshots=()):
+        """Text format lines, with the series of other processes' snapshots added in"""
+        with self._lock:
+            merged = {key: list(series) for key, series in self._series.items()}
+        for snapshot in snapshots:
+            for key, series in snapshot:
+                if len(series) != len(self.buckets) + 2:
+                    # Recorded with other buckets, e.g. by a worker running another version
+                    continue
+                total = merged.setdefault(tuple(key), [0] * len(series))
+                merged[tuple(key)] = [mine + theirs for mine, theirs in zip(total, series)]
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        label_names = self.labels + ('le',)
+        for key, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(label_names, key + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(label_names, key + ("+Inf",))} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, key)} {round(series[-2], 6)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+
+class JobTrace:
+    """Phase timeline of one download, built from the progress updates it reports.
+
+    Each phase change ('extract', 'download', 'postprocess', 'merge') closes
+    the previous phase and records its duration; `finish` closes the last
+    one and records the job's totals.
+    """
+
+    def __init__(self, metrics, platform, job_id=None, url=None):
+        self.metrics = metrics
+        self.platform = platform
+        self.job_id = job_id
+        self.url = url
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.phase = None
+        self.phase_started = self.started
+        self.phases = []
+        self.download_seconds = 0.0
+        self.downloaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, progress_hook):
+        """Progress hook that feeds this trace, then passes the update on"""
+        def hook(**fields):
+            self.update(**fields)
+            if progress_hook:
+                progress_hook(**fields)
+        return hook
+
+    def update(self, phase=None, downloaded_bytes=None, **fields):
+        with self._lock:
+            if downloaded_bytes:
+                self.downloaded_bytes = max(self.downloaded_bytes, downloaded_bytes)
+            if phase and phase != self.phase:
+                self._close_phase(time.monotonic())
+                self.phase = phase
+
+    def _close_phase(self, now):
+        if self.phase is not None:
+            seconds = now - self.phase_started
+            self.phases.append({'phase': self.phase, 'offset': round(self.phase_started - self.started, 3), 'seconds': round(seconds, 3)})
+            self.metrics.phase_seconds.observe(seconds, platform=self.platform, phase=self.phase)
+            if self.phase == 'download':
+                self.download_seconds += seconds
+        self.phase_started = now
+
+    def finish(self, result, downloaded_bytes=None):
+        """Record the outcome of the job; downloaded_bytes overrides the count seen in progress updates"""
+        now = time.monotonic()
+        with self._lock:
+            self._close_phase(now)
+            self.phase = None
+        if downloaded_bytes is not None:
+            self.downloaded_bytes = downloaded_bytes
+        status = 'success' if result.get('status') == 'success' else 'error'
+        error_class = classify_error(result.get('message')) if status == 'error' else None
+        metrics = self.metrics
+        metrics.job_seconds.observe(now - self.started, platform=self.platform, status=status)
+        metrics.jobs.inc(platform=self.platform, status=status)
+        metrics.downloaded_bytes.inc(self.downloaded_bytes, platform=self.platform)
+        if error_class:
+            metrics.errors.inc(platform=self.platform, error_class=error_class)
+        throughput = self.downloaded_bytes / self.download_seconds if self.download_seconds and self.downloaded_bytes else None
+        if throughput:
+            metrics.throughput.observe(throughput, platform=self.platform)
+        metrics.write_trace({
+            'job_id': self.job_id,
+            'url': self.url,
+            'platform': self.platform,
+            'status': status,
+            'error_class': error_class,
+            'message': result.get('message'),
+            'started_at': self.started_at,
+            'seconds': round(now - self.started, 3),
+            'downloaded_bytes': self.downloaded_bytes,
+            'throughput': round(throughput) if throughput else None,
+            'phases': self.phases
+        })
+
+
+class Metrics:
+    """Download pipeline instrumentation, rendered in the Prometheus text format.
+
+    Jobs report phase timings through a `JobTrace`; gauges (queue depth,
+    running workers, ...) are read from callbacks when /metrics is scraped.
+    Worker processes share their counters and histograms as `snapshot()`s,
+    which the web process adds into its own when rendering. With
+    `trace_path` set, every finished job also appends its phase timeline
+    to that JSON Lines file.
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self._trace_lock = threading.Lock()
+        self._gauges = []
+        self.phase_seconds = Histogram(
+            'rk_phase_seconds', 'Time download jobs spent per phase', PHASE_BUCKETS, ('platform', 'phase')
+        )
+        self.job_seconds = Histogram(
+            'rk_job_seconds', 'Download job run time, queueing excluded', PHASE_BUCKETS, ('platform', 'status')
+        )
+        self.throughput = Histogram(
+            'rk_download_throughput_bytes_per_second', 'Bytes per second over the download phase of a job',
+            THROUGHPUT_BUCKETS, ('platform',)
+        )
+        self.store_seconds = Histogram(
+            'rk_store_seconds', 'Time spent linking files into and out of the content store', PHASE_BUCKETS, ('operation',)
+        )
+        self.jobs = Counter('rk_jobs_total', 'Finished download jobs', ('platform', 'status'))
+        self.errors = Counter('rk_job_errors_total', 'Failed download jobs by error class', ('platform', 'error_class'))
+        self.downloaded_bytes = Counter('rk_downloaded_bytes_total', 'Bytes downloaded by jobs', ('platform',))
+
+    @property
+    def instruments(self):
+        return (self.phase_seconds, self.job_seconds, self.throughput, self.store_seconds,
+                self.jobs, self.errors, self.downloaded_bytes)
+
+    def trace(self, platform, job_id=None, url=None):
+        return JobTrace(self, platform, job_id, url)
+
+    def snapshot(self):
+        """Counter and histogram values as JSON-serializable data, for another process to render"""
+        return {instrument.name: instrument.snapshot() for instrument in self.instruments}
+
+    def gauge(self, name, help, read, labels=()):
+        """Register a gauge read at scrape time; read() returns a number, or {label values: number}"""
+        self._gauges.append((name, help, read, labels))
+
+    def write_trace(self, record):
+        if not self.trace_path:
+            return
+        line = json.dumps(record) + '\n'
+        with self._trace_lock, open(self.trace_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def render(self, snapshots=()):
+        """Prometheus text format, including the counters and histograms of other processes' snapshots"""
+        lines = []
+        for instrument in self.instruments:
+            lines += instrument.render([snapshot.get(instrument.name) or [] for snapshot in snapshots])
+        for name, help, read, labels in self._gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+            if isinstance(value, dict):
+                lines += [f'{name}{_labels(labels, key if isinstance(key, tuple) else (key,))} {count}'
+                          for key, count in sorted(value.items())]
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+instaloader = LazyModule('instaloader')
+
+
+class InstancePool:
+    """Idle downloader instances grouped by option profile, reused across jobs.
+
+    Building a YoutubeDL or Instaloader is expensive, and a reused one keeps
+    its initialized extractors and its HTTP connection pool. Options that
+    change on every job (output paths, hooks) are not part of the profile;
+    they are reset on each checkout by `prepare`.
+    """
+
+    # Options applied per checkout instead of being baked into the instance
+    PER_JOB_OPTIONS = ()
+
+    def __init__(self, max_idle=4, max_profiles=32):
+        self.max_idle = max_idle
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()
+        self.created = 0
+        self.reused = 0
+
+    def profile(self, options):
+        """Hashable key for the options that shape an instance"""
+        return json.dumps(
+            {key: value for key, value in options.items() if key not in self.PER_JOB_OPTIONS},
+            sort_keys=True, default=repr
+        )
+
+    def checkout(self, options):
+        """Take an idle instance for options (or build one) and prepare it for a job"""
+        profile = self.profile(options)
+        instance = None
+        with self._lock:
+            idle = self._idle.get(profile)
+            if idle:
+                instance = idle.pop()
+                self._idle.move_to_end(profile)
+                self.reused += 1
+        if instance is None:
+            instance = self.create(options)
+            with self._lock:
+                self.created += 1
+        self.prepare(instance, options)
+        return profile, instance
+
+    def checkin(self, profile, instance):
+        """Return an instance to the pool, closing it if the pool is full"""
+        self.prepare(instance, {})
+        with self._lock:
+            idle = self._idle.setdefault(profile, [])
+            self._idle.move_to_end(profile)
+            if len(idle) < self.max_idle:
+                idle.append(instance)
+                instance = None
+            evicted = []
+            while len(self._idle) > self.max_profiles:
+                evicted.extend(self._idle.popitem(last=False)[1])
+        for stale in evicted + ([instance] if instance is not None else []):
+            self.close(stale)
+
+    @contextmanager
+    def borrow(self, options):
+        profile, instance = self.checkout(options)
+        try:
+            yield instance
+        finally:
+            self.checkin(profile, instance)
+
+    def prewarm(self, options, count=1):
+        """Build instances for a profile ahead of the first job that needs them"""
+        instances = [self.checkout(options) for _ in range(count)]
+        for profile, instance in instances:
+            self.checkin(profile, instance)
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(instances) for instances in self._idle.values())
+            return {'created': self.created, 'reused': self.reused, 'idle': idle, 'profiles': len(self._idle)}
+
+    def create(self, options):
+        raise NotImplementedError
+
+    def prepare(self, instance, options):
+        raise NotImplementedError
+
+    def close(self, instance):
+        pass
+
+
+class YoutubeDLPool(InstancePool):
+    """Pool of YoutubeDL instances"""
+
+    PER_JOB_OPTIONS = (
+        'outtmpl', 'progress_hooks', 'postprocessor_hooks', 'ratelimit', 'http_chunk_size', 'bandwidth_lease',
+        'concurrent_fragment_downloads', 'retry_sleep_functions', 'logger', 'external_downloader_args'
+    )
+
+    def create(self, options):
+        return yt_dlp.YoutubeDL({key: value for key, value in options.items() if key not in self.PER_JOB_OPTIONS})
+
+    def prepare(self, ydl, options):
+        # Per-job options, plus the per-run counters YoutubeDL keeps between calls
+        ydl.params['outtmpl'] = options.get('outtmpl') or {}
+        ydl._parse_outtmpl()
+        ydl.params['progress_hooks'] = list(options.get('progress_hooks', []))
+        ydl.params['postprocessor_hooks'] = list(options.get('postprocessor_hooks', []))
+        ydl._progress_hooks = list(ydl.params['progress_hooks'])
+        ydl._postprocessor_hooks = list(ydl.params['postprocessor_hooks'])
+        ydl.params['ratelimit'] = options.get('ratelimit')
+        # The lease paces downloads from its progress hook; external downloaders
+        # read its share from the live ratelimit param when they start
+        if ydl.params.get('bandwidth_lease'):
+            ydl.params['bandwidth_lease'].detach(ydl.params)
+        lease = ydl.params['bandwidth_lease'] = options.get('bandwidth_lease')
+        ydl.params['http_chunk_size'] = options.get('http_chunk_size')
+        if lease:
+            lease.attach(ydl.params)
+        # Fragment parallelism, retry backoff and the logger belong to the job's
+        # DownloadEngine run; downloaders read them from the live params too
+        ydl.params['concurrent_fragment_downloads'] = options.get('concurrent_fragment_downloads', 1)
+        ydl.params['retry_sleep_functions'] = options.get('retry_sleep_functions') or {}
+        ydl.params['logger'] = options.get('logger')
+        ydl.params['external_downloader_args'] = options.get('external_downloader_args')
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+        ydl._playlist_level = 0
+        ydl._playlist_urls = set()
+
+    def warm_extractors(self, options, ie_keys):
+        """Instantiate extractors on an idle instance for options, ahead of its first job"""
+        with self.borrow(options) as ydl:
+            for ie_key in ie_keys:
+                ydl.get_info_extractor(ie_key)
+
+    def close(self, ydl):
+        ydl.close()
+
+
+class ProgressWriter:
+    """Chunked replacement for InstaloaderContext.write_raw that reports (and optionally paces) bytes written"""
+
+    def __init__(self, context, progress_hook=None, min_interval=0.25, throttle=None):
+        self.context = context
+        self.progress_hook = progress_hook
+        self.throttle = throttle
+        self.min_interval = min_interval
+        self.downloaded_bytes = 0
+        self.files_done = 0
+        self.last_report = 0
+        # Media files of one job may be written from several threads at once
+        self._lock = threading.Lock()
+
+    def __call__(self, resp, filename):
+        self.context.log(filename, end=' ', flush=True)
+        with open(filename + '.temp', 'wb') as file:
+            if isinstance(resp, requests.Response):
+                for chunk in resp.iter_content(chunk_size=65536):
+                    if self.throttle:
+                        self.throttle(len(chunk))
+                    file.write(chunk)
+                    self.add_bytes(len(chunk))
+            else:
+                file.write(resp)
+                self.add_bytes(len(resp))
+        os.replace(filename + '.temp', filename)
+        with self._lock:
+            self.files_done += 1
+            if not self.progress_hook:
+                return
+            self.progress_hook(
+                phase='download',
+                downloaded_bytes=self.downloaded_bytes,
+                filename=os.path.basename(filename),
+                message=f'Downloaded {self.files_done} files'
+            )
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.downloaded_bytes += count
+            if not self.progress_hook or time.time() - self.last_report < self.min_interval:
+                return
+            self.last_report = time.time()
+            self.progress_hook(phase='download', downloaded_bytes=self.downloaded_bytes)
+
+
+class InstaloaderPool(InstancePool):
+    """Pool of Instaloader instances; each keeps its own requests session"""
+
+    PER_JOB_OPTIONS = ('dirname_pattern', 'filename_pattern', 'progress_hook', 'throttle')
+
+    def __init__(self, max_idle=4, max_profiles=32, rate_controller=None, on_create=None):
+        super().__init__(max_idle, max_profiles)
+        self.rate_controller = rate_controller
+        self.on_create = on_create
+
+    def create(self, options):
+        # The first job's patterns also fix the loader's title_pattern, which
+        # only depends on whether they contain {target}/{profile}
+        loader = instaloader.Instaloader(
+            rate_controller=self.rate_controller,
+            **{key: value for key, value in options.items() if key not in ('progress_hook', 'throttle')}
+        )
+        if self.on_create:
+            self.on_create(loader)
+        return loader
+
+    def prepare(self, loader, options):
+        loader.dirname_pattern = options.get('dirname_pattern') or '{target}'
+        loader.filename_pattern = options.get('filename_pattern') or '{date_utc}_UTC'
+        # Undo a previous job's progress writer, then install this job's
+        loader.context.__dict__.pop('write_raw', None)
+        if options.get('progress_hook') or options.get('throttle'):
+            loader.context.write_raw = ProgressWriter(
+                loader.context, options.get('progress_hook'), throttle=options.get('throttle')
+            )
+
+    def close(self, loader):
+        loader.close()
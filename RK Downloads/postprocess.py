@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+
+class PostProcessStage:
+    """yt-dlp post-processing (ffmpeg merges, remuxes, fixups, conversions) on its own worker pool.
+
+    Downloads run inside `deferring(ydl)` record yt-dlp's post_process calls
+    instead of running them on the network thread; `submit` queues them on
+    this stage, whose pool is sized to the CPU count since each task spends
+    its time in an ffmpeg process.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 2
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='postprocess')
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    @contextmanager
+    def deferring(self, ydl):
+        """Record instead of run the post-processing of downloads made in the block"""
+        calls = []
+
+        def post_process(filename, info, files_to_move=None):
+            # yt-dlp reads the final path from info as soon as post_process returns
+            info['filepath'] = filename
+            calls.append((filename, info, files_to_move))
+            return info
+
+        ydl.post_process = post_process
+        try:
+            yield calls
+        finally:
+            del ydl.post_process
+
+    def submit(self, ydl, calls, then=None):
+        """Queue recorded post_process calls of ydl; then(error) runs on the stage once they are done"""
+        with self._lock:
+            self.queued += 1
+        return self.executor.submit(self._run, ydl, calls, then, time.monotonic())
+
+    def _run(self, ydl, calls, then, queued_at):
+        started = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += started - queued_at
+        error = None
+        try:
+            for filename, info, files_to_move in calls:
+                result = yt_dlp.YoutubeDL.post_process(ydl, filename, info, files_to_move)
+                # Like yt-dlp, keep the info dict the caller holds up to date
+                if result is not info:
+                    info.clear()
+                    info.update(result)
+        except Exception as e:
+            error = e
+        with self._lock:
+            self.running -= 1
+            self.run_seconds += time.monotonic() - started
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if then:
+            then(error)
+        if error is not None:
+            raise error
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': round(self.wait_seconds / finished, 2) if finished else None,
+                'avg_run_seconds': round(self.run_seconds / finished, 2) if finished else None
+            }
@@ -0,0 +1,158 @@
+import functools
+import re
+import threading
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+Route = namedtuple('Route', ['platform', 'ie_key', 'url'])
+
+# Registrable domain -> platform name used for folders, limits and dispatch
+HOST_PLATFORMS = {
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'youtube-nocookie.com': 'youtube',
+    'instagram.com': 'instagram',
+    'instagr.am': 'instagram',
+    'facebook.com': 'facebook',
+    'fb.watch': 'facebook',
+    'fb.com': 'facebook',
+    'twitter.com': 'twitter',
+    'x.com': 'twitter',
+    'tiktok.com': 'tiktok',
+    'pinterest.com': 'pinterest',
+    'pin.it': 'pinterest',
+    'linkedin.com': 'linkedin',
+    'snapchat.com': 'snapchat',
+    'reddit.com': 'reddit',
+    'redd.it': 'reddit',
+    'twitch.tv': 'twitch',
+}
+
+# Canonical host for platforms whose bare, www., m. and mobile. hosts serve the same paths
+CANONICAL_HOSTS = {
+    'youtube.com': 'www.youtube.com',
+    'youtu.be': 'www.youtube.com',
+    'youtube-nocookie.com': 'www.youtube.com',
+    'instagram.com': 'www.instagram.com',
+    'facebook.com': 'www.facebook.com',
+    'twitter.com': 'x.com',
+    'x.com': 'x.com',
+    'reddit.com': 'www.reddit.com',
+}
+
+MIRROR_SUBDOMAINS = ('', 'www.', 'm.', 'mobile.')
+
+# yt-dlp extractor name prefix for each platform
+IE_PREFIXES = {
+    'youtube': 'Youtube',
+    'instagram': 'Instagram',
+    'facebook': 'Facebook',
+    'twitter': 'Twitter',
+    'tiktok': 'TikTok',
+    'pinterest': 'Pinterest',
+    'linkedin': 'LinkedIn',
+    'snapchat': 'Snapchat',
+    'reddit': 'Reddit',
+    'twitch': 'Twitch',
+}
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|dclid|msclkid|mc_[ce]id|igshid|igsh)$')
+# Short share parameters that are only known to be noise on the platforms we route
+SHARE_PARAMS = re.compile(r'^(si|feature|pp|ref|ref_src|ref_url|share_\w+|is_from_webapp|sender_device|_r|_t|s|t)$')
+
+# Only these parameters identify a YouTube video or playlist
+YOUTUBE_KEEP_PARAMS = {'v', 'list'}
+
+YOUTUBE_ID_PATHS = re.compile(r'^/(?:shorts|embed|v|live|e)/([\w-]{11})')
+
+
+class UrlRouter:
+    """Hostname-based platform routing, URL canonicalization and yt-dlp extractor hints"""
+
+    def __init__(self, cache_size=4096):
+        self._extractors = None
+        self._lock = threading.Lock()
+        self.route = functools.lru_cache(maxsize=cache_size)(self._route)
+
+    @property
+    def extractors(self):
+        """Candidate extractors per platform, in yt-dlp's own priority order (built on first use)"""
+        if self._extractors is None:
+            with self._lock:
+                if self._extractors is None:
+                    extractors = {platform: [] for platform in IE_PREFIXES}
+                    for ie in yt_dlp.extractor.gen_extractor_classes():
+                        for platform, prefix in IE_PREFIXES.items():
+                            if ie.ie_key().startswith(prefix):
+                                extractors[platform].append(ie)
+                    self._extractors = extractors
+        return self._extractors
+
+    def platform_for_host(self, host):
+        """Match host and each of its parent domains against HOST_PLATFORMS"""
+        labels = host.split('.')
+        for start in range(len(labels) - 1):
+            platform = HOST_PLATFORMS.get('.'.join(labels[start:]))
+            if platform:
+                return platform
+        return 'unknown'
+
+    def canonicalize(self, url, platform=None):
+        """Stable form of url: no tracking parameters or fragment, lowercase host,
+        and platform variants (youtu.be, shorts, embed, m.) expanded.
+
+        URLs of unknown hosts only lose tracking parameters, so the generic
+        extractor still sees the page it was given.
+        """
+        parts = urlsplit(url.strip())
+        if not parts.scheme:
+            parts = urlsplit('https://' + url.strip())
+        host = (parts.hostname or '').lower()
+        platform = platform or self.platform_for_host(host)
+        path = parts.path or '/'
+        query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                 if not TRACKING_PARAMS.match(key)]
+        if platform == 'unknown':
+            netloc = f'{host}:{parts.port}' if parts.port else host
+            return urlunsplit((parts.scheme.lower(), netloc, path, urlencode(query), ''))
+
+        query = [(key, value) for key, value in query if not SHARE_PARAMS.match(key)]
+        if platform == 'youtube':
+            match = YOUTUBE_ID_PATHS.match(path)
+            if host == 'youtu.be' and len(path) > 1:
+                query = [('v', path.strip('/').split('/')[0])] + query
+                path = '/watch'
+            elif match:
+                query = [('v', match.group(1))] + query
+                path = '/watch'
+            query = [(key, value) for key, value in query if key in YOUTUBE_KEEP_PARAMS]
+
+        for domain, canonical_host in CANONICAL_HOSTS.items():
+            if host in [prefix + domain for prefix in MIRROR_SUBDOMAINS]:
+                host = canonical_host
+                break
+        if len(path) > 1:
+            path = path.rstrip('/')
+        return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+    def ie_key_for(self, platform, url):
+        """The first of the platform's extractors that accepts url, like yt-dlp would pick"""
+        if platform not in IE_PREFIXES:
+            return None
+        for ie in self.extractors[platform]:
+            if ie.suitable(url):
+                return ie.ie_key()
+        return None
+
+    def _route(self, url):
+        host = (urlsplit(url.strip()).hostname or '').lower()
+        if not host:
+            host = (urlsplit('https://' + url.strip()).hostname or '').lower()
+        platform = self.platform_for_host(host)
+        canonical = self.canonicalize(url, platform)
+        return Route(platform, self.ie_key_for(platform, canonical), canonical)
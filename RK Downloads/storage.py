@@ -0,0 +1,300 @@
+import io
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class TransferFile(io.FileIO):
+    """Read-only file that calls `on_close` once when closed, e.g. by the WSGI server after sending it"""
+
+    def __init__(self, path, on_close):
+        super().__init__(path, 'rb')
+        self.on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.on_close()
+
+
+class StorageManager:
+    """Keeps the downloads directory under a byte quota by evicting least recently used entries.
+
+    Usage counts every file once per inode, so job folders hardlinked to the
+    content store are not counted twice. When it goes over the high
+    watermark, top-level entries (job folders and loose files) are deleted
+    one at a time, least recently accessed first, until it is under the
+    low watermark; store objects left without any job folder linking them
+    go with them. Entries of unfinished jobs, entries being transferred and
+    entries touched within `min_age` seconds are never evicted.
+    """
+
+    def __init__(self, root, quota, store_objects_dir=None, high_watermark=0.9, low_watermark=0.75, interval=60,
+                 min_age=300, active_entries=None, state_path=None, on_evict=None):
+        self.root = root
+        self.quota = quota  # bytes, None or 0 for no quota
+        self.store_objects_dir = store_objects_dir
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.min_age = min_age
+        self.active_entries = active_entries or (lambda: set())
+        self.state_path = state_path
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._accessed = self._load_access_times()
+        self._accessed_dirty = False
+        self._transfers = {}  # entry name -> transfers in progress
+        self._evicting = None
+        self._wake = threading.Event()
+        self._thread = None
+        self.usage = None
+        self.evicted = 0
+        self.freed_bytes = 0
+        self.last_scan_seconds = None
+        self.blocked = False
+
+    def entry_name(self, relative_path):
+        """Top-level entry of DOWNLOAD_DIR a client path belongs to"""
+        return relative_path.replace(os.sep, '/').strip('/').split('/')[0]
+
+    def acquire(self, name):
+        """Mark an entry as being transferred; False if it is being evicted right now"""
+        with self._lock:
+            if name == self._evicting:
+                return False
+            self._transfers[name] = self._transfers.get(name, 0) + 1
+            self._accessed[name] = time.time()
+            self._accessed_dirty = True
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self._transfers[name] -= 1
+            if not self._transfers[name]:
+                del self._transfers[name]
+            self._accessed[name] = time.time()
+            self._accessed_dirty = True
+
+    def open(self, path, name):
+        """Open a file of entry `name` for a transfer that lasts until the file is closed; None if it is being evicted"""
+        if not self.acquire(name):
+            return None
+        try:
+            return self.open_held(path, name)
+        except OSError:
+            self.release(name)
+            raise
+
+    def open_held(self, path, name):
+        """Open a file of an entry acquired by the caller; closing the file releases the entry"""
+        return TransferFile(path, lambda: self.release(name))
+
+    def touch(self, name):
+        """Record an access that cannot be tracked until it ends (e.g. a transfer handed to nginx)"""
+        with self._lock:
+            self._accessed[name] = time.time()
+            self._accessed_dirty = True
+
+    def poke(self):
+        """Check usage now instead of at the next interval, e.g. after a download finished"""
+        self._wake.set()
+
+    def start(self):
+        if self.quota and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='storage-manager', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.enforce()
+            except Exception:
+                # A vanished file mid-scan just means trying again next time
+                pass
+            self._save_access_times()
+
+    def enforce(self):
+        """Evict entries until usage is under the low watermark, if it is over the high one"""
+        started = time.monotonic()
+        entries, inodes = self.scan()
+        self.last_scan_seconds = round(time.monotonic() - started, 3)
+        usage = sum(size for size, links, object_path in inodes.values())
+        self.usage = usage
+        if not self.quota or usage <= self.quota * self.high_watermark:
+            self.blocked = False
+            return 0
+        target = self.quota * self.low_watermark
+        # Store objects no job folder links to only speed up repeat downloads; they go first
+        freed = self.collect_store_objects(inodes)
+        for name in self.eviction_order(entries):
+            if usage - freed <= target:
+                break
+            freed += self.evict(name, entries[name], inodes)
+        self.usage = usage - freed
+        # Everything evictable is gone and usage is still high
+        self.blocked = self.usage > target
+        return freed
+
+    def eviction_order(self, entries):
+        """Evictable entry names, least recently used first"""
+        active = self.active_entries()
+        now = time.time()
+        with self._lock:
+            busy = set(self._transfers)
+            last_used = {name: max(self._accessed.get(name, 0), entry['mtime']) for name, entry in entries.items()}
+        candidates = [
+            name for name in entries
+            if name not in active and name not in busy and now - last_used[name] >= self.min_age
+        ]
+        return sorted(candidates, key=lambda name: last_used[name])
+
+    def scan(self):
+        """Return ({entry name: {'mtime', 'inodes'}}, {inode: [size, links seen, store object path]})"""
+        entries = {}
+        inodes = {}
+        with os.scandir(self.root) as top:
+            for entry in top:
+                if entry.name.startswith('.'):
+                    continue
+                found = {}
+                for path in self._walk(entry):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        # Renamed or deleted by a running job since it was listed
+                        continue
+                    key = (stat.st_dev, stat.st_ino)
+                    found[key] = found.get(key, 0) + 1
+                    inodes.setdefault(key, [stat.st_size, 0, None])[1] += 1
+                try:
+                    entries[entry.name] = {'mtime': entry.stat().st_mtime, 'inodes': found}
+                except OSError:
+                    continue
+        if self.store_objects_dir and os.path.isdir(self.store_objects_dir):
+            for directory, dirs, files in os.walk(self.store_objects_dir):
+                for file in files:
+                    path = os.path.join(directory, file)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    info = inodes.setdefault((stat.st_dev, stat.st_ino), [stat.st_size, 0, None])
+                    info[1] += 1
+                    info[2] = path
+        return entries, inodes
+
+    def _walk(self, entry):
+        if entry.is_file(follow_symlinks=False):
+            yield entry.path
+        elif entry.is_dir(follow_symlinks=False):
+            for directory, dirs, files in os.walk(entry.path):
+                for file in files:
+                    yield os.path.join(directory, file)
+
+    def evict(self, name, entry, inodes):
+        """Delete one entry and the store objects only it linked to; returns the bytes freed"""
+        with self._lock:
+            if name in self._transfers:
+                return 0
+            self._evicting = name
+        try:
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            return 0
+        finally:
+            with self._lock:
+                self._evicting = None
+                self._accessed.pop(name, None)
+                self._accessed_dirty = True
+        freed = 0
+        for key, count in entry['inodes'].items():
+            info = inodes[key]
+            info[1] -= count
+            if info[1] == 1 and info[2]:
+                # Only the content store still has it; a later job would re-download it anyway
+                try:
+                    os.remove(info[2])
+                    info[1] = 0
+                except OSError:
+                    pass
+            if info[1] == 0:
+                freed += info[0]
+        self.evicted += 1
+        self.freed_bytes += freed
+        if self.on_evict:
+            self.on_evict(name)
+        return freed
+
+    def collect_store_objects(self, inodes):
+        """Delete store objects that no entry links to; returns the bytes freed"""
+        freed = 0
+        for info in inodes.values():
+            if info[1] == 1 and info[2]:
+                try:
+                    os.remove(info[2])
+                except OSError:
+                    continue
+                info[1] = 0
+                freed += info[0]
+        self.freed_bytes += freed
+        return freed
+
+    def clear(self):
+        """Delete every entry that is not in use; returns the names that were kept"""
+        entries, inodes = self.scan()
+        active = self.active_entries()
+        with self._lock:
+            busy = set(self._transfers)
+        kept = sorted(name for name in entries if name in active or name in busy)
+        for name in entries:
+            if name not in kept:
+                self.evict(name, entries[name], inodes)
+        self.collect_store_objects(inodes)
+        return kept
+
+    def stats(self):
+        with self._lock:
+            transfers = sum(self._transfers.values())
+        return {
+            'quota': self.quota or None,
+            'usage': self.usage,
+            'high_watermark': self.high_watermark,
+            'low_watermark': self.low_watermark,
+            'evicted': self.evicted,
+            'freed_bytes': self.freed_bytes,
+            'active_transfers': transfers,
+            'last_scan_seconds': self.last_scan_seconds,
+            'over_quota_with_nothing_to_evict': self.blocked
+        }
+
+    def _load_access_times(self):
+        if not self.state_path:
+            return {}
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_access_times(self):
+        # Access times survive restarts so the LRU order does too
+        if not self.state_path:
+            return
+        with self._lock:
+            if not self._accessed_dirty:
+                return
+            accessed = dict(self._accessed)
+            self._accessed_dirty = False
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(accessed, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# Leftovers of interrupted downloads never belong in the store
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+
+class ContentStore:
+    """Content-addressed store of finished downloads, shared across job folders.
+
+    Files are kept once under objects/ by SHA-256 and hardlinked into job
+    folders. Manifests under index/ map a media key (extractor, video id,
+    format) to the files that download produced.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.index_dir = os.path.join(root, 'index')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, extractor, video_id, format_id):
+        return f'{extractor}:{video_id}:{format_id}'
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def manifest_path(self, key):
+        return os.path.join(self.index_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def lookup(self, key):
+        """Return the manifest stored for key, or None if it is missing or incomplete"""
+        try:
+            with open(self.manifest_path(key), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest and not all(os.path.isfile(self.object_path(entry['sha256'])) for entry in manifest['files']):
+            manifest = None
+        with self._lock:
+            if manifest is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return manifest
+
+    def materialize(self, manifest, folder):
+        """Hardlink the files of a manifest into folder (copying if links are unsupported)"""
+        os.makedirs(folder, exist_ok=True)
+        for entry in manifest['files']:
+            source = self.object_path(entry['sha256'])
+            target = os.path.join(folder, entry['name'])
+            if os.path.exists(target):
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+        return [os.path.join(folder, entry['name']) for entry in manifest['files']]
+
+    def ingest(self, keys, paths, info):
+        """Move the finished files at paths into the store and index them under keys.
+
+        The job's files stay where they are as hardlinks of the stored objects,
+        so ingesting costs no extra disk space.
+        """
+        files = []
+        for path in sorted(paths):
+            if not os.path.isfile(path) or path.endswith(PARTIAL_SUFFIXES):
+                continue
+            digest = self.file_digest(path)
+            target = self.object_path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except FileExistsError:
+                # Same bytes are already stored: swap our copy for a link to them
+                temp_link = path + '.link'
+                os.link(target, temp_link)
+                os.replace(temp_link, path)
+            files.append({'name': os.path.basename(path), 'sha256': digest, 'size': os.path.getsize(path)})
+        if not files:
+            return None
+
+        manifest = {'files': files, 'info': info, 'created_at': time.time()}
+        for key in keys:
+            self._write_manifest(key, dict(manifest, key=key))
+        return manifest
+
+    def file_digest(self, path, chunk_size=1024 * 1024):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def _write_manifest(self, key, manifest):
+        path = self.manifest_path(key)
+        # Jobs storing the same media at once each write their own temp file
+        fd, temp_path = tempfile.mkstemp(dir=self.index_dir, prefix=os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class SyncState:
+    """High-water marks of sources (channels, playlists, profiles) that are synced incrementally.
+
+    Each source has a JSON state file (e.g. the date and shortcode of the
+    newest Instagram post seen) and, for yt-dlp sources, an archive of
+    downloaded video IDs in yt-dlp's --download-archive format.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, source, suffix):
+        return os.path.join(self.root, hashlib.sha1(source.encode('utf-8')).hexdigest() + suffix)
+
+    def archive_path(self, source):
+        return self.path(source, '.archive')
+
+    def load(self, source):
+        """State saved for source, or an empty dict if it was never synced"""
+        try:
+            with open(self.path(source, '.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, source, **fields):
+        """Merge fields into the state of source and record the sync time"""
+        with self._lock:
+            state = self.load(source)
+            state.update(fields, source=source, synced_at=time.time(), syncs=state.get('syncs', 0) + 1)
+            path = self.path(source, '.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(path + '.tmp', path)
+        return state
+
+    def archived_ids(self, source):
+        """Archive IDs ('youtube dQw4w9WgXcQ') already downloaded from source"""
+        try:
+            with open(self.archive_path(source), encoding='utf-8') as f:
+                return {line.strip() for line in f if line.strip()}
+        except OSError:
+            return set()
+
+    def add_to_archive(self, source, archive_ids):
+        if not archive_ids:
+            return
+        with self._lock, open(self.archive_path(source), 'a', encoding='utf-8') as f:
+            f.writelines(f'{archive_id}\n' for archive_id in archive_ids)
+
+    def sources(self):
+        """States of every synced source, most recently synced first"""
+        states = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    try:
+                        with open(entry.path, encoding='utf-8') as f:
+                            states.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        return sorted(states, key=lambda state: state.get('synced_at', 0), reverse=True)
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, 'benchmarks'))
+sys.path.insert(0, APP_DIR)
+
+from media_server import MediaServer
+
+
+@pytest.fixture(scope='session')
+def media():
+    """Stand-in media host serving synthetic progressive, HLS and DASH media"""
+    server = MediaServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def rk(tmp_path_factory):
+    """The app module, imported in a throwaway working directory (it keeps downloads/ and data/ there)"""
+    workdir = tmp_path_factory.mktemp('app')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    os.environ['RK_PREWARM_INSTANCES'] = '0'
+    try:
+        import app
+    finally:
+        os.chdir(previous)
+    return app
+
+
+@pytest.fixture
+def client(rk):
+    return rk.app.test_client()
+
+
+@pytest.fixture
+def slow_downloads(rk, monkeypatch):
+    """Hold downloads to about 2 MiB/s, so that one of 2 MiB runs for a second"""
+    make_hooks = rk.downloader.ydl_progress_hooks
+    downloaded = {}
+
+    def throttle(d):
+        if d['status'] == 'downloading':
+            done = d.get('downloaded_bytes') or 0
+            time.sleep(max(0, done - downloaded.get(d.get('tmpfilename'), 0)) / (2 * 1024 * 1024))
+            downloaded[d.get('tmpfilename')] = done
+
+    def slowed(*args, **kwargs):
+        hooks = make_hooks(*args, **kwargs)
+        hooks.setdefault('progress_hooks', []).insert(0, throttle)
+        return hooks
+    monkeypatch.setattr(rk.downloader, 'ydl_progress_hooks', slowed)
+
+
+def wait_for(predicate, timeout=10, interval=0.02):
+    """Poll predicate until it returns something truthy; fail the test after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = predicate()
+        if value:
+            return value
+        time.sleep(interval)
+    raise AssertionError('timed out waiting for condition')
+
+
+def run_job(client, url, **fields):
+    """Submit a download through the API and return the finished job"""
+    data = client.post('/download', json=dict(fields, url=url)).get_json()
+    assert data['status'] == 'started', data
+    return wait_for(lambda: (lambda job: job if job['state'] in ('completed', 'failed') else None)(
+        client.get(f"/jobs/{data['job_id']}").get_json()
+    ), timeout=60)
@@ -0,0 +1,127 @@
+import json
+import os
+import uuid
+
+import pytest
+
+from artifacts import ArtifactStore
+from media_server import media_bytes
+
+
+def info(media, video_id, subtitles='media/subs.mp4'):
+    return {
+        'id': video_id,
+        'title': 'Clip',
+        'extractor_key': 'Generic',
+        'webpage_url': f'{media.base_url}/watch/{video_id}',
+        'subtitles': {'en': [{'ext': 'vtt', 'url': f'{media.base_url}/{subtitles}?size=300'}]},
+        'automatic_captions': {
+            'en-US': [{'ext': 'vtt', 'url': f'{media.base_url}/media/auto-en.mp4?size=200'}],
+            'de': [{'ext': 'vtt', 'url': f'{media.base_url}/media/auto-de.mp4?size=200'}]
+        },
+        'thumbnails': [{'url': f'{media.base_url}/images/small.jpg?size=10'}, {'url': f'{media.base_url}/images/large.jpg?size=20'}],
+        'formats': [{'format_id': '18', 'url': f'{media.base_url}/media/clip.mp4'}],
+        'duration': 12
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / 'artifacts'))
+
+
+def test_recording_fetches_nothing(store, media):
+    manifest = store.record_info(info(media, 'a'))
+    available = store.available(manifest)
+    assert available['cached'] == []
+    assert available['thumbnail'] and available['metadata']
+    # Only the configured caption languages are kept
+    assert sorted((track['lang'], track['automatic']) for track in available['subtitles']) == [('en', False), ('en-US', True)]
+    assert store.stats() == {'fetched': 0, 'served_from_cache': 0}
+
+
+def test_artifacts_are_fetched_once_then_served_from_the_cache(store, media):
+    manifest = store.record_info(info(media, 'b'))
+    path = store.fetch(manifest, 'subtitles', 'en')
+    # Written subtitles are preferred over automatic captions
+    with open(path, 'rb') as f:
+        assert f.read() == media_bytes(0, 300)
+    assert store.fetch(manifest, 'subtitles', 'en') == path
+    assert store.stats() == {'fetched': 1, 'served_from_cache': 1}
+    assert store.available(store.manifest(manifest['key']))['cached'] == ['subtitles.en.vtt']
+
+
+def test_metadata_leaves_out_expiring_fields(store, media):
+    manifest = store.record_info(info(media, 'c'))
+    with open(store.fetch(manifest, 'metadata'), encoding='utf-8') as f:
+        metadata = json.load(f)
+    assert metadata['duration'] == 12
+    assert not set(ArtifactStore.METADATA_EXCLUDE) & set(metadata)
+
+
+def test_the_best_thumbnail_is_fetched(store, media):
+    manifest = store.record_info(info(media, 'd'))
+    path = store.fetch(manifest, 'thumbnail')
+    assert os.path.basename(path) == 'thumbnail.jpg'
+    assert os.path.getsize(path) == 20
+
+
+def test_missing_artifacts_are_value_errors(store, media):
+    manifest = store.record('Generic:e')
+    for kind, lang in (('subtitles', None), ('thumbnail', None), ('metadata', None), ('lyrics', None)):
+        with pytest.raises(ValueError):
+            store.select(manifest, kind, lang)
+
+
+@pytest.fixture
+def extractions(rk, monkeypatch):
+    """Replace yt-dlp extraction with a queue of info dicts; records each URL extracted"""
+    calls = []
+    results = []
+
+    def extract(url):
+        calls.append(url)
+        result = results.pop(0)
+        rk.downloader.cache_info(url, result)
+        return result
+    monkeypatch.setattr(rk.downloader, '_extract_info', extract)
+    return calls, results
+
+
+def test_listing_and_fetching_through_the_api(client, media, extractions):
+    calls, results = extractions
+    video = info(media, uuid.uuid4().hex)
+    results.append(video)
+    url = video['webpage_url']
+    listing = client.get('/artifacts', query_string={'url': url}).get_json()
+    assert listing['status'] == 'success'
+    assert listing['cached'] == []
+
+    first = client.get('/artifacts/subtitles', query_string={'url': url, 'lang': 'en'})
+    assert first.status_code == 200
+    assert first.get_data() == media_bytes(0, 300)
+    second = client.get('/artifacts/subtitles', query_string={'url': url, 'lang': 'en'})
+    assert second.get_data() == first.get_data()
+    assert client.get('/artifacts', query_string={'url': url}).get_json()['cached'] == ['subtitles.en.vtt']
+    assert len(calls) == 1
+
+    missing = client.get('/artifacts/subtitles', query_string={'url': url, 'lang': 'fr'})
+    assert missing.status_code == 404
+
+
+def test_an_expired_artifact_url_is_extracted_again(client, media, extractions):
+    calls, results = extractions
+    video_id = uuid.uuid4().hex
+    results.append(info(media, video_id, subtitles='expired/subs.mp4'))
+    results.append(info(media, video_id))
+    url = results[0]['webpage_url']
+    response = client.get('/artifacts/subtitles', query_string={'url': url, 'lang': 'en'})
+    assert response.status_code == 200
+    assert response.get_data() == media_bytes(0, 300)
+    assert len(calls) == 2
+
+
+def test_supported_platforms_point_to_artifacts(client):
+    features = client.get('/supported-platforms').get_json()['features']
+    assert not {'Subtitle downloads', 'Metadata preservation'} & set(features)
+    assert any('/artifacts' in feature for feature in features)
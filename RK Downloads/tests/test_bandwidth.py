@@ -0,0 +1,95 @@
+import time
+import uuid
+
+import pytest
+
+from bandwidth import BandwidthGovernor, Lease
+from conftest import run_job
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def capped(rk):
+    def cap(limit):
+        rk.bandwidth.configure(limit=limit)
+    yield cap
+    rk.bandwidth.configure(limit=None)
+
+
+def timed_job(client, url):
+    started = time.monotonic()
+    job = run_job(client, url)
+    assert job['state'] == 'completed', job['message']
+    return time.monotonic() - started
+
+
+@pytest.mark.parametrize('kind', ['hls', 'dash', 'media'])
+def test_downloads_run_at_the_capped_rate(client, media, capped, kind):
+    capped(2 * MiB)
+    name = uuid.uuid4().hex
+    url = {
+        'hls': f'{media.base_url}/hls/{name}.m3u8?segments=12&size={MiB // 3}',
+        'dash': f'{media.base_url}/dash/{name}.mpd?segments=12&size={MiB // 3}',
+        'media': f'{media.base_url}/media/{name}.mp4?size={4 * MiB}',
+    }[kind]
+    seconds = timed_job(client, url)
+    # 4 MiB at 2 MiB/s, plus extraction
+    assert 1.6 < seconds < 4.5
+
+
+def test_segmented_download_is_fast_under_a_high_cap(client, media, capped):
+    capped(100 * MiB)
+    seconds = timed_job(client, f'{media.base_url}/hls/{uuid.uuid4().hex}.m3u8?segments=12&size={MiB // 3}')
+    assert seconds < 1.5
+
+
+def test_idle_jobs_get_their_prospective_share():
+    governor = BandwidthGovernor(limit=9 * MiB, min_rate=1024)
+    downloading = Lease('a', 'interactive')
+    downloading._file_bytes['video.part'] = 1
+    starting = Lease('b', 'interactive')
+    shares = governor.allocate([downloading, starting], governor.limit)
+    assert shares[downloading] == 9 * MiB
+    assert shares[starting] == 9 * MiB // 2
+
+
+def test_threads_of_one_job_share_its_rate():
+    lease = Lease('a', 'interactive')
+    lease.set_rate(4 * MiB)
+    started = time.monotonic()
+    for offset in range(1, 9):
+        # Eight fragment updates of 0.25 MiB each on the job's running total
+        lease.ydl_progress_hook({'status': 'downloading', 'tmpfilename': 'v.mp4.part', 'downloaded_bytes': offset * MiB // 4})
+    assert 0.4 < time.monotonic() - started < 0.8
+    assert lease.bytes == 2 * MiB
+
+
+@pytest.mark.parametrize('limit, priorities', [
+    (5000, ['interactive'] * 10),
+    (100 * 1024, ['interactive', 'bulk', 'bulk', 'bulk']),
+    (9 * MiB, ['interactive'] + ['bulk'] * 50),
+])
+def test_shares_never_add_up_to_more_than_the_limit(limit, priorities):
+    governor = BandwidthGovernor(limit=limit, min_rate=32 * 1024)
+    leases = [Lease(str(index), priority) for index, priority in enumerate(priorities)]
+    for lease in leases:
+        lease._file_bytes['video.part'] = 1
+    shares = governor.allocate(leases, limit)
+    assert sum(shares.values()) <= limit
+    # Every lease still gets the floor, or an even split when the floors do not fit
+    assert min(shares.values()) >= min(governor.min_rate, limit // len(leases))
+
+
+@pytest.mark.parametrize('token, headers, remote_addr, allowed', [
+    (None, {}, '127.0.0.1', True),
+    (None, {}, '203.0.113.5', False),
+    ('secret', {}, '127.0.0.1', False),
+    ('secret', {'X-Admin-Token': 'wrong'}, '203.0.113.5', False),
+    ('secret', {'X-Admin-Token': 'secret'}, '203.0.113.5', True),
+])
+def test_admin_bandwidth_needs_the_token_or_a_local_client(rk, client, monkeypatch, token, headers, remote_addr, allowed):
+    monkeypatch.setitem(rk.app.config, 'ADMIN_TOKEN', token)
+    response = client.post('/admin/bandwidth', json={'limit': None}, headers=headers,
+                           environ_base={'REMOTE_ADDR': remote_addr})
+    assert response.status_code == (200 if allowed else 403)
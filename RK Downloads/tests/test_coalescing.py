@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cache import SingleFlight
+from conftest import wait_for
+
+MiB = 1024 * 1024
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'title': 'shared'}
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lambda _: flights.do('key', slow), range(5)))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flights.coalesced == 4
+
+
+def test_waiters_get_the_leader_error():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError('unavailable')
+
+    leader = ThreadPoolExecutor(max_workers=1).submit(flights.do, 'key', failing)
+    started.wait(5)
+    with pytest.raises(ValueError, match='unavailable'):
+        flights.do('key', failing)
+    with pytest.raises(ValueError):
+        leader.result()
+    # Nothing is cached: the next call runs again
+    assert flights.do('key', lambda: 'retried') == 'retried'
+
+
+def test_identical_urls_share_one_extraction(rk, media, monkeypatch):
+    downloader = rk.downloader
+    extract = downloader._extract_info
+    calls = []
+
+    def counted(url):
+        calls.append(url)
+        time.sleep(0.2)
+        return extract(url)
+
+    monkeypatch.setattr(downloader, '_extract_info', counted)
+    url = f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size=1000'
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        infos = list(pool.map(lambda _: downloader.extract_info(url), range(4)))
+    assert len(calls) == 1
+    assert all(info['url'] == url for info in infos)
+
+
+def test_identical_downloads_attach_to_the_job_in_flight(client, media, slow_downloads):
+    # Slowed down, so the first job is still downloading when the others arrive
+    url = f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size={2 * MiB}'
+    first = client.post('/download', json={'url': url}).get_json()
+    again = client.post('/download', json={'url': url}).get_json()
+    other_quality = client.post('/download', json={'url': url, 'quality': 'worst'}).get_json()
+    assert (first['coalesced'], again['coalesced'], other_quality['coalesced']) == (False, True, False)
+    assert again['job_id'] == first['job_id'] != other_quality['job_id']
+    wait_for(lambda: client.get(f"/jobs/{first['job_id']}").get_json()['state'] == 'completed', timeout=60)
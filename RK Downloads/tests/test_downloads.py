@@ -0,0 +1,72 @@
+import json
+import os
+import uuid
+
+from conftest import run_job
+
+
+def test_expired_cached_media_url_falls_back_to_fresh_extraction(rk, media, tmp_path):
+    downloader = rk.downloader
+    url = f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size=200000'
+    key = downloader.canonical_url(url)
+    info = dict(downloader.extract_info(url))
+    # The cached media URL now answers 404, as an expired signed URL would
+    info['url'] = f'{media.base_url}/gone/expiring.mp4'
+    info['formats'] = [dict(fmt, url=info['url']) for fmt in info.get('formats') or []]
+    downloader.info_cache.put(key, info)
+
+    # YouTube downloads run with ignoreerrors, so the 404 is logged rather than raised
+    result = downloader.download_youtube_content(url, str(tmp_path))
+    assert result['status'] == 'success', result
+    assert [os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)] == [200000]
+    assert downloader.info_cache.get(key)['url'] == url
+
+
+def test_repeated_download_links_the_stored_file(rk, client, media):
+    url = f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size=300000'
+    hits = rk.downloader.store.hits
+    first, again = run_job(client, url), run_job(client, url)
+    assert (first['state'], again['state']) == ('completed', 'completed')
+    assert rk.downloader.store.hits == hits + 1
+
+    def only_file(job):
+        # Job folder names end in the job's id
+        [folder] = [name for name in os.listdir(rk.DOWNLOAD_DIR) if name.endswith(job['id'])]
+        [name] = os.listdir(os.path.join(rk.DOWNLOAD_DIR, folder))
+        return os.stat(os.path.join(rk.DOWNLOAD_DIR, folder, name))
+
+    # One copy on disk, hardlinked into both job folders
+    assert only_file(first).st_ino == only_file(again).st_ino
+    assert only_file(again).st_size == 300000
+
+
+def test_bulk_download_streams_a_result_per_url(client, media):
+    first, second = (f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size=100000' for _ in range(2))
+    response = client.post('/bulk-download', json={'urls': [first, '  ', second, first]})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]['status'] == 'done'
+    results = {line['index']: line for line in lines[:-1]}
+    assert sorted(results) == [0, 1, 2]
+    assert all(line['status'] == 'success' for line in results.values())
+    assert (results[0]['url'], results[1]['url'], results[2]['url']) == (first, second, first)
+    # The repeated URL shares the first one's job
+    assert results[2]['job_id'] == results[0]['job_id'] != results[1]['job_id']
+
+
+def download_playlist(downloader, url, path):
+    options = downloader.engine.options('youtube', str(path), 'best')
+    return downloader.download_youtube_playlist(url, str(path), options)
+
+
+def test_playlist_rerun_skips_entries_already_in_the_store(rk, media, tmp_path):
+    downloader = rk.downloader
+    url = f'{media.base_url}/playlist/rerun.html?entries=3&size=100000'
+    first = download_playlist(downloader, url, tmp_path / 'first')
+    assert first['status'] == 'success', first
+    assert (first['downloaded'], first['skipped'], first['failed']) == (3, 0, 0)
+
+    again = download_playlist(downloader, url, tmp_path / 'again')
+    assert again['status'] == 'success', again
+    assert (again['downloaded'], again['skipped'], again['failed']) == (0, 3, 0)
+    assert sorted(os.listdir(tmp_path / 'again')) == sorted(os.listdir(tmp_path / 'first'))
@@ -0,0 +1,79 @@
+import time
+import uuid
+
+import pytest
+import yt_dlp
+from yt_dlp.downloader.external import Aria2cFD
+
+from bandwidth import Lease
+from conftest import run_job
+from engine import DownloadEngine, EngineRun
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def tuner(rk):
+    tuner = rk.downloader.engine.tuner('generic')
+    saved = tuner.current, dict(tuner.throughput)
+    yield tuner
+    tuner.current, tuner.throughput = saved
+    rk.bandwidth.configure(limit=None)
+
+
+def hls_url(media):
+    return f'{media.base_url}/hls/{uuid.uuid4().hex}.m3u8?segments=12&size={MiB // 3}'
+
+
+def test_uncapped_segmented_downloads_feed_the_tuner(client, media, tuner):
+    tuner.throughput.clear()
+    job = run_job(client, hls_url(media))
+    assert job['state'] == 'completed', job['message']
+    assert tuner.throughput
+
+
+def test_fragment_parallelism_does_not_multiply_the_cap(rk, client, media, tuner):
+    tuner.current = tuner.maximum
+    tuner.throughput.clear()
+    rk.bandwidth.configure(limit=2 * MiB)
+    started = time.monotonic()
+    job = run_job(client, hls_url(media))
+    assert job['state'] == 'completed', job['message']
+    # 4 MiB at 2 MiB/s, however many fragment threads share it
+    assert time.monotonic() - started > 1.6
+    # A capped download says nothing about the best parallelism
+    assert tuner.throughput == {}
+    assert tuner.current == tuner.maximum
+
+
+def test_runs_held_to_their_share_are_not_observed():
+    engine = DownloadEngine()
+    lease = Lease('a', 'interactive')
+    options = engine.options('generic', '/tmp', hooks={'bandwidth_lease': lease})
+    run = options['logger']
+    assert isinstance(run, EngineRun) and run.lease is lease
+
+    def download(seconds):
+        run.progress_hook({'status': 'downloading', 'filename': 'v.mp4', 'fragment_count': 4})
+        run.progress_hook({'status': 'finished', 'filename': 'v.mp4', 'downloaded_bytes': 4 * MiB, 'elapsed': seconds})
+
+    lease.set_rate(2 * MiB)
+    download(2.0)
+    assert run.tuner.throughput == {}
+    download(4.0)
+    assert run.tuner.throughput == {run.parallelism: MiB}
+
+
+def test_aria2c_takes_the_current_share_when_it_starts():
+    lease = Lease('a', 'interactive')
+    ydl = yt_dlp.YoutubeDL({'external_downloader': {'default': 'aria2c'}, 'quiet': True})
+    lease.attach(ydl.params)
+
+    def limit():
+        cmd = Aria2cFD(ydl, ydl.params)._make_cmd('v.mp4.part', {'url': 'https://example.com/v.mp4'})
+        return cmd[cmd.index('--max-overall-download-limit') + 1]
+
+    lease.set_rate(3 * MiB)
+    assert limit() == str(3 * MiB)
+    lease.set_rate(MiB)
+    assert limit() == str(MiB)
@@ -0,0 +1,59 @@
+import json
+import threading
+import uuid
+
+MiB = 1024 * 1024
+
+
+def read_events(response):
+    """(event, data) pairs of a Server-Sent Events response, keep-alive comments skipped"""
+    buffer = ''
+    for chunk in response.response:
+        buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buffer:
+            message, buffer = buffer.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in message.split('\n') if not line.startswith(':'))
+            if fields:
+                yield fields['event'], json.loads(fields['data'])
+
+
+def start(client, url):
+    data = client.post('/download', json={'url': url}).get_json()
+    assert data['status'] == 'started', data
+    return data['job_id']
+
+
+def test_job_events_stream_byte_progress_until_the_job_finishes(client, media, slow_downloads):
+    job_id = start(client, f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size={2 * MiB}')
+    response = client.get(f'/jobs/{job_id}/events')
+    assert response.mimetype == 'text/event-stream'
+    updates = [data for event, data in read_events(response) if event == 'progress']
+    response.close()
+
+    downloading = [update for update in updates if update['phase'] == 'download' and update['state'] == 'running']
+    assert downloading
+    assert all(update['total_bytes'] == 2 * MiB for update in downloading)
+    sizes = [update['downloaded_bytes'] for update in downloading]
+    assert sizes == sorted(sizes) and 0 < sizes[0] < 2 * MiB
+    assert updates[-1]['state'] == 'completed'
+    assert updates[-1]['progress'] == 100
+
+
+def test_events_of_an_unknown_job_are_not_found(client):
+    assert client.get('/jobs/nosuchjob/events').status_code == 404
+
+
+def test_finished_jobs_are_announced(rk, client, media):
+    announced = []
+
+    def listen():
+        # The test client reads up to the first message before returning the response
+        response = client.get('/events')
+        announced.append(next(read_events(response)))
+        response.close()
+
+    listener = threading.Thread(target=listen)
+    listener.start()
+    start(client, f'{media.base_url}/media/{uuid.uuid4().hex}.mp4?size=100000')
+    listener.join(30)
+    assert announced and announced[0] == ('job-finished', {'finished': rk.job_manager.finished_count})
@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime
+
+import instaloader
+import pytest
+
+from instagram import InstagramEngine, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_paces_at_its_rate():
+    bucket = TokenBucket(rate=20, capacity=5)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.03
+    for _ in range(4):
+        bucket.acquire()
+    # Four more tokens at 20 per second
+    assert 0.17 < time.monotonic() - started < 0.35
+
+
+def test_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=50, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    time.sleep(0.2)
+    assert bucket.stats()['tokens'] == 3
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.03
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    # Only the shared bucket paces queries; Instaloader's own per-loader pacing would sleep for minutes
+    monkeypatch.setattr(instaloader.RateController, 'wait_before_query', lambda self, query_type: None)
+    monkeypatch.setattr(instaloader.RateController, 'handle_429', lambda self, query_type: None)
+    engine = InstagramEngine(str(tmp_path), rate=100, burst=100, media_parallelism=4)
+    yield engine
+    engine.media_pool.shutdown()
+
+
+def test_a_429_on_one_loader_pauses_every_loader(engine):
+    engine.bucket.pause(0)
+    with engine.loader({}) as first, engine.loader({}) as second:
+        assert first is not second
+        first.context._rate_controller.backoff = 0.3
+        first.context._rate_controller.handle_429('graphql')
+        started = time.monotonic()
+        second.context._rate_controller.wait_before_query('graphql')
+        assert time.monotonic() - started >= 0.25
+
+
+def queue(loader, count):
+    for index in range(count):
+        loader.download_pic(f'post_{index}', f'https://cdn.example.com/{index}.jpg?x=1', datetime.now())
+
+
+def test_media_files_are_fetched_in_parallel(engine, monkeypatch):
+    fetched = []
+
+    def fetch(loader, filename, url, mtime):
+        time.sleep(0.2)
+        fetched.append(filename)
+        return True
+
+    monkeypatch.setattr(engine, 'fetch_media', fetch)
+    started = time.monotonic()
+    with engine.loader({}) as loader:
+        queue(loader, 4)
+    # Leaving the block waited for all four, which ran side by side
+    assert sorted(fetched) == [f'post_{index}' for index in range(4)]
+    assert time.monotonic() - started < 0.6
+
+
+def test_the_first_failed_media_fetch_is_raised(engine, monkeypatch):
+    done = threading.Event()
+
+    def fetch(loader, filename, url, mtime):
+        if filename == 'post_1':
+            time.sleep(0.1)
+            raise ValueError('post_1 failed')
+        if filename == 'post_2':
+            raise ValueError('post_2 failed')
+        done.set()
+        return True
+
+    monkeypatch.setattr(engine, 'fetch_media', fetch)
+    with pytest.raises(ValueError, match='post_1 failed'):
+        with engine.loader({}) as loader:
+            queue(loader, 3)
+    assert done.is_set()
+    # The loader went back to the pool with Instaloader's own download_pic
+    assert 'download_pic' not in vars(loader)
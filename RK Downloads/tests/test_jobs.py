@@ -0,0 +1,168 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import wait_for
+from jobs import JobManager, QueueFullError
+
+
+class Concurrency:
+    """Counts how many tasks run at once"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def run(self, seconds=0.05):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(seconds)
+        with self._lock:
+            self.active -= 1
+
+
+def test_jobs_run_on_at_most_max_workers():
+    tasks = Concurrency()
+
+    def runner(job):
+        tasks.run()
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=3)
+    jobs = [manager.submit(f'https://example.com/{index}', f'site{index % 4}') for index in range(12)]
+    wait_for(lambda: all(job.finished for job in jobs))
+    assert tasks.peak == 3
+    assert [job.state for job in jobs] == ['completed'] * 12
+
+
+def test_a_full_queue_rejects_new_jobs():
+    release = threading.Event()
+    manager = JobManager(lambda job: release.wait(5) and {'status': 'success'}, max_workers=1, queue_depth=2)
+    running = manager.submit('https://example.com/running', 'generic')
+    wait_for(lambda: running.state == 'running')
+    queued = [manager.submit(f'https://example.com/{index}', 'generic') for index in range(2)]
+    with pytest.raises(QueueFullError):
+        manager.submit('https://example.com/rejected', 'generic')
+    release.set()
+    wait_for(lambda: all(job.state == 'completed' for job in [running] + queued))
+
+
+def test_a_busy_platform_leaves_workers_to_the_others():
+    release = threading.Event()
+
+    def runner(job):
+        if job.platform == 'youtube':
+            release.wait(5)
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=3, platform_limit=1)
+    first, second = (manager.submit(f'https://youtube.com/{index}', 'youtube') for index in range(2))
+    other = manager.submit('https://tiktok.com/1', 'tiktok')
+    wait_for(lambda: other.finished)
+    assert first.state == 'running'
+    assert second.state == 'queued'
+    release.set()
+    wait_for(lambda: second.finished)
+
+
+def test_a_failing_runner_fails_only_its_job():
+    def runner(job):
+        if job.url.endswith('bad'):
+            raise RuntimeError('extractor exploded')
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=1)
+    bad, good = manager.submit('https://example.com/bad', 'generic'), manager.submit('https://example.com/good', 'generic')
+    wait_for(lambda: bad.finished and good.finished)
+    assert (bad.state, good.state) == ('failed', 'completed')
+    assert 'extractor exploded' in bad.message
+    assert manager.stats()['running'] == 0
+
+
+def test_jobs_waiting_on_post_processing_are_capped():
+    stage_done = threading.Event()
+
+    def runner(job):
+        # The download is done; the job now only waits for a slow post-processing stage
+        manager.update(job, phase='postprocess')
+        stage_done.wait(5)
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=2, max_offloaded=2)
+    jobs = [manager.submit(f'https://example.com/{index}', f'site{index}') for index in range(8)]
+    wait_for(lambda: sum(job.state == 'running' for job in jobs) == 4)
+    time.sleep(0.2)
+    # Two offloaded, two more waiting in their slots; nothing else starts
+    assert sum(job.state == 'running' for job in jobs) == 4
+    assert manager.stats()['postprocessing'] == 2
+    assert len(manager._workers) == 4
+    stage_done.set()
+    wait_for(lambda: all(job.state == 'completed' for job in jobs))
+    # The extra threads retire once nothing is offloaded anymore
+    wait_for(lambda: len(manager._workers) == 2)
+
+
+def test_sub_tasks_borrow_spare_slots_up_to_the_platform_cap():
+    tasks = Concurrency()
+
+    def runner(job):
+        group = manager.slot_group(job.platform)
+
+        def task(index):
+            with group.slot():
+                tasks.run()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(task, range(8)))
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=4, platform_limit=2)
+    job = manager.submit('https://example.com/list', 'youtube')
+    wait_for(lambda: job.finished)
+    assert tasks.peak == 2
+    assert manager.stats()['running'] == 0
+
+
+def test_sub_tasks_of_several_jobs_stay_under_max_workers():
+    tasks = Concurrency()
+
+    def runner(job):
+        group = manager.slot_group(job.platform)
+
+        def task(index):
+            with group.slot():
+                tasks.run()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(task, range(8)))
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=3, platform_limit=3)
+    jobs = [manager.submit(f'https://example.com/list{index}', 'youtube') for index in range(4)]
+    wait_for(lambda: all(job.finished for job in jobs))
+    assert tasks.peak == 3
+
+
+def test_queued_jobs_start_before_sub_tasks_borrow_more_slots():
+    started = threading.Event()
+
+    def runner(job):
+        if job.url == 'playlist':
+            group = manager.slot_group(job.platform)
+
+            def task(index):
+                with group.slot():
+                    started.set()
+                    time.sleep(0.1)
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                list(pool.map(task, range(6)))
+        return {'status': 'success'}
+
+    manager = JobManager(runner, max_workers=2, platform_limit=2)
+    playlist = manager.submit('playlist', 'youtube')
+    started.wait(5)
+    single = manager.submit('single', 'youtube')
+    wait_for(lambda: playlist.finished and single.finished)
+    assert single.finished_at < playlist.finished_at
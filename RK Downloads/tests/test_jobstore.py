@@ -0,0 +1,154 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from conftest import wait_for
+from jobs import Job, JobManager, JobTakenOverError
+from jobstore import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.db'))
+
+
+def saved_jobs(store, count, platform='generic', **fields):
+    jobs = []
+    for index in range(count):
+        job = Job(f'https://example.com/{index}', platform)
+        job.created_at += index
+        for field, value in fields.items():
+            setattr(job, field, value)
+        store.save(job)
+        jobs.append(job)
+    return jobs
+
+
+class Runs:
+    """Runner that records which jobs ran, and how often"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, job):
+        with self._lock:
+            self.counts[job.id] += 1
+        return {'status': 'success'}
+
+
+def test_processes_sharing_a_store_resume_each_job_once(store):
+    jobs = saved_jobs(store, 20)
+    runs = Runs()
+    managers = [JobManager(runs, store=store) for _ in range(4)]
+    threads = [threading.Thread(target=manager.resume_unfinished) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wait_for(lambda: sum(runs.counts.values()) == len(jobs))
+    time.sleep(0.2)
+    assert runs.counts == Counter({job.id: 1 for job in jobs})
+    assert all(record['state'] == 'completed' for record in map(store.load, (job.id for job in jobs)))
+
+
+def test_jobs_of_a_live_process_are_left_alone(store):
+    owner = JobManager(Runs(), store=store)
+    saved_jobs(store, 3, worker=owner.owner)
+    runs = Runs()
+    assert JobManager(runs, store=store).resume_unfinished() == []
+    assert not runs.counts
+
+
+def test_jobs_of_a_process_that_stopped_heartbeating_are_resumed(store):
+    jobs = saved_jobs(store, 3, worker='elsewhere-1234', state='running')
+    store._conn.execute('UPDATE jobs SET heartbeat_at = ?', (time.time() - 120,))
+    runs = Runs()
+    resumed = JobManager(runs, store=store).resume_unfinished(stale_after=60)
+    assert sorted(job.id for job in resumed) == sorted(job.id for job in jobs)
+    wait_for(lambda: len(runs.counts) == 3)
+
+
+def test_jobs_of_an_exited_local_process_are_resumed_at_once(store):
+    if sys.platform == 'win32':
+        pytest.skip('exited processes are only detected through their heartbeat on Windows')
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    jobs = saved_jobs(store, 2, worker=f'{socket.gethostname()}-{exited.pid}-abcdef')
+    runs = Runs()
+    resumed = JobManager(runs, store=store).resume_unfinished(stale_after=60)
+    assert sorted(job.id for job in resumed) == sorted(job.id for job in jobs)
+
+
+def test_workers_claim_each_job_once_within_platform_limits(store):
+    saved_jobs(store, 6, platform='youtube')
+    saved_jobs(store, 6, platform='tiktok')
+    claimed = []
+    lock = threading.Lock()
+
+    def claim(worker):
+        records = store.claim(worker, 4, lambda platform: 3)
+        with lock:
+            claimed.extend(records)
+
+    threads = [threading.Thread(target=claim, args=(f'worker-{index}',)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ids = [record['id'] for record in claimed]
+    assert len(ids) == len(set(ids)) == 6
+    assert Counter(record['platform'] for record in claimed) == Counter({'youtube': 3, 'tiktok': 3})
+
+
+def test_claim_skips_jobs_owned_by_a_process(store):
+    saved_jobs(store, 2, worker='inline-process-1')
+    assert store.claim('worker-1', 4, lambda platform: 4) == []
+
+
+def test_requeue_stale_returns_jobs_to_the_queue(store):
+    saved_jobs(store, 2)
+    records = store.claim('worker-1', 2, lambda platform: 2)
+    store._conn.execute('UPDATE jobs SET heartbeat_at = ?', (time.time() - 120,))
+    assert store.requeue_stale(60) == 2
+    assert sorted(record['id'] for record in store.claim('worker-2', 2, lambda platform: 2)) == \
+        sorted(record['id'] for record in records)
+
+
+def test_a_requeued_job_is_not_overwritten_by_its_old_owner(store):
+    saved_jobs(store, 1)
+    job = Job.from_record(store.claim('worker-1', 1, lambda platform: 1)[0])
+    store._conn.execute('UPDATE jobs SET heartbeat_at = ?', (time.time() - 120,))
+    store.requeue_stale(60)
+    assert store.claim('worker-2', 1, lambda platform: 1)
+    job.state = 'completed'
+    assert store.save(job) is False
+    record = store.load(job.id)
+    assert (record['worker'], record['state']) == ('worker-2', 'running')
+
+
+def test_a_job_taken_over_mid_run_stops_here(store):
+    stopped = []
+
+    def runner(job):
+        # Another worker takes the job over while this one downloads it
+        store._conn.execute("UPDATE jobs SET worker = 'elsewhere-1234' WHERE id = ?", (job.id,))
+        try:
+            manager.update(job, progress=50)
+        except JobTakenOverError:
+            stopped.append(job.id)
+            raise
+        return {'status': 'success'}
+
+    manager = JobManager(runner, store=store, progress_interval=0)
+    job = manager.submit('https://example.com/video', 'generic')
+    wait_for(lambda: job.message == 'Taken over by another worker')
+    assert stopped == [job.id]
+    record = store.load(job.id)
+    assert (record['worker'], record['state'], record['progress']) == ('elsewhere-1234', 'running', 0)
+    assert manager.get(job.id).worker == 'elsewhere-1234'
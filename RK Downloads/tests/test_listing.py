@@ -0,0 +1,53 @@
+import os
+import uuid
+
+import pytest
+
+from listing import DownloadIndex
+
+
+@pytest.fixture
+def downloads(tmp_path):
+    for name, size in (('b', 30), ('a', 10), ('c', 20)):
+        os.makedirs(tmp_path / name)
+        (tmp_path / name / 'clip.mp4').write_bytes(b'x' * size)
+    return tmp_path
+
+
+def test_pages_are_sorted_and_counted(downloads):
+    index = DownloadIndex(str(downloads))
+    items, total = index.page('name', 'asc', page=1, per_page=2)
+    assert total == 3
+    assert [item['name'] for item in items] == ['a', 'b']
+    items, total = index.page('size', 'desc', page=2, per_page=2)
+    assert [(item['name'], item['size'], item['file_count']) for item in items] == [('a', 10, 1)]
+
+
+def test_etag_changes_with_the_listing_only(downloads):
+    index = DownloadIndex(str(downloads))
+    etag = index.etag
+    assert index.etag == etag
+    os.makedirs(downloads / 'd')
+    assert index.etag != etag
+    etag = index.etag
+    # A job folder whose download finished is rescanned on refresh
+    (downloads / 'd' / 'clip.mp4').write_bytes(b'x')
+    index.refresh('d')
+    assert index.etag != etag
+    assert {item['name']: item['file_count'] for item in index.items()}['d'] == 1
+
+
+def test_listing_revalidates_with_its_etag(rk, client):
+    os.makedirs(os.path.join(rk.DOWNLOAD_DIR, f'listing_{uuid.uuid4().hex}'))
+    response = client.get('/downloads?sort=name&order=asc&per_page=1')
+    assert response.status_code == 200
+    assert response.get_json()['total'] >= 1 and len(response.get_json()['items']) == 1
+    revalidated = client.get('/downloads?sort=name&order=asc&per_page=1', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    # Another page is another representation
+    other_page = client.get('/downloads?sort=name&order=asc&per_page=1&page=2', headers={'If-None-Match': response.headers['ETag']})
+    assert other_page.status_code == 200
+
+    os.makedirs(os.path.join(rk.DOWNLOAD_DIR, f'listing_{uuid.uuid4().hex}'))
+    changed = client.get('/downloads?sort=name&order=asc&per_page=1', headers={'If-None-Match': response.headers['ETag']})
+    assert changed.status_code == 200
@@ -0,0 +1,39 @@
+import json
+
+from metrics import Metrics
+
+
+def worker_metrics(platform):
+    """Metrics of a worker process that ran one failed and one successful job"""
+    worker = Metrics()
+    trace = worker.trace(platform)
+    trace.update(phase='download', downloaded_bytes=1000)
+    trace.finish({'status': 'error', 'message': 'HTTP Error 403: Forbidden'})
+    trace = worker.trace(platform)
+    trace.update(phase='download', downloaded_bytes=500)
+    trace.finish({'status': 'success'})
+    return worker
+
+
+def test_snapshots_are_added_into_the_rendered_series():
+    worker = worker_metrics('snapshots')
+    web = Metrics()
+    web.jobs.inc(platform='snapshots', status='success')
+    text = web.render([json.loads(json.dumps(worker.snapshot()))])
+    assert 'rk_jobs_total{platform="snapshots",status="success"} 2' in text
+    assert 'rk_jobs_total{platform="snapshots",status="error"} 1' in text
+    assert 'rk_job_errors_total{platform="snapshots",error_class="forbidden"} 1' in text
+    assert 'rk_phase_seconds_count{platform="snapshots",phase="download"} 2' in text
+    assert 'rk_downloaded_bytes_total{platform="snapshots"} 1500' in text
+
+
+def test_external_workers_are_visible_in_the_web_metrics(rk, client, monkeypatch):
+    rk.job_store.save_metrics('worker-a', worker_metrics('external').snapshot())
+    rk.job_store.save_metrics('worker-b', worker_metrics('external').snapshot())
+    monkeypatch.setitem(rk.app.config, 'WORKER_MODE', 'external')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'rk_jobs_total{platform="external",status="success"} 2' in text
+    assert 'rk_phase_seconds_count{platform="external",phase="download"} 4' in text
+
+    monkeypatch.setitem(rk.app.config, 'WORKER_MODE', 'inline')
+    assert 'platform="external"' not in client.get('/metrics').get_data(as_text=True)
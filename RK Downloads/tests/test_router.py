@@ -0,0 +1,84 @@
+import pytest
+import yt_dlp
+
+from router import UrlRouter
+
+VIDEO = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+@pytest.fixture(scope='module')
+def router():
+    return UrlRouter()
+
+
+@pytest.mark.parametrize('url, platform', [
+    ('https://x.com/user/status/1', 'twitter'),
+    ('https://box.com/s/abc', 'unknown'),
+    ('https://www.box.com/s/abc', 'unknown'),
+    ('https://dropbox.com/s/abc', 'unknown'),
+    ('https://notyoutube.com/watch?v=dQw4w9WgXcQ', 'unknown'),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube'),
+    ('https://vm.tiktok.com/ZM123/', 'tiktok'),
+    ('https://old.reddit.com/r/videos/comments/1/title/', 'reddit'),
+    ('https://fb.watch/abc/', 'facebook'),
+    ('https://Instagram.COM/p/ABC/', 'instagram'),
+    ('youtube.com/watch?v=dQw4w9WgXcQ', 'youtube'),
+])
+def test_platforms_follow_the_host_and_its_parent_domains(router, url, platform):
+    assert router.route(url).platform == platform
+
+
+@pytest.mark.parametrize('url, canonical', [
+    # YouTube short links, shorts, embeds and mirror hosts are one video
+    ('https://youtu.be/dQw4w9WgXcQ?si=abc&t=10', VIDEO),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', VIDEO),
+    ('https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ?rel=0', VIDEO),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=share', VIDEO),
+    ('https://youtube.com/watch?v=dQw4w9WgXcQ&pp=xyz&utm_source=x', VIDEO),
+    ('https://www.youtube.com/watch?list=PL123&v=dQw4w9WgXcQ&index=3', 'https://www.youtube.com/watch?list=PL123&v=dQw4w9WgXcQ'),
+    # Share and tracking parameters, fragments and trailing slashes go
+    ('https://twitter.com/user/status/1?s=20&t=abc', 'https://x.com/user/status/1'),
+    ('https://mobile.twitter.com/user/status/1/', 'https://x.com/user/status/1'),
+    ('https://www.instagram.com/p/ABC/?igshid=xyz&utm_medium=copy_link', 'https://www.instagram.com/p/ABC'),
+    ('https://m.facebook.com/watch/?v=123&fbclid=abc', 'https://www.facebook.com/watch?v=123'),
+    ('https://www.reddit.com/r/videos/comments/1/title/?utm_source=share&utm_medium=web2x',
+     'https://www.reddit.com/r/videos/comments/1/title'),
+    # Unknown hosts keep their page and parameters, minus tracking ones
+    ('https://example.com/video?id=3&utm_source=x&fbclid=1#t=3', 'https://example.com/video?id=3'),
+    ('HTTPS://Example.COM:8080/a?s=1&t=2', 'https://example.com:8080/a?s=1&t=2'),
+])
+def test_canonical_urls(router, url, canonical):
+    assert router.route(url).url == canonical
+
+
+@pytest.mark.parametrize('url, ie_key', [
+    (VIDEO, 'Youtube'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'Youtube'),
+    ('https://www.youtube.com/playlist?list=PL123', 'YoutubeTab'),
+    ('https://x.com/user/status/1', 'Twitter'),
+    ('https://www.instagram.com/p/ABC/', 'Instagram'),
+    ('https://vm.tiktok.com/ZM123/', 'TikTokVM'),
+    ('https://example.com/video.mp4', None),
+])
+def test_extractor_hints_match_yt_dlp(router, url, ie_key):
+    assert router.route(url).ie_key == ie_key
+    if ie_key:
+        # The hint is the extractor yt-dlp would pick itself
+        assert next(ie for ie in yt_dlp.extractor.gen_extractor_classes() if ie.suitable(router.route(url).url)).ie_key() == ie_key
+
+
+def test_equivalent_urls_share_cache_job_and_store_keys(rk):
+    downloader = rk.downloader
+    variants = ['https://youtu.be/dQw4w9WgXcQ?si=x', 'https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=share',
+                'https://www.youtube.com/shorts/dQw4w9WgXcQ']
+    assert {downloader.canonical_url(url) for url in variants} == {VIDEO}
+    assert len({downloader.job_key(url, 'best') for url in variants}) == 1
+    assert {downloader.media_identity(url) for url in variants} == {('Youtube', 'dQw4w9WgXcQ')}
+
+
+def test_unknown_hosts_are_not_matched_against_every_extractor(rk, monkeypatch):
+    def scan():
+        raise AssertionError('scanned all extractors')
+
+    monkeypatch.setattr(yt_dlp.extractor, 'gen_extractor_classes', scan)
+    assert rk.downloader.media_identity('https://example.com/watch/123') is None
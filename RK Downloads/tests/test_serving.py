@@ -0,0 +1,88 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from media_server import media_bytes
+
+SIZE = 10000
+
+
+@pytest.fixture
+def video(rk):
+    folder = os.path.join(rk.DOWNLOAD_DIR, 'serving_test')
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'clip.mp4'), 'wb') as f:
+        f.write(media_bytes(0, SIZE))
+    return 'serving_test/clip.mp4'
+
+
+def get(client, path, **headers):
+    response = client.get(f'/download-file/{path}', headers=headers)
+    body = response.get_data()
+    response.close()
+    return response, body
+
+
+def test_full_file(client, video):
+    response, body = get(client, video)
+    assert response.status_code == 200
+    assert body == media_bytes(0, SIZE)
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(SIZE)
+
+
+def test_byte_range(client, video):
+    response, body = get(client, video, Range='bytes=100-199')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{SIZE}'
+    assert body == media_bytes(100, 200)
+
+
+def test_suffix_range(client, video):
+    response, body = get(client, video, Range='bytes=-50')
+    assert response.status_code == 206
+    assert body == media_bytes(SIZE - 50, SIZE)
+
+
+def test_unsatisfiable_range(client, video):
+    response, body = get(client, video, Range='bytes=20000-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+
+def test_conditional_get(client, video):
+    response, body = get(client, video)
+    revalidated, body = get(client, video, **{'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert body == b''
+
+
+def test_transfers_are_released(rk, client, video):
+    for headers in ({}, {'Range': 'bytes=0-9'}, {'Range': 'bytes=20000-'}):
+        get(client, video, **headers)
+    assert rk.storage.stats()['active_transfers'] == 0
+
+
+def test_paths_outside_downloads_are_rejected(client, video):
+    response, body = get(client, '../data/jobs.db')
+    assert response.status_code == 404
+
+
+def test_folder_zip(rk, client, video):
+    with open(os.path.join(rk.DOWNLOAD_DIR, 'serving_test', 'clip.en.vtt'), 'w', encoding='utf-8') as f:
+        f.write('WEBVTT\n\n' * 100)
+    response = client.get('/download-folder/serving_test')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    response.close()
+    assert archive.read('clip.mp4') == media_bytes(0, SIZE)
+    # Media is already compressed, so it is stored as is; text is deflated
+    assert archive.getinfo('clip.mp4').compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo('clip.en.vtt').compress_type == zipfile.ZIP_DEFLATED
+    assert rk.storage.stats()['active_transfers'] == 0
+
+
+def test_missing_folder_zip(client):
+    assert client.get('/download-folder/no_such_folder').status_code == 404
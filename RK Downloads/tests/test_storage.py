@@ -0,0 +1,219 @@
+import io
+import os
+import time
+import uuid
+import zipfile
+
+import pytest
+
+from jobs import Job
+from storage import StorageManager
+
+
+@pytest.fixture
+def root(tmp_path):
+    os.makedirs(tmp_path / 'downloads')
+    os.makedirs(tmp_path / 'store' / 'objects')
+    return tmp_path
+
+
+def folder(root, name, size, age=3600, file='clip.mp4'):
+    """A job folder of one file of size bytes, last modified age seconds ago"""
+    path = root / 'downloads' / name
+    os.makedirs(path, exist_ok=True)
+    (path / file).write_bytes(b'x' * size)
+    then = time.time() - age
+    os.utime(path, (then, then))
+    return path
+
+
+def store_object(root, name, size):
+    path = root / 'store' / 'objects' / name
+    path.write_bytes(b'y' * size)
+    return path
+
+
+def manager(root, quota, **options):
+    options.setdefault('min_age', 0)
+    return StorageManager(str(root / 'downloads'), quota, store_objects_dir=str(root / 'store' / 'objects'), **options)
+
+
+def remaining(root):
+    return sorted(os.listdir(root / 'downloads'))
+
+
+def test_nothing_is_evicted_under_the_high_watermark(root):
+    for index, name in enumerate('abcd'):
+        folder(root, name, 200, age=1000 - index)
+    storage = manager(root, 1000)
+    assert storage.enforce() == 0
+    assert storage.usage == 800
+    assert remaining(root) == ['a', 'b', 'c', 'd']
+
+
+def test_least_recently_used_go_first_down_to_the_low_watermark(root):
+    for index, name in enumerate('abcde'):
+        folder(root, name, 200, age=1000 - index)
+    storage = manager(root, 1000)
+    # A download of a makes it the most recently used
+    storage.acquire('a')
+    storage.release('a')
+    assert storage.enforce() == 400
+    assert remaining(root) == ['a', 'd', 'e']
+    assert storage.usage == 600 and not storage.blocked
+
+
+def test_folders_in_use_or_too_young_are_kept(root):
+    for index, name in enumerate('abcdef'):
+        folder(root, name, 200, age=1000 - index)
+    folder(root, 'c', 200, age=10)
+    storage = manager(root, 1000, min_age=300, active_entries=lambda: {'a'})
+    assert storage.acquire('b')
+    storage.enforce()
+    assert remaining(root) == ['a', 'b', 'c']
+    assert not storage.blocked
+
+
+def test_over_quota_with_nothing_evictable_is_reported(root):
+    for name in 'ab':
+        folder(root, name, 500)
+    storage = manager(root, 1000, active_entries=lambda: {'a', 'b'})
+    assert storage.enforce() == 0
+    assert remaining(root) == ['a', 'b']
+    assert storage.blocked
+
+
+def test_usage_counts_each_inode_once(root):
+    shared = store_object(root, 'shared', 300)
+    for name in 'ab':
+        os.makedirs(root / 'downloads' / name)
+        os.link(shared, root / 'downloads' / name / 'clip.mp4')
+    folder(root, 'c', 100)
+    storage = manager(root, 0)
+    storage.enforce()
+    assert storage.usage == 400
+
+
+def test_only_orphaned_store_objects_are_collected(root):
+    linked = store_object(root, 'linked', 300)
+    os.makedirs(root / 'downloads' / 'a')
+    os.link(linked, root / 'downloads' / 'a' / 'clip.mp4')
+    folder(root, 'b', 200)
+    orphan = store_object(root, 'orphan', 300)
+    # 800 bytes used: over 90% of 850, and under 75% once the orphan is gone
+    storage = manager(root, 850)
+    assert storage.enforce() == 300
+    assert not orphan.exists()
+    assert linked.exists()
+    assert remaining(root) == ['a', 'b']
+
+
+def test_store_objects_go_with_the_last_folder_linking_them(root):
+    linked = store_object(root, 'linked', 300)
+    os.makedirs(root / 'downloads' / 'a')
+    os.link(linked, root / 'downloads' / 'a' / 'clip.mp4')
+    os.utime(root / 'downloads' / 'a', (time.time() - 3600, time.time() - 3600))
+    folder(root, 'b', 200, age=60)
+    storage = manager(root, 500)
+    assert storage.enforce() == 300
+    assert remaining(root) == ['b']
+    assert not linked.exists()
+
+
+def test_clear_keeps_folders_in_use(root):
+    for name in 'abc':
+        folder(root, name, 100)
+    storage = manager(root, 0, active_entries=lambda: {'a'})
+    storage.acquire('b')
+    assert storage.clear() == ['a', 'b']
+    assert remaining(root) == ['a', 'b']
+
+
+def test_clear_downloads_leaves_folders_in_use(rk, client):
+    names = {kind: f'clear_{kind}_{uuid.uuid4().hex[:8]}' for kind in ('queued', 'sending', 'idle')}
+    for name in names.values():
+        os.makedirs(os.path.join(rk.DOWNLOAD_DIR, name))
+    job = Job('https://example.com/queued', 'generic')
+    job.folder = names['queued']
+    job.worker = rk.job_manager.owner
+    rk.job_store.save(job)
+    rk.storage.acquire(names['sending'])
+    try:
+        data = client.post('/clear-downloads').get_json()
+    finally:
+        rk.storage.release(names['sending'])
+        job.state = 'completed'
+        rk.job_store.save(job)
+    assert data['status'] == 'success'
+    assert {names['queued'], names['sending']} <= set(data['kept'])
+    assert os.path.isdir(os.path.join(rk.DOWNLOAD_DIR, names['queued']))
+    assert os.path.isdir(os.path.join(rk.DOWNLOAD_DIR, names['sending']))
+    assert not os.path.exists(os.path.join(rk.DOWNLOAD_DIR, names['idle']))
+
+
+@pytest.fixture
+def evictable(rk):
+    name = f'evict_{uuid.uuid4().hex[:8]}'
+    os.makedirs(os.path.join(rk.DOWNLOAD_DIR, name))
+    with open(os.path.join(rk.DOWNLOAD_DIR, name, 'clip.mp4'), 'wb') as f:
+        f.write(b'z' * 1000)
+    return name
+
+
+def try_evict(storage, name):
+    entries, inodes = storage.scan()
+    return storage.evict(name, entries[name], inodes)
+
+
+def test_file_is_not_evicted_between_lookup_and_open(rk, client, evictable, monkeypatch):
+    resolve = rk.resolve_download_path
+
+    def resolve_then_evict(relative_path):
+        path = resolve(relative_path)
+        try_evict(rk.storage, evictable)
+        return path
+
+    monkeypatch.setattr(rk, 'resolve_download_path', resolve_then_evict)
+    response = client.get(f'/download-file/{evictable}/clip.mp4')
+    assert response.status_code == 200
+    assert response.get_data() == b'z' * 1000
+    response.close()
+    assert rk.storage.stats()['active_transfers'] == 0
+
+
+def test_file_removed_after_lookup_is_not_found(rk, client, evictable, monkeypatch):
+    resolve = rk.resolve_download_path
+
+    def resolve_then_remove(relative_path):
+        path = resolve(relative_path)
+        os.remove(path)
+        return path
+
+    monkeypatch.setattr(rk, 'resolve_download_path', resolve_then_remove)
+    assert client.get(f'/download-file/{evictable}/clip.mp4').status_code == 404
+    assert rk.storage.stats()['active_transfers'] == 0
+
+
+def test_folder_is_not_evicted_before_it_is_zipped(rk, client, evictable, monkeypatch):
+    iter_zip = rk.iter_zip
+
+    def evict_then_zip(folder):
+        try_evict(rk.storage, evictable)
+        return iter_zip(folder)
+
+    monkeypatch.setattr(rk, 'iter_zip', evict_then_zip)
+    response = client.get(f'/download-folder/{evictable}')
+    assert response.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(response.get_data())).read('clip.mp4') == b'z' * 1000
+    response.close()
+    assert rk.storage.stats()['active_transfers'] == 0
+
+
+def test_folder_removed_after_lookup_is_not_found(rk, client, evictable, monkeypatch):
+    def vanished(folder):
+        raise FileNotFoundError(folder)
+        yield
+
+    monkeypatch.setattr(rk, 'iter_zip', vanished)
+    assert client.get(f'/download-folder/{evictable}').status_code == 404
+    assert rk.storage.stats()['active_transfers'] == 0
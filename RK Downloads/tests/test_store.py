@@ -0,0 +1,92 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+from store import ContentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ContentStore(str(tmp_path / 'store'))
+
+
+@pytest.fixture
+def fast_switching():
+    """Switch threads as often as possible, so unsynchronized updates would collide"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def download(tmp_path, name, data):
+    folder = tmp_path / name
+    os.makedirs(folder, exist_ok=True)
+    path = folder / 'clip.mp4'
+    path.write_bytes(data)
+    return str(path)
+
+
+def run_threads(count, target):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_ingested_files_are_linked_and_looked_up(store, tmp_path):
+    key = store.key('Generic', 'a', 'best')
+    path = download(tmp_path, 'job1', b'media')
+    store.ingest([key], [path, path + '.part'], {'id': 'a'})
+    manifest = store.lookup(key)
+    assert [entry['name'] for entry in manifest['files']] == ['clip.mp4']
+    assert os.path.samefile(path, store.object_path(manifest['files'][0]['sha256']))
+
+    [linked] = store.materialize(manifest, str(tmp_path / 'job2'))
+    assert os.path.samefile(linked, path)
+    assert store.lookup(store.key('Generic', 'b', 'best')) is None
+    assert store.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_a_manifest_with_missing_objects_is_a_miss(store, tmp_path):
+    key = store.key('Generic', 'a', 'best')
+    manifest = store.ingest([key], [download(tmp_path, 'job1', b'media')], {'id': 'a'})
+    os.unlink(store.object_path(manifest['files'][0]['sha256']))
+    assert store.lookup(key) is None
+
+
+def test_concurrent_ingests_of_the_same_media(store, tmp_path, fast_switching):
+    key = store.key('Generic', 'a', 'best')
+    paths = [download(tmp_path, f'job{index}', b'media') for index in range(16)]
+    # Long metadata keeps each manifest write going while the others start theirs
+    info = {'id': 'a', 'description': 'x' * 1000000}
+    assert run_threads(16, lambda index: store.ingest([key], [paths[index]], dict(info, job=index))) == []
+    with open(store.manifest_path(key), encoding='utf-8') as f:
+        assert json.load(f)['key'] == key
+    assert os.listdir(store.index_dir) == [os.path.basename(store.manifest_path(key))]
+    # Every job folder ends up with a link to the one stored copy
+    assert all(os.path.samefile(path, paths[0]) for path in paths)
+
+
+def test_hits_and_misses_are_counted_exactly(store, tmp_path, fast_switching):
+    key = store.key('Generic', 'a', 'best')
+    store.ingest([key], [download(tmp_path, 'job1', b'media')], {'id': 'a'})
+    missing = store.key('Generic', 'b', 'best')
+
+    def look_up(index):
+        for _ in range(200):
+            store.lookup(key if index % 2 else missing)
+    assert run_threads(8, look_up) == []
+    assert store.stats() == {'hits': 800, 'misses': 800}
@@ -0,0 +1,109 @@
+import uuid
+
+import pytest
+
+from media_server import media_bytes
+
+SIZE = 300000
+
+
+def page(media):
+    """A page URL no extractor has seen, so each test starts with an empty info cache"""
+    return f'{media.base_url}/watch/{uuid.uuid4().hex}'
+
+
+def video_info(url, *formats):
+    return {'id': 'clip', 'title': 'Clip', 'ext': 'mp4', 'webpage_url': url, 'formats': list(formats)}
+
+
+def progressive(media, path='media/clip.mp4', format_id='18'):
+    return {'format_id': format_id, 'url': f'{media.base_url}/{path}?size={SIZE}', 'ext': 'mp4',
+            'protocol': 'https', 'vcodec': 'avc1', 'acodec': 'mp4a'}
+
+
+@pytest.fixture
+def extractions(rk, monkeypatch):
+    """Replace yt-dlp extraction with a queue of info dicts; records each URL extracted"""
+    calls = []
+    results = []
+
+    def extract(url):
+        calls.append(url)
+        info = results.pop(0)
+        rk.downloader.cache_info(url, info)
+        return info
+    monkeypatch.setattr(rk.downloader, '_extract_info', extract)
+    return calls, results
+
+
+def stream(client, url, **headers):
+    response = client.get('/stream', query_string={'url': url}, headers=headers)
+    body = response.get_data()
+    response.close()
+    return response, body
+
+
+def test_range_requests_pass_through(client, media, extractions):
+    calls, results = extractions
+    url = page(media)
+    results.append(video_info(url, progressive(media)))
+    response, body = stream(client, url, Range='bytes=1000-1999')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000-1999/{SIZE}'
+    assert response.headers['Content-Length'] == '1000'
+    assert body == media_bytes(1000, 2000)
+
+    response, body = stream(client, url)
+    assert response.status_code == 200
+    assert body == media_bytes(0, SIZE)
+    # The second request was served from the info cache
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('path', ['hls/clip.m3u8', 'dash/clip.mpd'])
+def test_segmented_formats_are_rejected(client, media, path):
+    response, body = stream(client, f'{media.base_url}/{path}?segments=2&size=1000')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_formats_that_need_merging_are_rejected(client, media, extractions):
+    calls, results = extractions
+    url = page(media)
+    video_only = dict(progressive(media, format_id='137'), acodec='none')
+    audio_only = dict(progressive(media, format_id='140'), vcodec='none')
+    results.append(video_info(url, audio_only, video_only))
+    response, body = stream(client, url)
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_a_requested_format_that_needs_merging_is_rejected(client, media, extractions):
+    calls, results = extractions
+    url = page(media)
+    video_only = dict(progressive(media, format_id='137'), acodec='none')
+    results.append(video_info(url, video_only, progressive(media)))
+    response = client.get('/stream', query_string={'url': url, 'format': '137'})
+    assert response.status_code == 400
+    assert '137' in response.get_json()['message']
+
+
+def test_an_expired_url_is_extracted_once_more(client, media, extractions):
+    calls, results = extractions
+    url = page(media)
+    results.append(video_info(url, progressive(media, path='expired/clip.mp4')))
+    results.append(video_info(url, progressive(media)))
+    response, body = stream(client, url, Range='bytes=0-99')
+    assert response.status_code == 206
+    assert body == media_bytes(0, 100)
+    assert len(calls) == 2
+
+
+def test_a_url_that_stays_expired_is_not_retried_again(client, media, extractions):
+    calls, results = extractions
+    url = page(media)
+    results.append(video_info(url, progressive(media, path='expired/clip.mp4')))
+    results.append(video_info(url, progressive(media, path='expired/clip.mp4')))
+    response, body = stream(client, url)
+    assert response.status_code == 502
+    assert len(calls) == 2
@@ -0,0 +1,106 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import instaloader
+import pytest
+import yt_dlp
+
+from syncstate import SyncState
+
+
+def test_state_round_trips(tmp_path):
+    state = SyncState(str(tmp_path))
+    assert state.load('youtube:channel') == {}
+    state.update('youtube:channel', platform='youtube', latest_id='a', new_items=3)
+    state.update('youtube:channel', new_items=1)
+    saved = SyncState(str(tmp_path)).load('youtube:channel')
+    assert (saved['platform'], saved['latest_id'], saved['new_items'], saved['syncs']) == ('youtube', 'a', 1, 2)
+    state.update('instagram:someone', latest_date=1.5)
+    assert [source['source'] for source in state.sources()] == ['instagram:someone', 'youtube:channel']
+
+
+def test_archive_is_in_yt_dlp_format(tmp_path):
+    state = SyncState(str(tmp_path))
+    state.add_to_archive('youtube:channel', ['youtube dQw4w9WgXcQ', 'youtube abcdefghijk'])
+    state.add_to_archive('youtube:channel', ['youtube zyxwvutsrqp'])
+    assert state.archived_ids('youtube:channel') == {'youtube dQw4w9WgXcQ', 'youtube abcdefghijk', 'youtube zyxwvutsrqp'}
+    assert state.archived_ids('youtube:other') == set()
+    # yt-dlp itself reads the file as a --download-archive
+    with yt_dlp.YoutubeDL({'download_archive': state.archive_path('youtube:channel'), 'quiet': True}) as ydl:
+        assert ydl.in_download_archive({'id': 'dQw4w9WgXcQ', 'extractor_key': 'Youtube'})
+        assert not ydl.in_download_archive({'id': 'notarchived', 'extractor_key': 'Youtube'})
+
+
+def entry_ids(entries):
+    return [entry['id'] for entry in entries]
+
+
+@pytest.mark.parametrize('path, expected', [
+    # Channel tabs list newest first: listing stops at the first archived video
+    ('/channel/{name}', [0]),
+    # Playlists can change order anywhere, so every entry is checked
+    ('/playlist/{name}.html', [0, 2]),
+])
+def test_only_unarchived_entries_are_listed(rk, media, path, expected):
+    downloader = rk.downloader
+    url = f'{media.base_url}{path.format(name=uuid.uuid4().hex[:8])}?entries=3&size=1000'
+    ids = entry_ids(downloader.new_playlist_entries(url, set()))
+    assert len(ids) == 3
+    known = {yt_dlp.utils.make_archive_id('HTML5MediaEmbed', ids[1])}
+    assert entry_ids(downloader.new_playlist_entries(url, known)) == [ids[index] for index in expected]
+
+
+def test_playlist_sync_with_nothing_new_downloads_nothing(rk, media, tmp_path):
+    downloader = rk.downloader
+    url = f'{media.base_url}/channel/{uuid.uuid4().hex[:8]}?entries=3&size=1000'
+    source = f'youtube:{downloader.canonical_url(url)}'
+    entries = downloader.new_playlist_entries(url, set())
+    downloader.sync_state.add_to_archive(source, [downloader.archive_id(entry) for entry in entries])
+    options = downloader.engine.options('youtube', str(tmp_path), 'best')
+    result = downloader.download_youtube_playlist(url, str(tmp_path), options, sync=True)
+    assert (result['status'], result['new']) == ('success', 0), result
+    assert os.listdir(tmp_path) == []
+    assert downloader.sync_state.load(source)['new_items'] == 0
+
+
+class Post:
+    def __init__(self, shortcode, hours_ago, is_pinned=False):
+        self.shortcode = shortcode
+        self.date_utc = datetime.now() - timedelta(hours=hours_ago)
+        self.is_pinned = is_pinned
+
+
+@pytest.fixture
+def profile_posts(rk, monkeypatch):
+    """Posts the stubbed Instagram profile lists, newest first after any pinned ones; returns the downloaded shortcodes"""
+    posts = []
+    downloaded = []
+
+    class Profile:
+        @staticmethod
+        def get_posts():
+            return iter(posts)
+
+    monkeypatch.setattr(instaloader.Profile, 'from_username', lambda context, username: Profile)
+    monkeypatch.setattr(instaloader.Instaloader, 'download_post', lambda loader, post, target: downloaded.append(post.shortcode))
+    monkeypatch.setattr(rk.downloader, 'record_instagram_artifacts', lambda post: None)
+    return posts, downloaded
+
+
+def test_profile_sync_skips_pinned_posts_and_stops_at_the_last_seen(rk, tmp_path, profile_posts):
+    posts, downloaded = profile_posts
+    url = f'https://www.instagram.com/user{uuid.uuid4().hex[:8]}/'
+    pinned, older, newest = Post('pinned', 500, is_pinned=True), Post('a', 30), Post('b', 20)
+    posts[:] = [pinned, newest, older]
+    first = rk.downloader.download_instagram_content(url, str(tmp_path), sync=True)
+    assert first['status'] == 'success', first
+    assert downloaded == ['pinned', 'b', 'a']
+
+    downloaded.clear()
+    # Two new posts since; the pinned post is still listed first
+    posts[:] = [pinned, Post('d', 1), Post('c', 2), newest, older]
+    again = rk.downloader.download_instagram_content(url, str(tmp_path), sync=True)
+    assert again['status'] == 'success', again
+    assert downloaded == ['d', 'c']
+    assert again['new'] == 2
@@ -0,0 +1,57 @@
+import os
+import zipfile
+
+# Sidecar files that actually shrink; media is already compressed, so it is STORED
+DEFLATE_EXTENSIONS = {'.json', '.txt', '.xml', '.vtt', '.srt', '.ass', '.ssa', '.lrc', '.ttml', '.srv1', '.srv2', '.srv3'}
+
+
+class _StreamBuffer:
+    """Write-only file object that collects what zipfile writes until it is drained.
+
+    It supports tell() but not seek(), which makes zipfile write data
+    descriptors after each entry instead of seeking back to patch headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(folder, chunk_size=1024 * 1024):
+    """Yield a ZIP (ZIP64 when needed) of folder piece by piece with constant memory"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zipf:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, folder)
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                extension = os.path.splitext(file)[1].lower()
+                zinfo.compress_type = zipfile.ZIP_DEFLATED if extension in DEFLATE_EXTENSIONS else zipfile.ZIP_STORED
+                # zipfile switches the entry to ZIP64 itself based on zinfo.file_size
+                with open(file_path, 'rb') as source, zipf.open(zinfo, 'w') as target:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        target.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            yield data
+                yield buffer.drain()
+    # Central directory, written when the archive is closed
+    yield buffer.drain()
@@ -1,13 +1,16 @@
 // Global variables
 let currentTab = 'single';
 let downloads = [];
-let progressInterval = null;
+let progressSource = null;
 
 // Initialize the app
 document.addEventListener('DOMContentLoaded', function() {
     createParticles();
     refreshDownloads();
-    setInterval(refreshDownloads, 5000); // Refresh downloads every 5 seconds
+
+    // Refresh downloads whenever a job finishes instead of polling
+    const events = new EventSource('/events');
+    events.addEventListener('job-finished', refreshDownloads);
 });
 
 // Tab switching
@@ -36,6 +39,7 @@ function switchTab(tabName) {
         // Single download
         async function downloadSingle() {
             const url = document.getElementById('single-url').value.trim();
+            const quality = document.getElementById('quality-select').value || null;
             const statusDiv = document.getElementById('single-status');
             const spinner = document.getElementById('single-spinner');
             const buttonText = document.getElementById('single-text');
@@ -61,41 +65,33 @@ function switchTab(tabName) {
                 const response = await fetch('/download', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ url })
+                    body: JSON.stringify({ url, quality })
                 });
 
                 const result = await response.json();
 
                 if (result.status === 'started') {
-                    // Start progress monitoring
-                    progressInterval = setInterval(async () => {
-                        try {
-                            const progressResponse = await fetch('/progress');
-                            const progressData = await progressResponse.json();
-
-                            progressFill.style.width = progressData.progress + '%';
-                            progressText.textContent = progressData.status;
-
-                            if (progressData.progress >= 100) {
-                                clearInterval(progressInterval);
-                                progressInterval = null;
-                                showStatus(statusDiv, '✅ Download completed successfully!', 'success');
-                                document.getElementById('single-url').value = '';
-                                refreshDownloads();
-                            }
-                        } catch (error) {
-                            console.error('Progress check failed:', error);
-                        }
-                    }, 1000);
-
-                    // Stop monitoring after 5 minutes
-                    setTimeout(() => {
-                        if (progressInterval) {
-                            clearInterval(progressInterval);
-                            progressInterval = null;
-                            showStatus(statusDiv, '⚠️ Download may still be in progress. Check downloads tab.', 'warning');
+                    // Follow progress for this job over Server-Sent Events
+                    if (progressSource) progressSource.close();
+                    progressSource = new EventSource(`/jobs/${result.job_id}/events`);
+
+                    progressSource.addEventListener('progress', event => {
+                        const job = JSON.parse(event.data);
+
+                        progressFill.style.width = job.progress + '%';
+                        progressText.textContent = formatProgress(job);
+
+                        if (job.state === 'completed') {
+                            progressSource.close();
+                            progressSource = null;
+                            showStatus(statusDiv, '✅ Download completed successfully!', 'success');
+                            document.getElementById('single-url').value = '';
+                        } else if (job.state === 'failed') {
+                            progressSource.close();
+                            progressSource = null;
+                            showStatus(statusDiv, `❌ ${job.message}`, 'error');
                         }
-                    }, 300000);
+                    });
 
                 } else {
                     showStatus(statusDiv, `❌ ${result.message}`, 'error');
@@ -143,19 +139,38 @@ function switchTab(tabName) {
                     body: JSON.stringify({ urls })
                 });
                 
-                const result = await response.json();
-                
-                if (result.status === 'success') {
-                    let message = `✅ ${result.message}\n\n`;
-                    result.results.forEach((res, index) => {
+                if (!response.headers.get('Content-Type').includes('ndjson')) {
+                    const result = await response.json();
+                    showStatus(statusDiv, `❌ ${result.message}`, 'error');
+                    return;
+                }
+
+                // Results arrive one JSON line per URL as each download finishes
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let done = 0;
+                statusDiv.innerHTML = '';
+
+                while (true) {
+                    const { value, done: streamDone } = await reader.read();
+                    if (streamDone) break;
+                    buffer += decoder.decode(value, { stream: true });
+
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop();
+                    lines.filter(line => line.trim()).forEach(line => {
+                        const res = JSON.parse(line);
+                        if (res.status === 'done') {
+                            showStatus(statusDiv, `✅ ${res.message}`, 'success', true);
+                            document.getElementById('bulk-urls').value = '';
+                            return;
+                        }
+                        done += 1;
+                        buttonText.textContent = `Processed ${done} of ${urls.length} URLs...`;
                         const icon = res.status === 'success' ? '✅' : '❌';
-                        message += `${icon} URL ${index + 1}: ${res.message}\n`;
+                        showStatus(statusDiv, `${icon} URL ${res.index + 1}: ${res.message}`, res.status === 'success' ? 'success' : 'error', true);
                     });
-                    
-                    showStatus(statusDiv, message, 'success');
-                    document.getElementById('bulk-urls').value = '';
-                } else {
-                    showStatus(statusDiv, `❌ ${result.message}`, 'error');
                 }
             } catch (error) {
                 showStatus(statusDiv, `❌ Network error: ${error.message}`, 'error');
@@ -196,6 +211,9 @@ function switchTab(tabName) {
                     });
                     
                     html += '</div>';
+                    if (result.total > result.items.length) {
+                        html += `<p class="download-meta">Showing the ${result.items.length} most recent of ${result.total} items</p>`;
+                    }
                     downloadsDiv.innerHTML = html;
                 } else {
                     downloadsDiv.innerHTML = `
@@ -253,6 +271,17 @@ function switchTab(tabName) {
             }
         }
 
+        function formatProgress(job) {
+            if (job.phase !== 'download' || !job.downloaded_bytes) return job.message;
+
+            let text = job.message + ' - ' + formatFileSize(job.downloaded_bytes);
+            if (job.total_bytes) text += ' of ' + formatFileSize(job.total_bytes);
+            if (job.speed) text += ` (${formatFileSize(job.speed)}/s`;
+            if (job.speed && job.eta != null) text += `, ${job.eta}s left`;
+            if (job.speed) text += ')';
+            return text;
+        }
+
         function formatFileSize(bytes) {
             if (bytes === 0) return '0 Bytes';
             const k = 1024;
@@ -268,17 +297,25 @@ function switchTab(tabName) {
 
         // Platform detection
         document.getElementById('single-url').addEventListener('input', function(e) {
-            const url = e.target.value.toLowerCase();
+            const url = e.target.value.trim();
             const platforms = {
                 'youtube.com': 'YouTube', 'youtu.be': 'YouTube',
                 'instagram.com': 'Instagram', 'tiktok.com': 'TikTok',
                 'twitter.com': 'Twitter', 'x.com': 'Twitter',
-                'facebook.com': 'Facebook', 'reddit.com': 'Reddit'
+                'facebook.com': 'Facebook', 'fb.watch': 'Facebook',
+                'reddit.com': 'Reddit', 'redd.it': 'Reddit'
             };
 
-            const platform = Object.keys(platforms).find(key => url.includes(key));
+            // Match on the hostname (or a parent domain), so e.g. box.com isn't taken for x.com
+            let host = '';
+            try {
+                host = new URL(/^[a-z][a-z0-9+.-]*:\/\//i.test(url) ? url : 'https://' + url).hostname.toLowerCase();
+            } catch (err) {
+                return;
+            }
+            const platform = Object.keys(platforms).find(key => host === key || host.endsWith('.' + key));
 
-            if (platform && url.trim()) {
+            if (platform) {
                 const statusDiv = document.getElementById('single-status');
                 showStatus(statusDiv, `🌐 Detected: ${platforms[platform]}`, 'loading');
             }